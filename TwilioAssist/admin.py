@@ -0,0 +1,164 @@
+import io
+from flask import Blueprint, current_app, render_template, request, jsonify, stream_with_context
+from sqlalchemy import select, func
+from sqlalchemy.orm import joinedload
+from app import db
+from database import replica_reads, reads_from_replica
+
+# Create blueprint
+admin_bp = Blueprint('admin', __name__)
+
+def catalog_etag():
+    """ETag shared by the catalog APIs; changes whenever a product or category is written"""
+    from catalog import read_version
+    return f"catalog-{read_version(db.session)}"
+
+def cached(response, etag):
+    # Clients may keep the response but must revalidate it with If-None-Match
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def not_modified(etag):
+    return cached(current_app.response_class(status=304), etag)
+
+@admin_bp.route('/')
+def index():
+    """Main page showing chatbot information"""
+    return render_template('index.html')
+
+@admin_bp.route('/admin')
+@reads_from_replica
+def admin():
+    """Admin panel for managing products and categories"""
+    from models import Product, Category
+    # Products are paged in by admin.js from /api/products
+    product_count = db.session.execute(select(func.count(Product.id))).scalar()
+    categories = Category.query.order_by(Category.id).all()
+    return render_template('admin.html', product_count=product_count, categories=categories)
+
+@admin_bp.route('/api/products', methods=['GET', 'POST'])
+def api_products():
+    """API endpoint for managing products"""
+    from models import Product
+    
+    if request.method == 'GET':
+        with replica_reads():
+            etag = catalog_etag()
+            if request.if_none_match.contains(etag):
+                return not_modified(etag)
+
+            query = select(Product).options(joinedload(Product.category))
+            if request.args.get('category_id'):
+                query = query.where(Product.category_id == request.args.get('category_id', type=int))
+            if request.args.get('active') is not None:
+                query = query.where(Product.is_active == (request.args['active'].lower() in ('1', 'true', 'yes')))
+            after_id = request.args.get('after_id', 0, type=int)
+            limit = min(request.args.get('limit', 50, type=int), 500)
+            products = db.session.execute(
+                query.where(Product.id > after_id).order_by(Product.id).limit(limit)
+            ).scalars().all()
+
+        response = jsonify({
+            'products': [{
+                'id': p.id,
+                'name': p.name,
+                'price': p.price,
+                'description': p.description,
+                'is_active': p.is_active,
+                'category_id': p.category_id,
+                'category_name': p.category.name if p.category else None
+            } for p in products],
+            'next_after_id': products[-1].id if len(products) == limit else None,
+        })
+        return cached(response, etag)
+    
+    elif request.method == 'POST':
+        data = request.get_json()
+        product = Product(
+            name=data['name'],
+            price=data['price'],
+            description=data['description'],
+            category_id=data['category_id']
+        )
+        db.session.add(product)
+        db.session.commit()
+        return jsonify({'success': True, 'id': product.id})
+
+@admin_bp.route('/api/stats', methods=['GET'])
+def api_stats():
+    """Dashboard statistics from incrementally maintained counters"""
+    from stats import get_stats
+    return jsonify(get_stats(
+        hours=min(request.args.get('hours', 24, type=int), 24 * 7),
+        active_minutes=request.args.get('active_minutes', 30, type=int),
+    ))
+
+@admin_bp.route('/api/categories', methods=['GET'])
+@reads_from_replica
+def api_categories():
+    """API endpoint for getting categories"""
+    from models import Category
+    etag = catalog_etag()
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+    categories = Category.query.order_by(Category.id).all()
+    return cached(jsonify([{
+        'id': c.id,
+        'name': c.name,
+        'description': c.description
+    } for c in categories]), etag)
+
+@admin_bp.route('/api/conversations/<path:phone_number>/history', methods=['GET'])
+def api_conversation_history(phone_number):
+    """Stream a number's messages and orders in time order as JSON or JSON lines"""
+    from history import stream_history, parse_time, parse_cursor, HistoryError, FORMATS, CONTENT_TYPES, HISTORY_MAX_LIMIT
+    fmt = request.args.get('format', 'json')
+    if fmt not in FORMATS:
+        return jsonify({'error': f'format must be one of {", ".join(FORMATS)}'}), 400
+    try:
+        since = parse_time(request.args.get('since'), 'since')
+        until = parse_time(request.args.get('until'), 'until')
+        after = parse_cursor(request.args.get('after'))
+    except HistoryError as e:
+        return jsonify({'error': str(e)}), 400
+    # Without a limit the whole range is streamed
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+
+    def generate():
+        with replica_reads():
+            yield from stream_history(phone_number, fmt, since, until, after, limit)
+
+    return current_app.response_class(stream_with_context(generate()), content_type=CONTENT_TYPES[fmt])
+
+@admin_bp.route('/api/catalog/export', methods=['GET'])
+def api_catalog_export():
+    """Stream all products or categories as CSV or JSON lines"""
+    from catalog_io import export_lines, KINDS, FORMATS, CONTENT_TYPES
+    kind = request.args.get('kind', 'products')
+    fmt = request.args.get('format', 'csv')
+    if kind not in KINDS or fmt not in FORMATS:
+        return jsonify({'error': f'kind must be one of {", ".join(KINDS)} and format one of {", ".join(FORMATS)}'}), 400
+    etag = catalog_etag()
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+    response = current_app.response_class(stream_with_context(export_lines(kind, fmt)),
+                                          content_type=CONTENT_TYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}.{fmt}'
+    return cached(response, etag)
+
+@admin_bp.route('/api/catalog/import', methods=['POST'])
+def api_catalog_import():
+    """Insert or update products or categories from an uploaded CSV or JSON lines file"""
+    from catalog_io import import_catalog, format_from_name, KINDS, FORMATS
+    kind = request.args.get('kind', 'products')
+    upload = request.files.get('file')
+    # A multipart upload, or the file as the raw request body
+    stream = upload.stream if upload else request.stream
+    fmt = request.args.get('format') or format_from_name(upload.filename if upload else request.content_type)
+    if kind not in KINDS or fmt not in FORMATS:
+        return jsonify({'error': f'kind must be one of {", ".join(KINDS)} and format one of {", ".join(FORMATS)}'}), 400
+    report = import_catalog(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''), kind, fmt)
+    return jsonify(report.to_dict()), 200 if not report.error_count else 207
@@ -0,0 +1,239 @@
+"""Admission control for inbound messages, decided before any database work.
+
+Every phone number has a token bucket of PHONE_BURST messages refilled at
+PHONE_RATE_PER_MINUTE, and all numbers share one of GLOBAL_BURST refilled
+at GLOBAL_RATE_PER_SECOND. Buckets live in the process by default (so the
+global limit is per worker); with RATE_LIMIT_REDIS_URL they are shared by
+every worker and checked in one round trip. A throttled number gets a short
+notice once and empty replies after that, so a flood costs neither queries
+nor outbound messages; when the global bucket is empty everyone gets a busy
+notice, which costs no number its own tokens. Redis errors let messages
+through. A redelivered MessageSid this worker has already answered gets its
+stored reply without going through admission.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dialog import THROTTLED_REPLY, BUSY_REPLY
+from metrics import Counter
+from twiml import message_response, EMPTY_RESPONSE
+
+# 0 turns a bucket off
+PHONE_RATE_PER_MINUTE = float(os.environ.get("PHONE_RATE_PER_MINUTE", "20"))
+PHONE_BURST = int(os.environ.get("PHONE_BURST", "10"))
+GLOBAL_RATE_PER_SECOND = float(os.environ.get("GLOBAL_RATE_PER_SECOND", "200"))
+GLOBAL_BURST = int(os.environ.get("GLOBAL_BURST", "400"))
+# Phone buckets kept in memory; the least recently used go first
+RATE_LIMIT_MAX_PHONES = int(os.environ.get("RATE_LIMIT_MAX_PHONES", "100000"))
+# e.g. redis://localhost:6379/0 to share the buckets between workers
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL")
+RATE_LIMIT_REDIS_TIMEOUT = float(os.environ.get("RATE_LIMIT_REDIS_TIMEOUT", "0.05"))
+RATE_LIMIT_KEY_PREFIX = "ratelimit:"
+
+# Outcomes of a check
+ADMITTED, THROTTLED, STILL_THROTTLED, OVERLOADED = 0, 1, 2, 3
+
+WEBHOOK_REJECTED = Counter('webhook_rejected_total', "Inbound messages turned away before any database work", ('reason',))
+RATE_LIMIT_ERRORS = Counter('rate_limit_backend_errors_total', "Shared rate limit checks that failed and let the message through")
+
+
+class TokenBuckets:
+    """Token buckets by key, kept in this process"""
+
+    def __init__(self, rate, burst, max_keys=RATE_LIMIT_MAX_PHONES):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> [tokens, updated_at, rejected since the last token]
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, now):
+        """Take a token; returns ADMITTED, THROTTLED the first time it is refused, then STILL_THROTTLED"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now, False]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                bucket[2] = False
+                return ADMITTED
+            if bucket[2]:
+                return STILL_THROTTLED
+            bucket[2] = True
+            return THROTTLED
+
+    def refund(self, key):
+        """Give back a token taken by a message that was refused for another reason"""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket[0] = min(self.burst, bucket[0] + 1)
+
+
+class MemoryLimiter:
+    """Per-phone and global buckets of this process"""
+
+    def __init__(self, phone_rate, phone_burst, global_rate, global_burst):
+        self.phones = TokenBuckets(phone_rate, phone_burst) if phone_rate > 0 else None
+        self.total = TokenBuckets(global_rate, global_burst, max_keys=1) if global_rate > 0 else None
+
+    def check(self, phone_number):
+        now = time.monotonic()
+        if self.phones is not None:
+            result = self.phones.take(phone_number, now)
+            if result != ADMITTED:
+                return result
+        if self.total is not None and self.total.take('', now) != ADMITTED:
+            # Shedding load must not use up the sender's own allowance
+            if self.phones is not None:
+                self.phones.refund(phone_number)
+            return OVERLOADED
+        return ADMITTED
+
+    async def check_async(self, phone_number):
+        return self.check(phone_number)
+
+
+# KEYS: phone bucket, global bucket; ARGV: phone rate, burst, global rate, burst (rate 0 skips a bucket)
+TOKEN_BUCKET_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local function load(key, rate, burst)
+  local bucket = redis.call('HMGET', key, 'tokens', 'updated', 'rejected')
+  local tokens = tonumber(bucket[1]) or burst
+  local updated = tonumber(bucket[2]) or now
+  return math.min(burst, tokens + math.max(0, now - updated) * rate), bucket[3] == '1'
+end
+
+local function save(key, rate, burst, tokens, rejected)
+  redis.call('HSET', key, 'tokens', tostring(tokens), 'updated', tostring(now), 'rejected', rejected)
+  -- A bucket left alone until it is full again is the same as no bucket
+  redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+end
+
+local phone_rate, phone_burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local global_rate, global_burst = tonumber(ARGV[3]), tonumber(ARGV[4])
+local phone_tokens
+if phone_rate > 0 then
+  local tokens, rejected = load(KEYS[1], phone_rate, phone_burst)
+  if tokens < 1 then
+    save(KEYS[1], phone_rate, phone_burst, tokens, 1)
+    return rejected and 2 or 1
+  end
+  phone_tokens = tokens
+end
+-- The phone's token is only taken once the global bucket admits the message
+if global_rate > 0 then
+  local tokens = load(KEYS[2], global_rate, global_burst)
+  if tokens < 1 then
+    save(KEYS[2], global_rate, global_burst, tokens, 1)
+    return 3
+  end
+  save(KEYS[2], global_rate, global_burst, tokens - 1, 0)
+end
+if phone_tokens then
+  save(KEYS[1], phone_rate, phone_burst, phone_tokens - 1, 0)
+end
+return 0
+"""
+
+
+class RedisLimiter:
+    """Per-phone and global buckets shared by every worker through Redis"""
+
+    def __init__(self, url, phone_rate, phone_burst, global_rate, global_burst, timeout=RATE_LIMIT_REDIS_TIMEOUT):
+        # Only needed when the shared backend is configured
+        import redis
+        self.url = url
+        self.timeout = timeout
+        self.args = [phone_rate, phone_burst, global_rate, global_burst]
+        self.global_key = RATE_LIMIT_KEY_PREFIX + "global"
+        self.errors = (redis.RedisError, OSError)
+        client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+        self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        self._async_script = None
+        self._warned_at = 0.0
+
+    def _failed(self, e):
+        RATE_LIMIT_ERRORS.inc()
+        # One warning a minute is enough while Redis is down
+        if time.monotonic() - self._warned_at > 60:
+            self._warned_at = time.monotonic()
+            logging.warning(f"Rate limit check failed, letting messages through: {e!r}")
+        return ADMITTED
+
+    def check(self, phone_number):
+        try:
+            return int(self.script(keys=[RATE_LIMIT_KEY_PREFIX + phone_number, self.global_key], args=self.args))
+        except self.errors as e:
+            return self._failed(e)
+
+    async def check_async(self, phone_number):
+        if self._async_script is None:
+            # The asyncio client belongs to the loop that first uses it (one per ASGI worker)
+            import redis.asyncio
+            client = redis.asyncio.Redis.from_url(self.url, socket_timeout=self.timeout,
+                                                  socket_connect_timeout=self.timeout)
+            self._async_script = client.register_script(TOKEN_BUCKET_SCRIPT)
+        try:
+            return int(await self._async_script(keys=[RATE_LIMIT_KEY_PREFIX + phone_number, self.global_key],
+                                                args=self.args))
+        except self.errors as e:
+            return self._failed(e)
+
+
+def create_limiter(redis_url=RATE_LIMIT_REDIS_URL):
+    args = (PHONE_RATE_PER_MINUTE / 60, PHONE_BURST, GLOBAL_RATE_PER_SECOND, GLOBAL_BURST)
+    if redis_url:
+        return RedisLimiter(redis_url, *args)
+    return MemoryLimiter(*args)
+
+
+def rejection(result, phone_number):
+    """The TwiML for a refused message, or None when it was admitted"""
+    if result == ADMITTED:
+        return None
+    if result == OVERLOADED:
+        WEBHOOK_REJECTED.inc('global')
+        return message_response(BUSY_REPLY)
+    WEBHOOK_REJECTED.inc('phone')
+    if result == STILL_THROTTLED:
+        return EMPTY_RESPONSE
+    logging.info("Throttled sender", extra={'category': 'webhook.throttled', 'phone': phone_number})
+    return message_response(THROTTLED_REPLY)
+
+
+class Admission:
+    """Decides whether a message goes on to the conversation handler"""
+
+    def __init__(self, limiter=None):
+        self._limiter = limiter
+        self._lock = threading.Lock()
+
+    @property
+    def limiter(self):
+        if self._limiter is None:
+            with self._lock:
+                if self._limiter is None:
+                    self._limiter = create_limiter()
+        return self._limiter
+
+    def check(self, phone_number):
+        """None to go on, or the TwiML to answer a refused message with"""
+        return rejection(self.limiter.check(phone_number), phone_number)
+
+    async def check_async(self, phone_number):
+        return rejection(await self.limiter.check_async(phone_number), phone_number)
+
+
+admission = Admission()
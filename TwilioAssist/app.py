@@ -1,46 +1,80 @@
 import os
-import logging
-from flask import Flask, render_template, request, jsonify, flash, redirect, url_for
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
+from logs import configure_logging
+from database import RoutingSession, engine_options, replica_binds
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging (LOG_FORMAT=json for the queued production pipeline)
+configure_logging()
 
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={'class_': RoutingSession})
 
-# Create the app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+def create_app():
+    """Build the application without touching the database (see init_db)"""
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-change-in-production")
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
 
-# Configure the database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///chatbot.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+    # Configure the database
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///chatbot.db")
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
+    # Read replicas, if any (see database.py)
+    app.config["SQLALCHEMY_BINDS"] = replica_binds()
 
-# Initialize the app with the extension
-db.init_app(app)
+    # Initialize the app with the extension
+    db.init_app(app)
 
-with app.app_context():
-    # Import models to ensure tables are created
-    import models
+    # Import models so the metadata knows every table
+    import models  # noqa: F401
+    from message_log import message_log
+    from stats import stats_buffer
+    from sessions import session_sweeper
+    from admin import admin_bp
     from chatbot import chatbot_bp
-    
+    from broadcast import broadcast_bp
+    from orders import orders_bp
+    from commands import commands_bp
+    import metrics
+    import database
+
     # Register blueprints
+    app.register_blueprint(admin_bp)
     app.register_blueprint(chatbot_bp)
-    
-    # Create all tables
+    app.register_blueprint(broadcast_bp)
+    app.register_blueprint(orders_bp)
+    app.register_blueprint(commands_bp)
+    app.register_blueprint(metrics.metrics_bp)
+    metrics.init_app(app)
+    database.init_app(app, db)
+    message_log.init_app(app)
+    stats_buffer.init_app(app)
+    session_sweeper.init_app(app)
+
+    return app
+
+def dispose_engines(app):
+    """Forget pooled connections inherited from a parent process (call after fork)"""
+    with app.app_context():
+        for engine in db.engines.values():
+            # close=False leaves the parent's sockets alone
+            engine.dispose(close=False)
+
+def init_db():
+    """Create all tables, apply migrations and seed the catalog; needs an app context"""
+    from models import Product, Category, CatalogVersion
+    from catalog import CATALOG_VERSION_ID
+    from migrations import run_migrations
+
+    # Create all tables, then bring existing ones up to date
     db.create_all()
-    
+    run_migrations()
+
     # Initialize default products if none exist
-    from models import Product, Category
     if not Category.query.first():
         categories = [
             Category(name="Ebooks de Investimentos", description="Guias completos sobre investimentos"),
@@ -49,11 +83,11 @@ with app.app_context():
             Category(name="Apps Free Fire", description="Aplicativos e ferramentas para Free Fire"),
             Category(name="Outros", description="Outros produtos digitais")
         ]
-        
+
         for category in categories:
             db.session.add(category)
         db.session.commit()
-        
+
         # Add sample products
         products = [
             Product(name="Ebook: Primeiros Passos nos Investimentos", price=16.99, category_id=1, description="Guia completo para iniciantes em investimentos"),
@@ -63,59 +97,12 @@ with app.app_context():
             Product(name="Curso: Trading Avançado", price=199.99, category_id=3, description="Curso completo de trading profissional"),
             Product(name="App: FF Helper Pro", price=9.99, category_id=4, description="Ferramenta avançada para Free Fire"),
         ]
-        
+
         for product in products:
             db.session.add(product)
         db.session.commit()
 
-@app.route('/')
-def index():
-    """Main page showing chatbot information"""
-    return render_template('index.html')
-
-@app.route('/admin')
-def admin():
-    """Admin panel for managing products and categories"""
-    from models import Product, Category
-    products = Product.query.all()
-    categories = Category.query.all()
-    return render_template('admin.html', products=products, categories=categories)
-
-@app.route('/api/products', methods=['GET', 'POST'])
-def api_products():
-    """API endpoint for managing products"""
-    from models import Product
-    
-    if request.method == 'GET':
-        products = Product.query.all()
-        return jsonify([{
-            'id': p.id,
-            'name': p.name,
-            'price': p.price,
-            'description': p.description,
-            'category_id': p.category_id,
-            'category_name': p.category.name if p.category else None
-        } for p in products])
-    
-    elif request.method == 'POST':
-        data = request.get_json()
-        product = Product(
-            name=data['name'],
-            price=data['price'],
-            description=data['description'],
-            category_id=data['category_id']
-        )
-        db.session.add(product)
+    # Make sure the shared catalog version row exists
+    if not db.session.get(CatalogVersion, CATALOG_VERSION_ID):
+        db.session.add(CatalogVersion(id=CATALOG_VERSION_ID, version=0))
         db.session.commit()
-        return jsonify({'success': True, 'id': product.id})
-
-@app.route('/api/categories', methods=['GET'])
-def api_categories():
-    """API endpoint for getting categories"""
-    from models import Category
-    categories = Category.query.all()
-    return jsonify([{
-        'id': c.id,
-        'name': c.name,
-        'description': c.description
-    } for c in categories])
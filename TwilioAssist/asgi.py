@@ -0,0 +1,202 @@
+"""ASGI entry point: `uvicorn asgi:app --workers 4`.
+
+POST /webhook and POST /send-message are served on the event loop. The
+conversation code is the one gunicorn runs: it is called through
+AsyncSession.run_sync, which hands it an ordinary Session (bound here as
+db.session) whose statements are awaited on an async driver (aiosqlite,
+asyncpg), and Twilio is called with aiohttp. A message waiting on the
+database or on Twilio holds no thread, so one process can have thousands in
+flight; ASGI_DB_POOL_SIZE + ASGI_DB_MAX_OVERFLOW bound the connections they
+share. Every other route is the Flask app, run on a thread pool.
+"""
+import os
+import json
+import time
+import logging
+from urllib.parse import parse_qs
+from a2wsgi import WSGIMiddleware
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app import create_app, db
+from admission import admission
+from database import track_pool, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+from chatbot import stored_reply, reply_to, save_message, TWILIO_PHONE_NUMBER
+from dialog import ERROR_REPLY
+from locks import async_conversation_locks
+from metrics import stage, worker_metrics, METRICS_ENABLED, WEBHOOK_MESSAGES, HTTP_REQUEST_SECONDS
+from sessions import session_sweeper
+from twiml import message_response
+import twilio_client
+
+# Defaults to DATABASE_URL with its async driver
+ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL")
+# Ignored for SQLite, which takes one writer at a time: there the pool is one
+# connection the requests queue for, since more would only time out on its lock
+ASGI_DB_POOL_SIZE = int(os.environ.get("ASGI_DB_POOL_SIZE", "10"))
+ASGI_DB_MAX_OVERFLOW = int(os.environ.get("ASGI_DB_MAX_OVERFLOW", "20"))
+# Threads serving the Flask routes (admin, APIs, metrics)
+ASGI_WSGI_THREADS = int(os.environ.get("ASGI_WSGI_THREADS", "10"))
+
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg', 'postgres': 'postgresql+asyncpg'}
+
+
+def async_url(url):
+    """The same database with its async driver"""
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for {backend} databases; set ASYNC_DATABASE_URL")
+    query = dict(url.query)
+    # asyncpg spells libpq's sslmode as ssl
+    if 'sslmode' in query:
+        query['ssl'] = query.pop('sslmode')
+    return url.set(drivername=ASYNC_DRIVERS[backend], query=query)
+
+
+def with_session(sync_session, fn, *args):
+    """Call fn with db.session resolving to the session run_sync passed in"""
+    db.session.registry.set(sync_session)
+    try:
+        return fn(*args)
+    finally:
+        db.session.registry.clear()
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def json_response(data, status=200):
+    # Same bytes as Flask's jsonify outside debug mode
+    return status, 'application/json', (json.dumps(data, separators=(',', ':'), sort_keys=True) + "\n").encode()
+
+
+class AsgiApp:
+    """The webhook on asyncio, with the rest of the Flask app mounted behind it"""
+
+    def __init__(self, flask_app, database_url=ASYNC_DATABASE_URL):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)
+        if database_url is None:
+            # The URL Flask-SQLAlchemy resolved, so relative SQLite paths match
+            with flask_app.app_context():
+                database_url = async_url(db.engine.url)
+        database_url = make_url(database_url)
+        if database_url.get_backend_name() == 'sqlite':
+            pool_size, max_overflow = 1, 0
+        else:
+            pool_size, max_overflow = ASGI_DB_POOL_SIZE, ASGI_DB_MAX_OVERFLOW
+        self.engine = create_async_engine(database_url, pool_size=pool_size, max_overflow=max_overflow,
+                                          pool_timeout=DB_POOL_TIMEOUT, pool_recycle=DB_POOL_RECYCLE,
+                                          pool_pre_ping=DB_POOL_PRE_PING)
+        track_pool('asgi', self.engine.sync_engine)
+        self.sessions = async_sessionmaker(self.engine)
+        self.routes = {
+            ('POST', '/webhook'): self.webhook,
+            ('POST', '/send-message'): self.send_message,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        route = self.routes.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+        if route is None:
+            return await self.wsgi(scope, receive, send)
+
+        started = time.perf_counter()
+        body = await read_body(receive)
+        with self.flask_app.app_context():
+            status, content_type, content = await route(body)
+        await send({'type': 'http.response.start', 'status': status, 'headers': [
+            (b'content-type', content_type.encode()),
+            (b'content-length', str(len(content)).encode()),
+        ]})
+        await send({'type': 'http.response.body', 'body': content})
+        if METRICS_ENABLED:
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, scope['path'], scope['method'], str(status))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                twilio_client.open_async_client()
+                # Under Flask the first request starts the sweeper; webhooks here never reach Flask
+                if session_sweeper.app is not None:
+                    session_sweeper._ensure_started()
+                worker_metrics._ensure_started()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await twilio_client.close_async_client()
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def run(self, fn, *args):
+        """Call a sync function of the app in its own async session"""
+        async with self.sessions() as session:
+            return await session.run_sync(with_session, fn, *args)
+
+    async def webhook(self, body):
+        """Handle incoming WhatsApp messages from Twilio, as chatbot.webhook does"""
+        try:
+            with stage('parse'):
+                form = parse_qs(body.decode('utf-8', 'replace'), keep_blank_values=True)
+                phone_number = form.get('From', [''])[0].replace('whatsapp:', '')
+                message_body = form.get('Body', [''])[0].strip()
+                message_sid = form.get('MessageSid', [None])[0]
+
+            if message_sid:
+                stored = stored_reply(message_sid, phone_number, cached_only=True)
+                if stored is not None:
+                    return 200, 'text/html; charset=utf-8', stored
+
+            with stage('admit'):
+                rejected = await admission.check_async(phone_number)
+            if rejected is not None:
+                return 200, 'text/html; charset=utf-8', rejected
+
+            if message_sid:
+                stored = await self.run(stored_reply, message_sid, phone_number)
+                if stored is not None:
+                    return 200, 'text/html; charset=utf-8', stored
+
+            logging.info("Received message", extra={'category': 'webhook.message', 'phone': phone_number, 'body': message_body})
+
+            async with async_conversation_locks.hold(phone_number):
+                twiml = await self.run(reply_to, phone_number, message_body, message_sid)
+
+        except Exception as e:
+            logging.error("Error processing webhook: %s", e, extra={'category': 'webhook.error'}, exc_info=True)
+            WEBHOOK_MESSAGES.inc('error')
+            twiml = message_response(ERROR_REPLY)
+        return 200, 'text/html; charset=utf-8', twiml
+
+    async def send_message(self, body):
+        """Send message via Twilio (for testing or admin use)"""
+        try:
+            data = json.loads(body)
+            phone_number = data.get('phone_number')
+            message = data.get('message')
+
+            client = twilio_client.get_async_client()
+            if not client:
+                return json_response({'error': 'Twilio not configured'}, 400)
+
+            twilio_message = await client.messages.create_async(
+                body=message,
+                from_=f'whatsapp:{TWILIO_PHONE_NUMBER}',
+                to=f'whatsapp:{phone_number}'
+            )
+            await self.run(save_message, phone_number, message, False)
+            return json_response({'success': True, 'message_sid': twilio_message.sid})
+
+        except Exception as e:
+            logging.error("Error sending message: %s", e, extra={'category': 'send.error'}, exc_info=True)
+            return json_response({'error': str(e)}, 500)
+
+
+app = AsgiApp(create_app())
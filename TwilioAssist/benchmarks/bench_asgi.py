@@ -0,0 +1,174 @@
+"""Sync (gunicorn) against async (uvicorn asgi:app) serving under many in-flight requests.
+
+Starts each server in turn with the same number of worker processes, a
+fresh copy of the database and a local fake Twilio with --latency per send,
+then, with --concurrency requests in flight from one aiohttp client:
+
+  webhook  --phones customers walk the bench_webhook.py scenarios
+  send     --sends POST /send-message calls, each waiting on fake Twilio
+
+and reports throughput and latency percentiles per server and phase. A
+sync worker holds its process for the whole Twilio call, so the send phase
+shows the gap most; the webhook phase is bound by the database (SQLite
+serializes writers, use --database-url with PostgreSQL for a fairer run).
+
+    python benchmarks/bench_asgi.py --workers 2 --concurrency 200 --latency 0.2
+    python benchmarks/bench_asgi.py --database-url postgresql://localhost/bench_chatbot --output asgi.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_webhook import (  # noqa: E402
+    SCENARIOS, twilio_form, percentile, disable_rate_limits, init_database, start_server, git_revision,
+)
+from fake_twilio import start_fake_twilio  # noqa: E402
+
+SERVERS = ('gunicorn', 'uvicorn')
+
+
+def summarize(latencies, errors, elapsed):
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 2),
+        'throughput_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'max_ms': round(latencies[-1] * 1000, 1) if latencies else 0.0,
+    }
+
+
+async def timed_post(session, url, latencies, **kwargs):
+    """POST and record the latency; returns the body, or None on an error"""
+    import aiohttp
+    start = time.perf_counter()
+    try:
+        async with session.post(url, **kwargs) as response:
+            content = await response.read()
+            ok = response.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        content, ok = None, False
+    latencies.append(time.perf_counter() - start)
+    return content if ok else None
+
+
+async def webhook_phase(session, url, phones, concurrency):
+    names = list(SCENARIOS)
+    latencies, errors = [], 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def customer(index):
+        nonlocal errors
+        phone = f"+55118{index:08d}"
+        async with slots:
+            # A customer's messages go one after the other, as on WhatsApp
+            for step, body in enumerate(SCENARIOS[names[index % len(names)]]):
+                content = await timed_post(session, url + '/webhook', latencies,
+                                           data=twilio_form(phone, body, f"SM{index:016d}{step:016d}"))
+                if content is None or b'ocorreu um erro' in content:
+                    errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(customer(i) for i in range(phones)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def send_phase(session, url, sends, concurrency):
+    latencies, errors = [], 0
+    slots = asyncio.Semaphore(concurrency)
+
+    async def send(index):
+        nonlocal errors
+        async with slots:
+            content = await timed_post(session, url + '/send-message', latencies,
+                                       json={'phone_number': f"+55117{index:08d}", 'message': "Teste de envio"})
+        if content is None or b'"success":true' not in content:
+            errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(sends)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+async def drive(url, args):
+    import aiohttp
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        return {
+            'webhook': await webhook_phase(session, url, args.phones, args.concurrency),
+            'send': await send_phase(session, url, args.sends, args.concurrency),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="defaults to a fresh temporary SQLite file per server")
+    parser.add_argument('--servers', nargs='+', choices=SERVERS, default=list(SERVERS))
+    parser.add_argument('--workers', type=int, default=2, help="worker processes of each server")
+    parser.add_argument('--phones', type=int, default=300, help="simulated customers in the webhook phase")
+    parser.add_argument('--sends', type=int, default=200, help="POST /send-message calls in the send phase")
+    parser.add_argument('--concurrency', type=int, default=200, help="requests in flight")
+    parser.add_argument('--latency', type=float, default=0.2, help="fake Twilio latency in seconds")
+    parser.add_argument('--timeout', type=float, default=120, help="client timeout per request")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    disable_rate_limits()
+    fake = start_fake_twilio(latency=args.latency)
+    env = dict(os.environ, TWILIO_ACCOUNT_SID='ACbench', TWILIO_AUTH_TOKEN='bench',
+               TWILIO_PHONE_NUMBER='+15550000000', TWILIO_API_BASE_URL=fake.url,
+               LOG_LEVEL='WARNING', MESSAGE_LOG_MODE='sync')
+    template = None
+    if not args.database_url:
+        # Every server starts from the same freshly seeded SQLite file
+        template = os.path.join(tempfile.mkdtemp(), "template.db")
+        init_database("sqlite:///" + template)
+    else:
+        init_database(args.database_url)
+
+    results = {}
+    for kind in args.servers:
+        database_url = args.database_url
+        if template:
+            path = os.path.join(os.path.dirname(template), f"{kind}.db")
+            shutil.copyfile(template, path)
+            database_url = "sqlite:///" + path
+        server, url = start_server(kind, args.workers, database_url, env=env)
+        try:
+            results[kind] = asyncio.run(drive(url, args))
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{kind}: {json.dumps(results[kind])}", file=sys.stderr)
+
+    report = {
+        'benchmark': 'asgi',
+        'revision': git_revision(),
+        'created_at': datetime.utcnow().isoformat(),
+        'database': (args.database_url or 'sqlite').split(':', 1)[0],
+        'workers': args.workers,
+        'phones': args.phones,
+        'sends': args.sends,
+        'concurrency': args.concurrency,
+        'twilio_latency': args.latency,
+        'results': results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Customer latency on POST /webhook while a few numbers flood it.
+
+Runs the bench_webhook.py scenarios for --phones customers in-process while
+--spammers threads post --flood-rate messages a second from --flood-numbers
+numbers (falling behind when the server cannot keep up),
+once with admission control off and once with the per-phone and global
+buckets of admission.py, and reports the customers' latency percentiles,
+the flood messages sent and the SQL statements they cost.
+
+    python benchmarks/bench_flood.py --phones 100 --spammers 4 --flood-rate 200
+    python benchmarks/bench_flood.py --database-url postgresql://localhost/bench_chatbot --output flood.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_webhook import (  # noqa: E402
+    FlaskTarget, twilio_form, run, disable_rate_limits, init_database, git_revision,
+)
+
+MODES = ('off', 'on')
+
+
+def flood(target, numbers, rate, stop, sent):
+    """Post from the given numbers round-robin at rate a second until stop is set"""
+    count = 0
+    next_at = time.perf_counter()
+    while not stop.is_set():
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        next_at += 1 / rate
+        phone = numbers[count % len(numbers)]
+        target.post(twilio_form(phone, "spam", f"SMflood{threading.get_ident()}{count:012d}"))
+        count += 1
+    sent.append(count)
+
+
+def run_mode(target, limiter, args, offset):
+    import admission
+    admission.admission._limiter = limiter
+    numbers = [f"+55113{i:08d}" for i in range(args.flood_numbers)]
+    stop = threading.Event()
+    sent = []
+    spammers = [threading.Thread(target=flood, args=(target, numbers, args.flood_rate / args.spammers, stop, sent)) for _ in range(args.spammers)]
+    for thread in spammers:
+        thread.start()
+    statements = target.statements
+    try:
+        result = run(target, args.phones, args.concurrency, offset)
+    finally:
+        stop.set()
+        for thread in spammers:
+            thread.join()
+    result['flood_messages'] = sum(sent)
+    result['sql_statements'] = target.statements - statements
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="defaults to a fresh temporary SQLite file")
+    parser.add_argument('--phones', type=int, default=100, help="simulated customers")
+    parser.add_argument('--concurrency', type=int, default=4, help="customers in flight")
+    parser.add_argument('--spammers', type=int, default=4, help="threads flooding the webhook")
+    parser.add_argument('--flood-rate', type=float, default=200, help="flood messages a second, all spammers together")
+    parser.add_argument('--flood-numbers', type=int, default=2, help="numbers the flood comes from")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    disable_rate_limits()
+    database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    init_database(database_url)
+    target = FlaskTarget(database_url)
+
+    import admission
+    limiters = {
+        'off': admission.MemoryLimiter(0, 0, 0, 0),
+        'on': admission.MemoryLimiter(20 / 60, 10, 200, 400),
+    }
+    results = {}
+    for index, mode in enumerate(MODES):
+        # Fresh customers for each mode
+        results[mode] = run_mode(target, limiters[mode], args, index * args.phones)
+        print(f"{mode}: {json.dumps(results[mode])}", file=sys.stderr)
+
+    report = {
+        'benchmark': 'flood',
+        'revision': git_revision(),
+        'created_at': datetime.utcnow().isoformat(),
+        'database': database_url.split(':', 1)[0],
+        'phones': args.phones,
+        'concurrency': args.concurrency,
+        'spammers': args.spammers,
+        'flood_rate': args.flood_rate,
+        'flood_numbers': args.flood_numbers,
+        'results': results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
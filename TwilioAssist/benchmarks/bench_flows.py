@@ -0,0 +1,87 @@
+"""Per-message dispatch cost of the conversation flow engine.
+
+Runs scripted conversations through dialog.chat_engine with in-memory
+services (no Flask, no database), then repeats with a few hundred extra
+synthetic states registered to show dispatch cost does not grow with the flow.
+
+    python benchmarks/bench_flows.py --messages 200000
+"""
+import os
+import sys
+import time
+import argparse
+from collections import namedtuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flows import Session, Step  # noqa: E402
+from dialog import chat_flow, chat_engine  # noqa: E402
+
+FakeProduct = namedtuple('FakeProduct', ['id', 'category_id'], defaults=(1,))
+
+SCRIPTS = [
+    ["oi", "1", "2", "1", "Maria"],
+    ["menu", "5", "3", "João"],
+    ["oi", "5", "5", "Ana", "12,50"],
+    ["oi", "2", "1", "2", "voltar", "voltar", "ajuda", "xyz"],
+    ["buscar ebook", "1", "3", "ebook", "voltar"],
+]
+
+
+class FakeServices:
+    def category_text(self, category_id):
+        return f"category {category_id}"
+
+    def category_products(self, category_id):
+        return [FakeProduct(category_id * 10 + i) for i in range(3)]
+
+    def product_text(self, product_id):
+        return f"product {product_id}"
+
+    def search_products(self, query):
+        return [FakeProduct(7)] if 'ebook' in query.lower() else []
+
+    def search_text(self, query, products):
+        return f"{len(products)} results for {query}"
+
+    def place_order(self, phone_number, product_id, customer_name):
+        return f"order {product_id} for {customer_name}"
+
+
+def apply(session, step):
+    return session._replace(current_state=step.state, **step.updates)
+
+
+def run(engine, messages):
+    services = FakeServices()
+    session = Session('main_menu', None, None, None)
+    inputs = [text for script in SCRIPTS for text in script]
+    start = time.perf_counter()
+    for i in range(messages):
+        session = apply(session, engine.dispatch(session, inputs[i % len(inputs)], "+5511999999999", services))
+    return (time.perf_counter() - start) / messages * 1e9
+
+
+def with_extra_states(count):
+    flow = chat_flow.copy()
+    for n in range(count):
+        state = f'extra_{n}'
+        flow.option(state, *[str(i) for i in range(1, 10)])(lambda ctx: Step('main_menu', 'x'))
+        flow.fallback(state)(lambda ctx: Step(ctx.state, 'y'))
+    return flow.compile()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--extra-states', type=int, default=500)
+    args = parser.parse_args()
+
+    base = run(chat_engine, args.messages)
+    extended = run(with_extra_states(args.extra_states), args.messages)
+    print(f"{len(chat_engine.states)} states: {base:8.0f} ns/message")
+    print(f"{len(chat_engine.states) + args.extra_states} states: {extended:8.0f} ns/message")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Streaming a long conversation history: throughput and peak memory.
+
+Seeds one number with --messages messages (and an order every
+--order-every messages) on a scratch database, then streams its history
+through history.stream_history for growing time ranges and reports events
+per second and the peak Python memory of each run, which should stay flat
+as the range grows.
+
+    python benchmarks/bench_history.py --messages 200000
+    python benchmarks/bench_history.py --database-url postgresql://localhost/bench_chatbot --format json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_webhook import init_database, git_revision  # noqa: E402
+
+PHONE = "+5511987650000"
+START = datetime(2024, 1, 1)
+
+
+def seed(messages, order_every, batch=10000):
+    from sqlalchemy import insert
+    from app import db
+    from models import Message, Order
+    for first in range(0, messages, batch):
+        db.session.execute(insert(Message), [{
+            'phone_number': PHONE,
+            'message_body': f"Mensagem {i} do histórico de teste",
+            'is_incoming': i % 2 == 0,
+            'timestamp': START + timedelta(seconds=i),
+        } for i in range(first, min(first + batch, messages))])
+    if order_every:
+        db.session.execute(insert(Order), [{
+            'phone_number': PHONE, 'product_id': 1, 'status': 'paid',
+            'created_at': START + timedelta(seconds=i),
+        } for i in range(0, messages, order_every)])
+    db.session.commit()
+
+
+def stream(fmt, seconds):
+    from history import stream_history
+    tracemalloc.start()
+    start = time.perf_counter()
+    events = 0
+    size = 0
+    for chunk in stream_history(PHONE, fmt, until=START + timedelta(seconds=seconds)):
+        size += len(chunk)
+        events += chunk.count('"type":')
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'events': events,
+        'seconds': round(elapsed, 3),
+        'events_per_s': round(events / elapsed) if elapsed else 0,
+        'output_kb': size // 1024,
+        'peak_memory_kb': peak // 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="defaults to a fresh temporary SQLite file")
+    parser.add_argument('--messages', type=int, default=100000)
+    parser.add_argument('--order-every', type=int, default=50, help="one order per this many messages (0 for none)")
+    parser.add_argument('--format', choices=['json', 'ndjson'], default='ndjson')
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "history.db")
+    init_database(database_url)
+    os.environ["DATABASE_URL"] = database_url
+    from app import create_app
+    app = create_app()
+
+    results = []
+    with app.test_request_context():
+        seed(args.messages, args.order_every)
+        for fraction in (0.01, 0.1, 1.0):
+            seconds = max(1, int(args.messages * fraction))
+            result = stream(args.format, seconds)
+            results.append(result)
+            print(f"{seconds} messages: {json.dumps(result)}", file=sys.stderr)
+
+    report = {
+        'benchmark': 'history',
+        'revision': git_revision(),
+        'created_at': datetime.utcnow().isoformat(),
+        'database': database_url.split(':', 1)[0],
+        'messages': args.messages,
+        'format': args.format,
+        'results': results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
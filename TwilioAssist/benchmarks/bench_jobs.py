@@ -0,0 +1,130 @@
+"""Order pipeline throughput: paid orders through the job workers to delivery.
+
+Creates --orders pending orders, queues an `order.paid` job for each, and
+starts --processes `flask --app main run-jobs --threads N` workers against a
+local fake Twilio (see fake_twilio.py). It waits until every order is
+delivered, then reports orders per second, and fails if any customer got the
+delivery message other than exactly once.
+
+    python benchmarks/bench_jobs.py --orders 2000 --processes 2 --threads 4 --latency 0.05
+    python benchmarks/bench_jobs.py --database-url postgresql://localhost/bench_chatbot --processes 4
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_webhook import APP_DIR, git_revision, init_database  # noqa: E402
+from fake_twilio import start_fake_twilio  # noqa: E402
+
+sys.path.insert(0, APP_DIR)
+
+
+def seed_orders(database_url, count):
+    """Insert pending orders with an order.paid job each"""
+    from sqlalchemy import create_engine, insert, select, func
+    from models import Order, Job, Product
+    engine = create_engine(database_url)
+    with engine.begin() as conn:
+        product_id = conn.execute(select(func.min(Product.id))).scalar()
+        start = (conn.execute(select(func.max(Order.id))).scalar() or 0) + 1
+        now = datetime.utcnow()
+        conn.execute(insert(Order), [
+            {'id': start + i, 'phone_number': f"+55117{i:07d}", 'customer_name': f"Cliente {i}",
+             'product_id': product_id, 'status': 'pending', 'created_at': now}
+            for i in range(count)
+        ])
+        conn.execute(insert(Job), [
+            {'kind': 'order.paid', 'order_id': start + i, 'status': 'queued', 'attempts': 0, 'run_at': now}
+            for i in range(count)
+        ])
+    return engine, range(start, start + count)
+
+
+def delivered(engine, order_ids):
+    from sqlalchemy import select, func
+    from models import Order
+    with engine.connect() as conn:
+        return conn.execute(
+            select(func.count(Order.id))
+            .where(Order.id.between(order_ids[0], order_ids[-1]), Order.status == 'delivered')
+        ).scalar()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="defaults to a fresh temporary SQLite file")
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=2, help="worker threads per process")
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=1000, help="ORDER_MESSAGE_RATE per process")
+    parser.add_argument('--latency', type=float, default=0.02, help="fake Twilio latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of fake Twilio 429/500 answers")
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "jobs.db")
+    init_database(database_url)
+    engine, order_ids = seed_orders(database_url, args.orders)
+    fake = start_fake_twilio(latency=args.latency, error_rate=args.error_rate, seed=1)
+
+    env = dict(os.environ, DATABASE_URL=database_url, TWILIO_ACCOUNT_SID='ACbench', TWILIO_AUTH_TOKEN='bench',
+               TWILIO_PHONE_NUMBER='+15550000000', TWILIO_API_BASE_URL=fake.url,
+               JOB_BATCH_SIZE=str(args.batch_size), JOB_POLL_INTERVAL='0.1', JOB_RETRY_BACKOFF='0.2',
+               ORDER_MESSAGE_RATE=str(args.rate), LOG_LEVEL='WARNING')
+    start = time.perf_counter()
+    workers = [
+        subprocess.Popen(['flask', '--app', 'main', 'run-jobs', '--threads', str(args.threads)],
+                         cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL)
+        for _ in range(args.processes)
+    ]
+    try:
+        done = 0
+        while done < args.orders and time.perf_counter() - start < args.timeout:
+            time.sleep(0.2)
+            done = delivered(engine, order_ids)
+        elapsed = time.perf_counter() - start
+    finally:
+        for worker in workers:
+            worker.send_signal(signal.SIGTERM)
+        for worker in workers:
+            worker.wait()
+
+    deliveries = Counter(m['To'] for m in fake.messages)
+    duplicates = sum(1 for n in deliveries.values() if n > 1)
+    report = {
+        'benchmark': 'jobs',
+        'revision': git_revision(),
+        'created_at': datetime.utcnow().isoformat(),
+        'database': database_url.split(':', 1)[0],
+        'orders': args.orders,
+        'processes': args.processes,
+        'threads': args.threads,
+        'batch_size': args.batch_size,
+        'twilio_latency': args.latency,
+        'delivered': done,
+        'seconds': round(elapsed, 2),
+        'orders_per_second': round(done / elapsed, 1),
+        'twilio_responses': fake.responses,
+        'customers_messaged': len(deliveries),
+        'duplicate_deliveries': duplicates,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if done < args.orders or duplicates or len(deliveries) != args.orders:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Phone-number lookup latency against table size, before and after the indexes.
+
+Builds Conversation/Message/Order tables without the phone-number indexes,
+times the webhook-style lookups, applies the migrations and times them again.
+
+    python benchmarks/bench_phone_lookups.py --sizes 1000 10000 100000
+    python benchmarks/bench_phone_lookups.py --database-url postgresql://localhost/bench
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, select, insert, text  # noqa: E402
+from app import db  # noqa: E402
+from models import Conversation, Message, Order  # noqa: E402
+from migrations import run_migrations  # noqa: E402
+
+INDEXES = [
+    'ix_conversation_phone_number',
+    'ix_message_phone_number_timestamp',
+    'ix_order_phone_number_created_at',
+]
+
+QUERIES = {
+    'conversation': lambda phone: select(Conversation.id).where(Conversation.phone_number == phone),
+    'messages': lambda phone: select(Message.id).where(Message.phone_number == phone)
+        .order_by(Message.timestamp.desc()).limit(20),
+    'orders': lambda phone: select(Order.id).where(Order.phone_number == phone)
+        .order_by(Order.created_at.desc()),
+}
+
+
+def phone(i):
+    return f"+55119{i:08d}"
+
+
+def build(engine, size):
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for name in INDEXES:
+            conn.execute(text(f"DROP INDEX {name}"))
+        conn.execute(text("DELETE FROM schema_migration"))
+
+        now = datetime.utcnow()
+        conn.execute(insert(Conversation), [{'phone_number': phone(i)} for i in range(size)])
+        conn.execute(insert(Message), [
+            {'phone_number': phone(i % size), 'message_body': 'oi', 'is_incoming': True,
+             'timestamp': now - timedelta(seconds=i)}
+            for i in range(size * 4)
+        ])
+        conn.execute(insert(Order), [
+            {'phone_number': phone(i * 7 % size), 'product_id': 1, 'created_at': now - timedelta(minutes=i)}
+            for i in range(max(size // 5, 1))
+        ])
+
+
+def measure(engine, size, lookups):
+    rng = random.Random(size)
+    phones = [phone(rng.randrange(size)) for _ in range(lookups)]
+    results = {}
+    with engine.connect() as conn:
+        for name, query in QUERIES.items():
+            conn.execute(query(phones[0])).all()  # warm up
+            start = time.perf_counter()
+            for p in phones:
+                conn.execute(query(p)).all()
+            results[name] = (time.perf_counter() - start) / lookups * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--database-url', help="scratch database to use instead of a temporary SQLite file")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    rows = []
+    print(f"{'rows':>10} {'query':>13} {'before (us)':>12} {'after (us)':>11} {'speedup':>8}")
+    for size in args.sizes:
+        url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), f"bench_{size}.db")
+        engine = create_engine(url)
+        build(engine, size)
+        before = measure(engine, size, args.lookups)
+        run_migrations(engine)
+        after = measure(engine, size, args.lookups)
+        engine.dispose()
+
+        for name in QUERIES:
+            speedup = before[name] / after[name] if after[name] else float('inf')
+            print(f"{size:>10} {name:>13} {before[name]:>12.1f} {after[name]:>11.1f} {speedup:>7.1f}x")
+            rows.append({'rows': size, 'query': name, 'before_us': before[name], 'after_us': after[name]})
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
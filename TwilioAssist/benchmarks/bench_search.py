@@ -0,0 +1,176 @@
+"""Product search: index build, incremental update and query latency.
+
+Builds a synthetic catalog of --products products from Portuguese-looking
+words, then reports the time to build the index, to sync it after one
+product is added or changed, and p50/p99/max latency over a mix of queries
+(rare and common words, prefixes, accents, several words, no match). The
+first run of each query is reported apart.
+
+Before timing, it checks search() against a brute-force scan of a small
+catalog after rounds of random adds, edits and removals, and exits non-zero
+if the result scores differ.
+
+    python benchmarks/bench_search.py --products 50000 --output search.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from catalog import CachedProduct  # noqa: E402
+from search import SearchIndex, product_terms, tokenize, MIN_PREFIX_LENGTH, PREFIX_FACTOR  # noqa: E402
+from bench_webhook import git_revision  # noqa: E402
+
+CATEGORIES = ["Ebooks de Investimentos", "Ebooks de Emagrecimento", "Cursos de Investimentos",
+              "Apps Free Fire", "Outros", "Cursos de Culinária", "Planilhas Financeiras", "Música"]
+COMMON = ["ebook", "curso", "guia", "completo", "avançado", "prático", "iniciantes", "app", "pro"]
+QUERIES = ["investimentos", "invest", "cetogênica", "CETOGENICA", "curso avançado", "ebook dieta",
+           "free fire", "planilha", "guia completo iniciantes", "zzzz", "ebook", "música", "trading ações"]
+
+
+def make_words(rng, count):
+    syllables = ["ba", "ce", "di", "fo", "gu", "la", "me", "ni", "po", "ra", "se", "ti", "vo", "ção", "ões", "ên"]
+    return ["".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(count)]
+
+
+def make_products(count, seed=1):
+    rng = random.Random(seed)
+    vocabulary = make_words(rng, 20000) + ["investimentos", "ações", "trading", "dieta", "cetogênica",
+                                           "exercícios", "planilha", "receitas", "free", "fire"]
+    products = []
+    for i in range(1, count + 1):
+        category_id = rng.randrange(len(CATEGORIES))
+        name = " ".join([rng.choice(COMMON)] + rng.sample(vocabulary, 3))
+        description = " ".join(rng.sample(COMMON, 2) + rng.sample(vocabulary, 6))
+        products.append(CachedProduct(i, name, description, round(rng.uniform(5, 300), 2),
+                                      category_id + 1, CATEGORIES[category_id]))
+    return products
+
+
+def brute_force(products, query, limit):
+    """Scores of the best products for a query, computed by scanning them all"""
+    words = list(dict.fromkeys(tokenize(query)))
+    per_word = []
+    for word in words:
+        scores = {}
+        for product in products:
+            best = 0.0
+            for term, weight in product_terms(product).items():
+                if term == word:
+                    best = max(best, weight)
+                elif len(word) >= MIN_PREFIX_LENGTH and term.startswith(word):
+                    best = max(best, weight * PREFIX_FACTOR)
+            if best:
+                scores[product.id] = best
+        if scores:
+            per_word.append(scores)
+    if not per_word:
+        return []
+    common = set(per_word[0]).intersection(*per_word[1:])
+    return sorted((sum(s[pid] for s in per_word) for pid in common), reverse=True)[:limit]
+
+
+def check(rounds=20, size=300, limit=5, seed=2):
+    """Compare the index with brute force while the catalog changes under it"""
+    rng = random.Random(seed)
+    catalog = {p.id: p for p in make_products(size, seed)}
+    index = SearchIndex()
+    index.sync(catalog.values())
+    queries = QUERIES + ["ba", "cet", "ebo", "pro app", "curso de fire"]
+    mismatches = 0
+    for round_number in range(rounds):
+        for product in rng.sample(list(catalog.values()), 10):
+            del catalog[product.id]
+        for product in make_products(8, seed + round_number + 1):
+            new_id = max(catalog) + 1
+            catalog[new_id] = product._replace(id=new_id)
+        for product in rng.sample(list(catalog.values()), 5):
+            catalog[product.id] = product._replace(name=product.name + " trading")
+        index.sync(catalog.values())
+        for query in queries:
+            by_id = {p.id: p for p in catalog.values()}
+            found = index.search(query, limit)
+            expected = brute_force(catalog.values(), query, limit)
+            # Ties may come out in any order, so compare the scores of the results
+            got = sorted((brute_force([by_id[p.id]], query, 1) or [0])[0] for p in found)[::-1]
+            if expected and got != expected:
+                mismatches += 1
+                print(f"round {round_number} {query!r}: expected {expected}, got {got}")
+    return mismatches
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--products', type=int, default=50000)
+    parser.add_argument('--rounds', type=int, default=200, help="times each query is run")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    mismatches = check()
+    print(f"checked against brute force: {mismatches} mismatches", file=sys.stderr)
+    if mismatches:
+        sys.exit(1)
+
+    products = make_products(args.products)
+    index = SearchIndex()
+    start = time.perf_counter()
+    index.sync(products)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    # One product added and one renamed, as after a POST to /api/products
+    added = products + [CachedProduct(args.products + 1, "Ebook: Investindo em Ações", "Guia", 24.99, 1,
+                                      CATEGORIES[0])]
+    added[0] = added[0]._replace(name="Curso de trading para iniciantes")
+    start = time.perf_counter()
+    changed = index.sync(added)
+    sync_ms = (time.perf_counter() - start) * 1000
+    assert changed == 2 and index.search("investindo")[0].id == args.products + 1
+
+    latencies, cold = {}, {}
+    for query in QUERIES:
+        start = time.perf_counter()
+        index.search(query)
+        cold[query] = (time.perf_counter() - start) * 1e6
+        samples = []
+        for _ in range(args.rounds):
+            start = time.perf_counter()
+            index.search(query)
+            samples.append((time.perf_counter() - start) * 1e6)
+        latencies[query] = samples
+    everything = [s for samples in latencies.values() for s in samples]
+
+    report = {
+        'benchmark': 'search',
+        'revision': git_revision(),
+        'created_at': datetime.utcnow().isoformat(),
+        'products': args.products,
+        'build_ms': round(build_ms, 1),
+        'sync_two_changes_ms': round(sync_ms, 2),
+        'query_us': {
+            'p50': round(statistics.median(everything), 1),
+            'p99': round(percentile(everything, 0.99), 1),
+            'max': round(max(everything), 1),
+        },
+        'per_query_p50_us': {q: round(statistics.median(s), 1) for q, s in latencies.items()},
+        'per_query_first_us': {q: round(t, 1) for q, t in cold.items()},
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Cold start: time from import to the first answered webhook.
+
+Each run starts a fresh interpreter, imports main, and posts one webhook
+through the Flask test client. It reports the import time, the first-request
+time (which loads the catalog and templates) and the total. With --serve it
+also times a gunicorn from process start to the first 200 response, with and
+without --preload.
+
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --serve gunicorn --workers 4 --output startup.json
+    python benchmarks/bench_startup.py --database-url postgresql://localhost/bench_chatbot
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_webhook import APP_DIR, git_revision, init_database, start_server, twilio_form  # noqa: E402
+
+CHILD = """
+import json, time
+start = time.perf_counter()
+from main import app
+imported = time.perf_counter()
+response = app.test_client().post('/webhook', data=json.loads(%r))
+done = time.perf_counter()
+assert response.status_code == 200 and b'ocorreu um erro' not in response.data
+print(json.dumps({'import_ms': (imported - start) * 1000, 'first_request_ms': (done - imported) * 1000}))
+"""
+
+
+def summarize(samples):
+    return {'median': statistics.median(samples), 'min': min(samples), 'max': max(samples)}
+
+
+def in_process(database_url, runs):
+    """Import-to-first-request in fresh interpreters"""
+    env = dict(os.environ, DATABASE_URL=database_url)
+    results = {'import_ms': [], 'first_request_ms': [], 'total_ms': []}
+    for i in range(runs):
+        form = json.dumps(twilio_form(f"+55116{i:08d}", "oi", f"SMstartup{i:026d}"))
+        output = subprocess.check_output([sys.executable, '-c', CHILD % form], cwd=APP_DIR, env=env,
+                                         stderr=subprocess.DEVNULL, text=True)
+        sample = json.loads(output.strip().splitlines()[-1])
+        results['import_ms'].append(sample['import_ms'])
+        results['first_request_ms'].append(sample['first_request_ms'])
+        results['total_ms'].append(sample['import_ms'] + sample['first_request_ms'])
+    return {name: summarize(samples) for name, samples in results.items()}
+
+
+def served(kind, workers, database_url, preload, runs):
+    """Process start to the first answered webhook on a gunicorn"""
+    import requests
+    samples = []
+    for i in range(runs):
+        start = time.perf_counter()
+        server, url = start_server(kind, workers, database_url, preload)
+        try:
+            form = twilio_form(f"+55115{i:08d}", "oi", f"SMserve{int(preload)}{i:025d}")
+            while True:
+                try:
+                    if requests.post(url + '/webhook', data=form, timeout=5).status_code == 200:
+                        break
+                except requests.ConnectionError:
+                    time.sleep(0.05)
+            samples.append((time.perf_counter() - start) * 1000)
+        finally:
+            server.terminate()
+            server.wait()
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="defaults to a fresh temporary SQLite file")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--serve', choices=['gunicorn'], help="also time a gunicorn start")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    args = parser.parse_args()
+
+    database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "startup.db")
+    init_database(database_url)
+
+    results = {'in_process': in_process(database_url, args.runs)}
+    if args.serve:
+        results['server'] = served(args.serve, args.workers, database_url, False, args.runs)
+        results['server_preload'] = served(args.serve, args.workers, database_url, True, args.runs)
+
+    report = {
+        'benchmark': 'startup',
+        'revision': git_revision(),
+        'created_at': datetime.utcnow().isoformat(),
+        'database': database_url.split(':', 1)[0],
+        'runs': args.runs,
+        'server': args.serve,
+        'workers': args.workers if args.serve else None,
+        'results': results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""TwiML serialization cost: twiml.py against twilio's MessagingResponse.
+
+Times both serializers, encoding included. That they return the same bytes
+is checked by tests/test_twiml.py.
+
+    python benchmarks/bench_twiml.py --iterations 100000
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from twilio.twiml.messaging_response import MessagingResponse  # noqa: E402
+from catalog import CachedProduct, render_product  # noqa: E402
+from dialog import MAIN_MENU  # noqa: E402
+from twiml import message_response  # noqa: E402
+
+
+def twilio_response(text):
+    response = MessagingResponse()
+    response.message(text)
+    # Encoded, as it goes out in the response body
+    return str(response).encode()
+
+
+def timed(fn, text, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(text)
+    return (time.perf_counter() - start) / iterations * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    dynamic = render_product(CachedProduct(1, "Ebook: Investindo em Ações", "Estratégias avançadas", 24.99, 1, "Ebooks"))
+    print(f"{'reply':18} {'MessagingResponse':>18} {'twiml':>10} {'speedup':>8}")
+    for label, text in (('static main menu', MAIN_MENU), ('dynamic product', dynamic)):
+        baseline = timed(twilio_response, text, args.iterations)
+        fast = timed(message_response, text, args.iterations)
+        print(f"{label:18} {baseline:15.0f} ns {fast:7.0f} ns {baseline / fast:7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
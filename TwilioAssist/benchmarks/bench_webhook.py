@@ -0,0 +1,280 @@
+"""Load test for POST /webhook with realistic Twilio payloads.
+
+Simulated customers walk through the purchase and donation flows. The
+"flask" target drives chatbot_bp in-process through the Flask test client
+and also counts SQL statements per message; the "http" target posts to a
+running server, or to a gunicorn (or uvicorn, for asgi.py) started by the
+harness with --serve.
+
+    python benchmarks/bench_webhook.py --phones 200 --concurrency 8
+    python benchmarks/bench_webhook.py --database-url postgresql://localhost/bench_chatbot
+    python benchmarks/bench_webhook.py --target http --serve gunicorn --workers 4 --output results.json
+    python benchmarks/bench_webhook.py --target http --serve uvicorn --workers 4
+    python benchmarks/bench_webhook.py --baseline results.json
+
+Use a scratch database: the runs create conversations and orders.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+SCENARIOS = {
+    'purchase': ["oi", "1", "1", "1", "Cliente Teste"],
+    'browse_and_buy': ["oi", "2", "voltar", "3", "1", "2", "1", "1", "Cliente Teste"],
+    'donation': ["oi", "5", "2", "Doador Teste"],
+    'custom_donation': ["menu", "5", "5", "Doador Teste", "12,50"],
+    'help': ["oi", "ajuda", "menu"],
+}
+
+
+def twilio_form(phone, body, sid):
+    """Form fields Twilio posts for an inbound WhatsApp message"""
+    return {
+        'SmsMessageSid': sid,
+        'NumMedia': '0',
+        'ProfileName': 'Cliente',
+        'SmsSid': sid,
+        'WaId': phone.lstrip('+'),
+        'SmsStatus': 'received',
+        'Body': body,
+        'To': 'whatsapp:+14155238886',
+        'NumSegments': '1',
+        'MessageSid': sid,
+        'AccountSid': 'AC' + '0' * 32,
+        'From': f'whatsapp:{phone}',
+        'ApiVersion': '2010-04-01',
+    }
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class FlaskTarget:
+    """Drives the real app in-process and counts SQL statements"""
+
+    def __init__(self, database_url):
+        os.environ["DATABASE_URL"] = database_url
+        from sqlalchemy import event
+        from app import create_app, db
+        self.app = app = create_app()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.statements = 0
+        with app.app_context():
+            engine = db.engine
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def count(conn, cursor, statement, parameters, context, executemany):
+            with self._lock:
+                self.statements += 1
+
+    def post(self, form):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post('/webhook', data=form)
+        return response.status_code, response.get_data()
+
+    def close(self):
+        pass
+
+
+class HttpTarget:
+    """Posts to a running server over HTTP"""
+
+    statements = None
+
+    def __init__(self, url):
+        import requests
+        self.url = url.rstrip('/') + '/webhook'
+        self._requests = requests
+        self._local = threading.local()
+
+    def post(self, form):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.post(self.url, data=form)
+        return response.status_code, response.content
+
+    def close(self):
+        pass
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def disable_rate_limits():
+    """Measure the handler rather than admission control (set the variables to override)"""
+    os.environ.setdefault("PHONE_RATE_PER_MINUTE", "0")
+    os.environ.setdefault("GLOBAL_RATE_PER_SECOND", "0")
+
+
+def init_database(database_url):
+    """Create and seed the schema, as `flask --app main init-db` does before a deploy"""
+    env = dict(os.environ, DATABASE_URL=database_url)
+    subprocess.run(['flask', '--app', 'main', 'init-db'], cwd=APP_DIR, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def start_server(kind, workers, database_url, preload=False, env=None):
+    """Start gunicorn (sync workers) or uvicorn (asgi.py) on a free port and wait until it answers"""
+    port = free_port()
+    env = dict(env or os.environ, DATABASE_URL=database_url)
+    if kind == 'uvicorn':
+        command = ['uvicorn', 'asgi:app', '--workers', str(workers), '--host', '127.0.0.1', '--port', str(port),
+                   '--log-level', 'warning']
+    else:
+        command = ['gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'main:app']
+    if preload and kind == 'gunicorn':
+        command.append('--preload')
+    process = subprocess.Popen(command, cwd=APP_DIR, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{kind} did not start")
+
+
+def run_customer(target, index, script, latencies, errors):
+    phone = f"+55119{index:08d}"
+    for step, body in enumerate(script):
+        sid = f"SM{index:016d}{step:016d}"
+        start = time.perf_counter()
+        status, content = target.post(twilio_form(phone, body, sid))
+        latencies.append(time.perf_counter() - start)
+        if status != 200 or b'ocorreu um erro' in content:
+            errors.append(status)
+
+
+def run(target, phones, concurrency, offset=0):
+    """Run phones customers, numbered from offset"""
+    names = list(SCENARIOS)
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [
+            pool.submit(run_customer, target, i, SCENARIOS[names[i % len(names)]], latencies, errors)
+            for i in range(offset, offset + phones)
+        ]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    messages = len(latencies)
+    return {
+        'messages': messages,
+        'errors': len(errors),
+        'seconds': elapsed,
+        'throughput_per_s': messages / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    for key in ('throughput_per_s', 'p50_ms', 'p95_ms', 'p99_ms', 'sql_statements_per_message'):
+        old, new = baseline.get(key), result.get(key)
+        if old and new is not None:
+            print(f"  {key:28} {old:10.2f} -> {new:10.2f} ({(new - old) / old * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=['flask', 'http'], default='flask')
+    parser.add_argument('--database-url', help="defaults to a fresh temporary SQLite file")
+    parser.add_argument('--url', help="base URL of a running server (http target)")
+    parser.add_argument('--serve', choices=['gunicorn', 'uvicorn'], help="start a server for the http target")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--preload', action='store_true', help="start gunicorn with --preload")
+    parser.add_argument('--phones', type=int, default=100, help="simulated customers")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--baseline', help="previous JSON output to compare against")
+    args = parser.parse_args()
+
+    disable_rate_limits()
+    database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    init_database(database_url)
+    server = None
+    if args.target == 'flask':
+        target = FlaskTarget(database_url)
+    else:
+        url = args.url
+        if args.serve:
+            server, url = start_server(args.serve, args.workers, database_url, args.preload)
+        if not url:
+            parser.error("--target http needs --url or --serve")
+        target = HttpTarget(url)
+
+    try:
+        result = run(target, args.phones, args.concurrency)
+    finally:
+        target.close()
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if target.statements is not None:
+        result['sql_statements_per_message'] = target.statements / result['messages']
+
+    report = {
+        'benchmark': 'webhook',
+        'revision': git_revision(),
+        'created_at': datetime.utcnow().isoformat(),
+        'target': args.target,
+        'server': args.serve,
+        'workers': args.workers if args.serve else None,
+        'preload': args.preload if args.serve else None,
+        'database': database_url.split(':', 1)[0],
+        'phones': args.phones,
+        'concurrency': args.concurrency,
+        'results': result,
+    }
+    print(json.dumps(report, indent=2))
+    if args.baseline:
+        print(f"Compared with {args.baseline}:")
+        compare(result, args.baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Catalog reads must go to the replica and everything else to the primary.
+
+Seeds a primary and a replica (by default two temporary SQLite files, the
+replica a copy of the primary), then renames every product on the replica
+only, so a reply shows which database served it. Drives the app in-process
+and checks, per database, the statements each step ran:
+
+  /api/products, /api/categories, /admin  read only from the replica
+  a webhook conversation                  writes only to the primary, shows replica products
+  POST /api/products                      runs only on the primary
+  SELECT ... FOR UPDATE, reads after a
+  catalog write in the same transaction   stay on the primary
+
+Exits non-zero on any failure.
+
+    python benchmarks/check_replicas.py
+    python benchmarks/check_replicas.py --database-url postgresql://localhost:5432/primary \\
+        --replica-url postgresql://localhost:5433/replica
+
+Two independent PostgreSQL databases can stand in for a primary and its
+replica; both are seeded and the replica's products renamed.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_webhook import FlaskTarget, disable_rate_limits, init_database, twilio_form  # noqa: E402
+
+MARKER = "[replica] "
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def mark_replica(replica_url):
+    from sqlalchemy import create_engine, text
+    engine = create_engine(replica_url)
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE product SET name = :marker || name"), {'marker': MARKER})
+    engine.dispose()
+
+
+class StatementLog:
+    """First keyword of every statement, by role"""
+
+    def __init__(self, engines):
+        from sqlalchemy import event
+        self.statements = {}
+        for key, engine in engines.items():
+            event.listen(engine, 'before_cursor_execute', self._recorder(key or 'primary'))
+
+    def _recorder(self, role):
+        def record(conn, cursor, statement, parameters, context, executemany):
+            keyword = statement.split(None, 1)[0].upper()
+            if 'FOR UPDATE' in statement.upper():
+                keyword += ' FOR UPDATE'
+            self.statements.setdefault(role, []).append(keyword)
+        return record
+
+    def take(self):
+        statements, self.statements = self.statements, {}
+        return statements
+
+
+def run(target, log):
+    from sqlalchemy import select
+    from app import db
+    from database import replica_reads
+    from models import Product
+    client = target.app.test_client()
+    failures = []
+
+    def check(name, ok, statements, detail=None):
+        if not ok:
+            failures.append({'check': name, 'statements': statements, 'detail': detail})
+
+    for path in ('/api/products', '/api/categories', '/admin'):
+        response = client.get(path)
+        statements = log.take()
+        check(f"GET {path}", response.status_code == 200 and not statements.get('primary')
+              and statements.get('replica0'), statements, response.status_code)
+        if path == '/api/products':
+            name = response.get_json()['products'][0]['name']
+            check("GET /api/products shows replica rows", name.startswith(MARKER), statements, name)
+
+    replies = []
+    for step, body in enumerate(["oi", "1", "1"]):
+        status, content = target.post(twilio_form("+5511999990001", body, f"SMreplica{step:026d}"))
+        replies.append(content.decode())
+    statements = log.take()
+    check("webhook writes only to the primary",
+          not any(s.startswith(WRITES) for s in statements.get('replica0', []))
+          and any(s.startswith(WRITES) for s in statements.get('primary', [])), statements)
+    check("webhook renders the catalog from the replica", MARKER in replies[-1], statements, replies[-1][-200:])
+
+    response = client.post('/api/products', json={'name': "Produto novo", 'price': 9.9,
+                                                  'description': "check", 'category_id': 1})
+    statements = log.take()
+    check("POST /api/products runs on the primary",
+          response.status_code == 200 and not statements.get('replica0'), statements, response.status_code)
+
+    with target.app.app_context(), replica_reads() as session:
+        session.execute(select(Product).where(Product.id == 1).with_for_update()).scalars().first()
+        statements = log.take()
+        check("FOR UPDATE stays on the primary", not statements.get('replica0'), statements)
+        session.rollback()
+
+        product = session.execute(select(Product).where(Product.id == 2)).scalar_one()
+        product.name = "Renomeado"
+        session.flush()
+        log.take()
+        name = session.execute(select(Product.name).where(Product.id == 2)).scalar_one()
+        statements = log.take()
+        check("reads after a catalog write stay on the primary",
+              name == "Renomeado" and not statements.get('replica0'), statements, name)
+        session.rollback()
+        db.session.remove()
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', help="primary; defaults to a fresh temporary SQLite file")
+    parser.add_argument('--replica-url', help="replica; defaults to a copy of the SQLite primary")
+    args = parser.parse_args()
+    if bool(args.database_url) != bool(args.replica_url):
+        parser.error("give both --database-url and --replica-url, or neither")
+
+    disable_rate_limits()
+    if args.database_url:
+        database_url, replica_url = args.database_url, args.replica_url
+        init_database(database_url)
+        init_database(replica_url)
+    else:
+        directory = tempfile.mkdtemp()
+        database_url = "sqlite:///" + os.path.join(directory, "primary.db")
+        replica_url = "sqlite:///" + os.path.join(directory, "replica.db")
+        init_database(database_url)
+        shutil.copyfile(os.path.join(directory, "primary.db"), os.path.join(directory, "replica.db"))
+    mark_replica(replica_url)
+
+    # Read when database.py is imported, so before the app exists
+    os.environ["DATABASE_REPLICA_URLS"] = replica_url
+    target = FlaskTarget(database_url)
+    from app import db
+    with target.app.app_context():
+        log = StatementLog(db.engines)
+    failures = run(target, log)
+
+    print(json.dumps({
+        'database': database_url.split(':', 1)[0],
+        'failures': failures,
+    }, indent=2, default=str))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
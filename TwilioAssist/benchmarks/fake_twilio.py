@@ -0,0 +1,116 @@
+"""Local stand-in for the Twilio Messages API.
+
+Accepts POST /2010-04-01/Accounts/<sid>/Messages.json and answers like
+Twilio, optionally adding latency and failing a share of requests with 429
+or 500. Point the app at it with TWILIO_API_BASE_URL=http://127.0.0.1:8099.
+
+    python benchmarks/fake_twilio.py --port 8099 --latency 0.05 --error-rate 0.1
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from itertools import count
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+
+class FakeTwilioHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        if not self.path.endswith("/Messages.json"):
+            return self._reply(404, {"code": 20404, "message": "Not found", "status": 404})
+
+        if server.latency:
+            time.sleep(server.latency)
+        roll = server.random.random()
+        if roll < server.error_rate / 2:
+            server.record("429")
+            return self._reply(429, {"code": 20429, "message": "Too Many Requests", "status": 429}, [("Retry-After", "0")])
+        if roll < server.error_rate:
+            server.record("500")
+            return self._reply(500, {"code": 20500, "message": "Internal Server Error", "status": 500})
+
+        sid = f"SM{next(server.ids):032d}"
+        server.record("201", form)
+        self._reply(201, {
+            "sid": sid,
+            "status": "queued",
+            "to": form.get("To"),
+            "from": form.get("From"),
+            "body": form.get("Body"),
+            "num_segments": "1",
+            "direction": "outbound-api",
+        })
+
+
+class FakeTwilioServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Async clients open many connections at once; the default backlog of 5 drops them
+    request_queue_size = 1024
+
+    def __init__(self, address, latency=0.0, error_rate=0.0, seed=None):
+        super().__init__(address, FakeTwilioHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.ids = count(1)
+        self.lock = threading.Lock()
+        self.responses = {}
+        self.messages = []
+
+    def record(self, status, form=None):
+        with self.lock:
+            self.responses[status] = self.responses.get(status, 0) + 1
+            if form is not None:
+                self.messages.append(form)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_fake_twilio(port=0, **kwargs):
+    """Start the stand-in on a background thread and return the server"""
+    server = FakeTwilioServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 429/500")
+    args = parser.parse_args()
+
+    server = FakeTwilioServer(("127.0.0.1", args.port), latency=args.latency, error_rate=args.error_rate)
+    print(f"Fake Twilio listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(server.responses)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, request, current_app
+from sqlalchemy import select, insert, update, func, or_, and_
+from app import db
+from models import Broadcast, BroadcastRecipient, Conversation, Message, Order
+import twilio_client
+from stats import record_messages
+
+# Campaign sending configuration
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", "4"))
+# Messages per second from this process, shared by every broadcast it is sending
+BROADCAST_RATE = float(os.environ.get("BROADCAST_RATE", "10"))
+BROADCAST_BATCH_SIZE = int(os.environ.get("BROADCAST_BATCH_SIZE", "100"))
+BROADCAST_MAX_ATTEMPTS = int(os.environ.get("BROADCAST_MAX_ATTEMPTS", "3"))
+# A running broadcast whose heartbeat is older than this can be resumed elsewhere;
+# the sender refreshes it every quarter of this while sending
+BROADCAST_STALE_SECONDS = int(os.environ.get("BROADCAST_STALE_SECONDS", "120"))
+
+AUDIENCES = ('conversations', 'buyers', 'list')
+
+broadcast_bp = Blueprint('broadcast', __name__)
+
+
+class RateLimiter:
+    """Spaces calls so that at most `rate` start per second across threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# One limiter per process: broadcasts running side by side share BROADCAST_RATE
+broadcast_limiter = RateLimiter(BROADCAST_RATE)
+
+
+def normalize_phone(phone_number):
+    return phone_number.strip().replace('whatsapp:', '')
+
+
+def audience_numbers(audience, phone_numbers=None):
+    """Yield the distinct phone numbers of an audience"""
+    if audience == 'list':
+        seen = set()
+        for phone in phone_numbers or []:
+            phone = normalize_phone(phone)
+            if phone and phone not in seen:
+                seen.add(phone)
+                yield phone
+        return
+
+    column = Conversation.phone_number if audience == 'conversations' else Order.phone_number
+    query = select(column).distinct().execution_options(yield_per=BROADCAST_BATCH_SIZE)
+    yield from db.session.execute(query).scalars()
+
+
+def create_broadcast(message_body, audience, phone_numbers=None):
+    """Create a broadcast and its recipient rows"""
+    broadcast = Broadcast(message_body=message_body, audience=audience, status='pending')
+    db.session.add(broadcast)
+    db.session.flush()
+
+    total = 0
+    batch = []
+    for phone in audience_numbers(audience, phone_numbers):
+        batch.append({'broadcast_id': broadcast.id, 'phone_number': phone, 'status': 'pending', 'attempts': 0})
+        if len(batch) >= BROADCAST_BATCH_SIZE:
+            db.session.execute(insert(BroadcastRecipient), batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(BroadcastRecipient), batch)
+        total += len(batch)
+
+    broadcast.total = total
+    db.session.commit()
+    return broadcast
+
+
+def claim_broadcast(broadcast_id):
+    """Mark a broadcast as running here; returns the claim's owner token, or None if another worker owns it"""
+    owner = uuid.uuid4().hex
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=BROADCAST_STALE_SECONDS)
+    result = db.session.execute(
+        update(Broadcast)
+        .where(Broadcast.id == broadcast_id)
+        .where(or_(
+            Broadcast.status.in_(['pending', 'interrupted']),
+            and_(Broadcast.status == 'running', Broadcast.heartbeat_at < stale),
+        ))
+        .values(status='running', owner=owner, heartbeat_at=now, started_at=func.coalesce(Broadcast.started_at, now))
+    )
+    db.session.commit()
+    return owner if result.rowcount == 1 else None
+
+
+def owned_by(broadcast_id, owner):
+    """Condition matching the broadcast only while this claim still holds it"""
+    return and_(Broadcast.id == broadcast_id, Broadcast.owner == owner, Broadcast.status == 'running')
+
+
+def heartbeat(broadcast_id, owner):
+    """Refresh the heartbeat of a broadcast; False once another worker has taken it over"""
+    result = db.session.execute(update(Broadcast).where(owned_by(broadcast_id, owner)).values(heartbeat_at=datetime.utcnow()))
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def send_one(client, limiter, phone_number, body):
+    """Send one message; returns (sid, error)"""
+    limiter.wait()
+    try:
+        message = client.messages.create(
+            body=body,
+            from_=f'whatsapp:{os.environ.get("TWILIO_PHONE_NUMBER")}',
+            to=f'whatsapp:{phone_number}'
+        )
+        return message.sid, None
+    except Exception as e:
+        return None, str(e)
+
+
+def send_batch(pool, client, broadcast_id, owner, body, batch):
+    """Send a batch from the pool; returns ((recipient, (sid, error)) pairs, whether the claim still holds)
+
+    Slow rates or a busy shared limiter can make a batch outlast
+    BROADCAST_STALE_SECONDS, so the heartbeat is refreshed as results come in.
+    Once the claim is lost, sends that have not started are skipped.
+    """
+    lost = threading.Event()
+
+    def send(recipient):
+        if lost.is_set():
+            return None
+        return send_one(client, broadcast_limiter, recipient.phone_number, body)
+
+    results = []
+    beat_at = time.monotonic()
+    for recipient, result in zip(batch, pool.map(send, batch)):
+        if result is not None:
+            results.append((recipient, result))
+        if not lost.is_set() and time.monotonic() - beat_at >= BROADCAST_STALE_SECONDS / 4:
+            if not heartbeat(broadcast_id, owner):
+                lost.set()
+            beat_at = time.monotonic()
+    return results, not lost.is_set()
+
+
+def record_batch(broadcast_id, owner, body, results):
+    """Persist a batch of send results, their Message rows and the broadcast counters
+
+    Returns False when the claim no longer holds. The results are recorded
+    anyway, since those messages went out.
+    """
+    now = datetime.utcnow()
+    updates = []
+    messages = []
+    sent = failed = 0
+    for (recipient_id, phone, attempts), (sid, error) in results:
+        attempts += 1
+        if sid:
+            status = 'sent'
+            sent += 1
+            messages.append({'phone_number': phone, 'message_body': body, 'is_incoming': False, 'timestamp': now})
+        elif attempts >= BROADCAST_MAX_ATTEMPTS:
+            status = 'failed'
+            failed += 1
+        else:
+            status = 'pending'
+        updates.append({'id': recipient_id, 'status': status, 'attempts': attempts,
+                        'message_sid': sid, 'error': error, 'updated_at': now})
+
+    db.session.execute(update(BroadcastRecipient), updates)
+    if messages:
+        db.session.execute(insert(Message), messages)
+    db.session.execute(
+        update(Broadcast).where(Broadcast.id == broadcast_id).values(
+            sent=Broadcast.sent + sent, failed=Broadcast.failed + failed
+        )
+    )
+    owned = db.session.execute(update(Broadcast).where(owned_by(broadcast_id, owner)).values(heartbeat_at=now))
+    written_at = time.time()
+    db.session.commit()
+    record_messages(messages, written_at)
+    return owned.rowcount == 1
+
+
+def run_broadcast(app, broadcast_id, owner):
+    """Send every pending recipient of a broadcast while the claim holds; meant for a background thread"""
+    with app.app_context():
+        try:
+            broadcast = db.session.get(Broadcast, broadcast_id)
+            client = twilio_client.get_client()
+            if client is None:
+                raise RuntimeError('Twilio not configured')
+
+            body = broadcast.message_body
+            with ThreadPoolExecutor(max_workers=BROADCAST_WORKERS) as pool:
+                while True:
+                    # Fresh recipients first, retries after them
+                    batch = db.session.execute(
+                        select(BroadcastRecipient.id, BroadcastRecipient.phone_number, BroadcastRecipient.attempts)
+                        .where(BroadcastRecipient.broadcast_id == broadcast_id)
+                        .where(BroadcastRecipient.status == 'pending')
+                        .order_by(BroadcastRecipient.attempts, BroadcastRecipient.id)
+                        .limit(BROADCAST_BATCH_SIZE)
+                    ).all()
+                    if not batch:
+                        break
+                    results, owned = send_batch(pool, client, broadcast_id, owner, body, batch)
+                    if not record_batch(broadcast_id, owner, body, results) or not owned:
+                        logging.warning(f"Broadcast {broadcast_id} was taken over by another worker, stopping")
+                        return
+
+            db.session.execute(
+                update(Broadcast).where(owned_by(broadcast_id, owner))
+                .values(status='completed', finished_at=datetime.utcnow())
+            )
+            db.session.commit()
+            logging.info(f"Broadcast {broadcast_id} completed")
+        except Exception as e:
+            logging.error(f"Error running broadcast {broadcast_id}: {str(e)}")
+            db.session.rollback()
+            db.session.execute(
+                update(Broadcast).where(owned_by(broadcast_id, owner)).values(status='failed', error=str(e))
+            )
+            db.session.commit()
+
+
+def start_broadcast(broadcast_id):
+    """Claim a broadcast and send it from a background thread"""
+    owner = claim_broadcast(broadcast_id)
+    if owner is None:
+        return False
+    app = current_app._get_current_object()
+    threading.Thread(target=run_broadcast, args=(app, broadcast_id, owner), name=f"broadcast-{broadcast_id}", daemon=True).start()
+    return True
+
+
+def broadcast_to_dict(broadcast):
+    return {
+        'id': broadcast.id,
+        'message': broadcast.message_body,
+        'audience': broadcast.audience,
+        'status': broadcast.status,
+        'total': broadcast.total,
+        'sent': broadcast.sent,
+        'failed': broadcast.failed,
+        'pending': broadcast.total - broadcast.sent - broadcast.failed,
+        'error': broadcast.error,
+        'created_at': broadcast.created_at.isoformat() if broadcast.created_at else None,
+        'finished_at': broadcast.finished_at.isoformat() if broadcast.finished_at else None,
+    }
+
+
+@broadcast_bp.route('/api/broadcasts', methods=['GET', 'POST'])
+def api_broadcasts():
+    """List recent broadcasts or create and start a new one"""
+    if request.method == 'GET':
+        broadcasts = Broadcast.query.order_by(Broadcast.id.desc()).limit(20).all()
+        return {'broadcasts': [broadcast_to_dict(b) for b in broadcasts]}
+
+    data = request.get_json() or {}
+    message = (data.get('message') or '').strip()
+    audience = data.get('audience', 'conversations')
+    if not message:
+        return {'error': 'Message is required'}, 400
+    if audience not in AUDIENCES:
+        return {'error': f'Audience must be one of: {", ".join(AUDIENCES)}'}, 400
+    if audience == 'list' and not data.get('phone_numbers'):
+        return {'error': 'phone_numbers is required for audience "list"'}, 400
+
+    broadcast = create_broadcast(message, audience, data.get('phone_numbers'))
+    start_broadcast(broadcast.id)
+    return {'success': True, 'id': broadcast.id, 'total': broadcast.total}, 202
+
+
+@broadcast_bp.route('/api/broadcasts/<int:broadcast_id>', methods=['GET'])
+def api_broadcast(broadcast_id):
+    """Progress of a broadcast"""
+    broadcast = db.session.get(Broadcast, broadcast_id)
+    if not broadcast:
+        return {'error': 'Broadcast not found'}, 404
+    return broadcast_to_dict(broadcast)
+
+
+@broadcast_bp.route('/api/broadcasts/<int:broadcast_id>/recipients', methods=['GET'])
+def api_broadcast_recipients(broadcast_id):
+    """Per-recipient status, optionally filtered by status"""
+    query = select(BroadcastRecipient).where(BroadcastRecipient.broadcast_id == broadcast_id)
+    if request.args.get('status'):
+        query = query.where(BroadcastRecipient.status == request.args['status'])
+    after_id = request.args.get('after_id', 0, type=int)
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    recipients = db.session.execute(
+        query.where(BroadcastRecipient.id > after_id).order_by(BroadcastRecipient.id).limit(limit)
+    ).scalars().all()
+    return {'recipients': [{
+        'id': r.id,
+        'phone_number': r.phone_number,
+        'status': r.status,
+        'attempts': r.attempts,
+        'message_sid': r.message_sid,
+        'error': r.error,
+    } for r in recipients]}
+
+
+@broadcast_bp.route('/api/broadcasts/<int:broadcast_id>/resume', methods=['POST'])
+def api_broadcast_resume(broadcast_id):
+    """Resume an interrupted broadcast, optionally retrying failed recipients"""
+    broadcast = db.session.get(Broadcast, broadcast_id)
+    if not broadcast:
+        return {'error': 'Broadcast not found'}, 404
+
+    data = request.get_json(silent=True) or {}
+    if data.get('retry_failed') and broadcast.status in ('completed', 'failed', 'interrupted'):
+        result = db.session.execute(
+            update(BroadcastRecipient)
+            .where(BroadcastRecipient.broadcast_id == broadcast_id, BroadcastRecipient.status == 'failed')
+            .values(status='pending', attempts=0)
+        )
+        broadcast.failed -= result.rowcount
+        broadcast.status = 'interrupted'
+        db.session.commit()
+    elif broadcast.status == 'failed':
+        broadcast.status = 'interrupted'
+        db.session.commit()
+
+    if not start_broadcast(broadcast_id):
+        return {'error': 'Broadcast is already running or finished'}, 409
+    return {'success': True, 'id': broadcast_id}, 202
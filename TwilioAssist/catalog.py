@@ -0,0 +1,207 @@
+import os
+import time
+import logging
+import threading
+from collections import namedtuple
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.orm import Session
+from app import db
+from models import Category, Product, CatalogVersion
+from search import product_index
+from locks import hold_lock
+from database import replica_reads
+
+# Seconds a worker trusts its snapshot before re-checking the shared version row
+CATALOG_CACHE_TTL = float(os.environ.get("CATALOG_CACHE_TTL", "5"))
+
+CATALOG_VERSION_ID = 1
+
+CachedCategory = namedtuple('CachedCategory', ['id', 'name', 'description', 'products'])
+CachedProduct = namedtuple('CachedProduct', ['id', 'name', 'description', 'price', 'category_id', 'category_name'])
+
+
+def format_price(price):
+    """Return price formatted in Brazilian Real"""
+    return f"R$ {price:.2f}".replace('.', ',')
+
+
+def render_category(category):
+    """Render the product listing for a category"""
+    if not category.products:
+        return f"😔 Não temos produtos disponíveis em {category.name} no momento.\n\nDigite *menu* para voltar ao início."
+
+    parts = [f"📋 *{category.name}*\n\n"]
+    for i, product in enumerate(category.products, 1):
+        parts.append(f"{i}️⃣ *{product.name}*\n")
+        parts.append(f"💰 {format_price(product.price)}\n")
+        if product.description:
+            parts.append(f"📝 {product.description}\n")
+        parts.append("\n")
+
+    parts.append("Responda com o número do produto que deseja comprar.\n")
+    parts.append("Digite *voltar* para retornar ao menu principal.")
+    return "".join(parts)
+
+
+def render_search_results(query, products):
+    """Render the numbered matches of a product search"""
+    if not products:
+        return (f"😔 Nenhum produto encontrado para \"{query}\".\n\n"
+                "Tente outras palavras ou digite *menu* para ver as categorias.")
+
+    parts = [f"🔎 *Resultados para \"{query}\"*\n\n"]
+    for i, product in enumerate(products, 1):
+        parts.append(f"{i}️⃣ *{product.name}*\n")
+        parts.append(f"💰 {format_price(product.price)}\n")
+        parts.append(f"📂 {product.category_name}\n\n")
+
+    parts.append("Responda com o número do produto para ver os detalhes.\n")
+    parts.append("Digite *menu* para voltar ao menu principal.")
+    return "".join(parts)
+
+
+def render_product(product):
+    """Render the detail view for a product"""
+    parts = [f"🛍️ *{product.name}*\n\n", f"💰 Preço: {format_price(product.price)}\n"]
+    if product.description:
+        parts.append(f"📝 Descrição: {product.description}\n")
+    parts.append(f"📂 Categoria: {product.category_name}\n\n")
+
+    parts.append("Para comprar este produto, responda:\n")
+    parts.append("*1* - Confirmar compra\n")
+    parts.append("*2* - Ver outros produtos desta categoria\n")
+    parts.append("*3* - Voltar ao menu principal\n")
+    return "".join(parts)
+
+
+class CatalogSnapshot:
+    """Immutable view of the active catalog with pre-rendered replies"""
+
+    def __init__(self, version, categories):
+        self.version = version
+        self.categories = {c.id: c for c in categories}
+        self.products = {p.id: p for c in categories for p in c.products}
+        self.category_texts = {c.id: render_category(c) for c in categories}
+        self.product_texts = {p.id: render_product(p) for p in self.products.values()}
+
+    def category_products(self, category_id):
+        """Return the active products of a category in menu order"""
+        category = self.categories.get(category_id)
+        return category.products if category else ()
+
+    def search(self, query):
+        """Active products matching a free-text query, best first"""
+        return product_index.search(query)
+
+
+def load_snapshot(session, version):
+    """Build a snapshot from the database using the given session"""
+    categories = session.execute(select(Category).order_by(Category.id)).scalars().all()
+    rows = session.execute(
+        select(Product).where(Product.is_active == True).order_by(Product.id)  # noqa: E712
+    ).scalars().all()
+
+    by_category = {c.id: [] for c in categories}
+    names = {c.id: c.name for c in categories}
+    for p in rows:
+        if p.category_id in by_category:
+            by_category[p.category_id].append(CachedProduct(
+                p.id, p.name, p.description, p.price, p.category_id, names[p.category_id]
+            ))
+
+    return CatalogSnapshot(version, [
+        CachedCategory(c.id, c.name, c.description, tuple(by_category[c.id])) for c in categories
+    ])
+
+
+def read_version(session):
+    """Read the shared catalog version (0 when the row is missing)"""
+    version = session.execute(
+        select(CatalogVersion.version).where(CatalogVersion.id == CATALOG_VERSION_ID)
+    ).scalar()
+    return version or 0
+
+
+class CatalogCache:
+    """Per-process catalog cache validated against the shared version row"""
+
+    def __init__(self, ttl=CATALOG_CACHE_TTL):
+        self.ttl = ttl
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, session=None):
+        """Return a current snapshot, reloading it if the catalog changed"""
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < self.ttl:
+            return snapshot
+
+        session = session or db.session
+        # Replica lag only delays a reload, as the TTL does
+        with hold_lock(self._lock), replica_reads(session):
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() - self._checked_at < self.ttl:
+                return snapshot
+
+            version = read_version(session)
+            if snapshot is None or snapshot.version != version:
+                snapshot = load_snapshot(session, version)
+                # Only products that changed since the last snapshot are re-indexed
+                product_index.sync(snapshot.products.values())
+                self._snapshot = snapshot
+                logging.info(f"Catalog cache loaded version {version}")
+            self._checked_at = time.monotonic()
+            return snapshot
+
+    def peek(self):
+        """Return the local snapshot without checking the version, or None"""
+        return self._snapshot
+
+    def invalidate(self):
+        """Drop the local snapshot so the next read reloads it"""
+        with hold_lock(self._lock):
+            self._snapshot = None
+            self._checked_at = 0.0
+
+
+catalog_cache = CatalogCache()
+
+
+def get_catalog(session=None):
+    """Return the current catalog snapshot"""
+    return catalog_cache.get(session)
+
+
+def bump_version(session):
+    """Increment the shared catalog version inside the current transaction"""
+    result = session.execute(
+        update(CatalogVersion)
+        .where(CatalogVersion.id == CATALOG_VERSION_ID)
+        .values(version=CatalogVersion.version + 1)
+    )
+    if result.rowcount == 0:
+        session.execute(insert(CatalogVersion).values(id=CATALOG_VERSION_ID, version=1))
+    session.info['catalog_dirty'] = True
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_catalog_writes(session, flush_context, instances):
+    """Bump the catalog version whenever a product or category is written"""
+    if session.info.get('catalog_dirty'):
+        return
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, (Product, Category)):
+            bump_version(session)
+            return
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('catalog_dirty', False):
+        catalog_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _reset_after_rollback(session):
+    session.info.pop('catalog_dirty', None)
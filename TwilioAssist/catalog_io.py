@@ -0,0 +1,344 @@
+"""Streaming import and export of products and categories as CSV or JSONL.
+
+Export pages through the table by id and yields one chunk of lines per page,
+so memory stays flat whatever the catalog size. Import reads rows one at a
+time, validates them and writes them in batches of CATALOG_IMPORT_BATCH_SIZE
+with bulk INSERT / UPDATE statements: rows with an `id` that exists are
+updated, all others inserted. Invalid rows are skipped and reported with
+their line number. Bulk statements bypass the ORM flush, so each batch
+bumps the catalog version itself.
+"""
+import io
+import os
+import csv
+import json
+import logging
+from sqlalchemy import select, insert, update, text
+from app import db
+from models import Category, Product
+from catalog import bump_version
+
+CATALOG_IMPORT_BATCH_SIZE = int(os.environ.get("CATALOG_IMPORT_BATCH_SIZE", "500"))
+CATALOG_EXPORT_PAGE_SIZE = int(os.environ.get("CATALOG_EXPORT_PAGE_SIZE", "1000"))
+# Row errors listed in an import report; the rest are only counted
+CATALOG_IMPORT_MAX_ERRORS = int(os.environ.get("CATALOG_IMPORT_MAX_ERRORS", "100"))
+
+FORMATS = ('csv', 'jsonl')
+KINDS = ('products', 'categories')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson; charset=utf-8'}
+
+FIELDS = {
+    'products': ['id', 'name', 'description', 'price', 'category_id', 'category', 'is_active'],
+    'categories': ['id', 'name', 'description'],
+}
+MODELS = {'products': Product, 'categories': Category}
+
+TRUE_VALUES = {'1', 'true', 'yes', 'sim', 's', 'y'}
+FALSE_VALUES = {'0', 'false', 'no', 'nao', 'não', 'n'}
+
+
+class RowError(ValueError):
+    """A row that cannot be imported"""
+
+
+def format_from_name(name, default='csv'):
+    """Guess the format from a file name or content type"""
+    name = (name or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')) or 'ndjson' in name or 'jsonl' in name:
+        return 'jsonl'
+    if name.endswith('.csv') or 'csv' in name:
+        return 'csv'
+    return default
+
+
+# Export
+
+def product_rows(page_size=CATALOG_EXPORT_PAGE_SIZE):
+    """Yield pages of product dicts in id order"""
+    names = dict(db.session.execute(select(Category.id, Category.name)).all())
+    last_id = 0
+    while True:
+        page = db.session.execute(
+            select(Product.id, Product.name, Product.description, Product.price, Product.category_id,
+                   Product.is_active)
+            .where(Product.id > last_id).order_by(Product.id).limit(page_size)
+        ).all()
+        if not page:
+            return
+        last_id = page[-1].id
+        yield [{
+            'id': p.id, 'name': p.name, 'description': p.description, 'price': p.price,
+            'category_id': p.category_id, 'category': names.get(p.category_id),
+            'is_active': p.is_active if p.is_active is not None else True,
+        } for p in page]
+
+
+def category_rows(page_size=CATALOG_EXPORT_PAGE_SIZE):
+    """Yield pages of category dicts in id order"""
+    last_id = 0
+    while True:
+        page = db.session.execute(
+            select(Category.id, Category.name, Category.description)
+            .where(Category.id > last_id).order_by(Category.id).limit(page_size)
+        ).all()
+        if not page:
+            return
+        last_id = page[-1].id
+        yield [{'id': c.id, 'name': c.name, 'description': c.description} for c in page]
+
+
+def export_lines(kind, fmt):
+    """Yield the export of a table as text chunks, one per page"""
+    pages = product_rows() if kind == 'products' else category_rows()
+    fields = FIELDS[kind]
+    if fmt == 'jsonl':
+        for page in pages:
+            yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in page)
+        return
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, lineterminator="\n")
+    writer.writeheader()
+    for page in pages:
+        writer.writerows(page)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# Import
+
+def read_rows(stream, fmt):
+    """Yield (line number, dict) from a text stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, RowError(f"invalid JSON: {e}")
+            continue
+        yield line_number, row if isinstance(row, dict) else RowError("expected a JSON object")
+
+
+def blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def parse_id(value, field='id'):
+    if blank(value):
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise RowError(f"{field} must be an integer")
+    if number <= 0:
+        raise RowError(f"{field} must be positive")
+    return number
+
+
+def parse_text(row, field, max_length=None, required=False):
+    value = row.get(field)
+    if blank(value):
+        if required:
+            raise RowError(f"{field} is required")
+        return None
+    value = str(value).strip()
+    if max_length and len(value) > max_length:
+        raise RowError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def parse_price(value):
+    if blank(value):
+        raise RowError("price is required")
+    if isinstance(value, str):
+        value = value.strip().replace('R$', '').strip()
+        # Brazilian notation: 1.234,56
+        if ',' in value:
+            value = value.replace('.', '').replace(',', '.')
+    try:
+        price = float(value)
+    except (TypeError, ValueError):
+        raise RowError("price must be a number")
+    if price < 0 or price != price:
+        raise RowError("price must be zero or more")
+    return round(price, 2)
+
+
+def parse_bool(value, default=True):
+    if blank(value):
+        return default
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise RowError("is_active must be true or false")
+
+
+class CategoryLookup:
+    """Category ids by id and by (case-insensitive) name, loaded once per import"""
+
+    def __init__(self):
+        rows = db.session.execute(select(Category.id, Category.name)).all()
+        self.ids = {row.id for row in rows}
+        self.by_name = {row.name.strip().lower(): row.id for row in rows}
+
+    def resolve(self, row):
+        category_id = parse_id(row.get('category_id'), 'category_id')
+        if category_id is not None:
+            if category_id not in self.ids:
+                raise RowError(f"category_id {category_id} does not exist")
+            return category_id
+        name = parse_text(row, 'category')
+        if name is None:
+            raise RowError("category_id or category is required")
+        category_id = self.by_name.get(name.lower())
+        if category_id is None:
+            raise RowError(f"category {name!r} does not exist")
+        return category_id
+
+
+def validate_product(row, categories):
+    return {
+        'id': parse_id(row.get('id')),
+        'name': parse_text(row, 'name', 200, required=True),
+        'description': parse_text(row, 'description'),
+        'price': parse_price(row.get('price')),
+        'category_id': categories.resolve(row),
+        'is_active': parse_bool(row.get('is_active')),
+    }
+
+
+def validate_category(row, categories):
+    return {
+        'id': parse_id(row.get('id')),
+        'name': parse_text(row, 'name', 100, required=True),
+        'description': parse_text(row, 'description'),
+    }
+
+
+class ImportReport:
+    """Counts and the first row errors of an import"""
+
+    def __init__(self, max_errors=CATALOG_IMPORT_MAX_ERRORS):
+        self.max_errors = max_errors
+        self.rows = 0
+        self.inserted = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'error': message})
+
+    def to_dict(self):
+        return {
+            'rows': self.rows,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+def write_batch(model, batch, session):
+    """Insert or update a batch of validated rows; returns (inserted, updated)"""
+    ids = [row['id'] for _, row in batch if row['id'] is not None]
+    existing = set(session.execute(select(model.id).where(model.id.in_(ids))).scalars()) if ids else set()
+    updates = [row for _, row in batch if row['id'] in existing]
+    inserts = [row for _, row in batch if row['id'] not in existing]
+    if updates:
+        session.execute(update(model), updates)
+    # Rows without an id get one from the database; executemany needs the same keys in every row
+    with_id = [row for row in inserts if row['id'] is not None]
+    without_id = [{k: v for k, v in row.items() if k != 'id'} for row in inserts if row['id'] is None]
+    for rows in (with_id, without_id):
+        if rows:
+            session.execute(insert(model), rows)
+    bump_version(session)
+    return len(inserts), len(updates)
+
+
+def flush_batch(model, batch, report):
+    """Write a batch in one transaction; on a database error retry it row by row to find the culprits"""
+    session = db.session
+    try:
+        inserted, updated = write_batch(model, batch, session)
+        session.commit()
+        report.inserted += inserted
+        report.updated += updated
+        return
+    except Exception:
+        session.rollback()
+    for line, row in batch:
+        try:
+            inserted, updated = write_batch(model, [(line, row)], session)
+            session.commit()
+            report.inserted += inserted
+            report.updated += updated
+        except Exception as e:
+            session.rollback()
+            report.error(line, str(getattr(e, 'orig', e)).splitlines()[0])
+
+
+def sync_id_sequence(model):
+    """Move a PostgreSQL id sequence past ids that were inserted explicitly"""
+    session = db.session
+    if session.get_bind().dialect.name != 'postgresql':
+        return
+    table = model.__table__.name
+    session.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('\"{table}\"', 'id'), "
+        f"(SELECT COALESCE(MAX(id), 0) + 1 FROM \"{table}\"), false)"
+    ))
+    session.commit()
+
+
+def import_catalog(stream, kind, fmt, batch_size=CATALOG_IMPORT_BATCH_SIZE):
+    """Import rows from a text stream; returns an ImportReport"""
+    model = MODELS[kind]
+    validate = validate_product if kind == 'products' else validate_category
+    categories = CategoryLookup() if kind == 'products' else None
+    report = ImportReport()
+    batch = []
+    seen_ids = set()
+
+    for line, row in read_rows(stream, fmt):
+        report.rows += 1
+        try:
+            if isinstance(row, RowError):
+                raise row
+            values = validate(row, categories)
+            if values['id'] is not None:
+                # A second row for the same id would update it twice in one batch
+                if values['id'] in seen_ids:
+                    raise RowError(f"duplicate id {values['id']}")
+                seen_ids.add(values['id'])
+        except RowError as e:
+            report.error(line, str(e))
+            continue
+        batch.append((line, values))
+        if len(batch) >= batch_size:
+            flush_batch(model, batch, report)
+            batch = []
+    if batch:
+        flush_batch(model, batch, report)
+
+    if report.inserted:
+        sync_id_sequence(model)
+    logging.info(f"Imported {kind}: {report.inserted} inserted, {report.updated} updated, "
+                 f"{report.error_count} errors")
+    return report
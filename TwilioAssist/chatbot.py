@@ -2,28 +2,40 @@ import os
 import logging
 from datetime import datetime
 from flask import Blueprint, request
-from twilio.twiml.messaging_response import MessagingResponse
-from twilio.rest import Client
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from app import db
-from models import Category, Product, Conversation, Message, Order
+from models import Conversation, Message, Order
+from catalog import get_catalog, format_price, render_search_results
+from message_log import log_message
+from idempotency import processed_messages
+from locks import conversation_locks
+from admission import admission
+from metrics import stage, WEBHOOK_MESSAGES
+import twilio_client
+from flows import Session
+from twiml import message_response
+from sessions import is_expired, reset_session
+from orders import schedule_expiry
+from dialog import (
+    BUSINESS_NAME, ATTENDANT_NAME, DONATION_CATEGORY_ID, ERROR_REPLY, chat_engine,
+    get_main_menu, get_donation_options, process_donation_selection,
+    process_donation_payment, handle_help_request,
+)
 
-# Twilio configuration
-TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID")
-TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN")
+# Twilio configuration (credentials are read in twilio_client)
 TWILIO_PHONE_NUMBER = os.environ.get("TWILIO_PHONE_NUMBER")
 
-# Business configuration
-BUSINESS_NAME = "Ediinho Boor"
-ATTENDANT_NAME = "Edii"
+# Times a message is re-run when another worker updated the conversation first
+WEBHOOK_MAX_ATTEMPTS = int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", "3"))
 
 # Create blueprint
 chatbot_bp = Blueprint('chatbot', __name__)
 
 def get_twilio_client():
-    """Get Twilio client instance"""
-    if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
-        return Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-    return None
+    """Get the shared, connection-pooled Twilio client"""
+    return twilio_client.get_client()
 
 def save_message(phone_number, message_body, is_incoming=True):
     """Save message to database"""
@@ -36,137 +48,38 @@ def save_message(phone_number, message_body, is_incoming=True):
     db.session.commit()
 
 def get_or_create_conversation(phone_number):
-    """Get existing conversation or create new one"""
-    conversation = Conversation.query.filter_by(phone_number=phone_number).first()
+    """Get existing conversation or create new one (committed by the caller)"""
+    # FOR UPDATE holds the row until the webhook commits on databases that
+    # support it; elsewhere Conversation.version catches concurrent writers
+    conversation = db.session.execute(
+        select(Conversation).where(Conversation.phone_number == phone_number).with_for_update()
+    ).scalar()
     if not conversation:
-        conversation = Conversation(phone_number=phone_number)
+        conversation = Conversation(phone_number=phone_number, current_state='main_menu')
         db.session.add(conversation)
-        db.session.commit()
     return conversation
 
-def get_main_menu():
-    """Generate main menu message"""
-    return f"""✨ Oi! Eu sou {ATTENDANT_NAME}, atendente virtual de {BUSINESS_NAME}!  
-Aqui você encontra produtos incríveis 🚀  
-Responda com o número da opção que deseja:
-
-1️⃣ Ebooks de Investimentos
-2️⃣ Ebooks de Emagrecimento
-3️⃣ Cursos de Investimentos
-4️⃣ Apps Free Fire
-5️⃣ Outros
-
-Digite *menu* a qualquer momento para voltar ao início.
-Digite *ajuda* para falar com atendimento humano."""
-
 def get_category_products(category_id):
     """Get products for a specific category"""
     # Special handling for "Outros" category (category 5) - show donation option
-    if category_id == 5:
+    if category_id == DONATION_CATEGORY_ID:
         return get_donation_options()
     
-    category = Category.query.get(category_id)
-    if not category:
+    text = get_catalog().category_texts.get(category_id)
+    if text is None:
         return "❌ Categoria não encontrada."
-    
-    products = Product.query.filter_by(category_id=category_id, is_active=True).all()
-    if not products:
-        return f"😔 Não temos produtos disponíveis em {category.name} no momento.\n\nDigite *menu* para voltar ao início."
-    
-    message = f"📋 *{category.name}*\n\n"
-    for i, product in enumerate(products, 1):
-        message += f"{i}️⃣ *{product.name}*\n"
-        message += f"💰 {product.formatted_price()}\n"
-        if product.description:
-            message += f"📝 {product.description}\n"
-        message += "\n"
-    
-    message += "Responda com o número do produto que deseja comprar.\n"
-    message += "Digite *voltar* para retornar ao menu principal."
-    
-    return message
-
-def get_donation_options():
-    """Show donation options for category Outros"""
-    message = "💝 *Apoie nosso trabalho!*\n\n"
-    message += "Se você gostou do nosso conteúdo e quer nos apoiar, pode fazer uma doação via PIX:\n\n"
-    
-    message += "💳 *Opções de Doação:*\n"
-    message += "1️⃣ R$ 5,00 - Cafezinho ☕\n"
-    message += "2️⃣ R$ 10,00 - Lanche 🍕\n"
-    message += "3️⃣ R$ 20,00 - Almoço 🍽️\n"
-    message += "4️⃣ R$ 50,00 - Apoio Premium 🌟\n"
-    message += "5️⃣ Outro valor (você escolhe) 💰\n\n"
-    
-    message += "🔑 **Chave PIX:** ediinhoboor@gmail.com\n\n"
-    message += "Responda com o número da opção desejada.\n"
-    message += "Digite *voltar* para retornar ao menu principal.\n\n"
-    message += "Muito obrigado pelo seu apoio! 🙏"
-    
-    return message
-
-def process_donation_selection(option):
-    """Process donation option selection"""
-    donation_amounts = {
-        '1': ('5.00', 'Cafezinho ☕'),
-        '2': ('10.00', 'Lanche 🍕'),
-        '3': ('20.00', 'Almoço 🍽️'),
-        '4': ('50.00', 'Apoio Premium 🌟'),
-        '5': ('0.00', 'Outro valor 💰')
-    }
-    
-    if option == '5':
-        message = "💰 *Outro valor*\n\n"
-        message += "Por favor, me informe o valor que deseja doar (apenas números):\n"
-        message += "Exemplo: 25.50 ou 15\n\n"
-        message += "Qual valor gostaria de contribuir?"
-        return message
-    else:
-        amount, description = donation_amounts[option]
-        message = f"💝 *Doação Selecionada*\n\n"
-        message += f"📦 {description}\n"
-        message += f"💰 Valor: R$ {amount}\n\n"
-        message += "Para finalizar a doação, me informe seu nome:"
-        return message
-
-def process_donation_payment(name, amount, description="Doação"):
-    """Process donation payment"""
-    message = f"🙏 *Obrigado, {name}!*\n\n"
-    message += f"💝 Doação: {description}\n"
-    message += f"💰 Valor: R$ {amount}\n\n"
-    
-    message += "💳 *Dados para PIX:*\n"
-    message += "🔑 **Chave PIX:** ediinhoboor@gmail.com\n"
-    message += "🏷️ **Nome:** Ediinho Boor\n\n"
-    
-    message += "📱 Após fazer o PIX, pode enviar o comprovante aqui mesmo!\n\n"
-    message += "✨ Sua contribuição nos ajuda muito a continuar criando conteúdo de qualidade!\n\n"
-    message += "Digite *menu* para voltar ao início."
-    
-    return message
+    return text
 
 def get_product_details(product_id):
     """Get detailed information about a product"""
-    product = Product.query.get(product_id)
-    if not product:
+    text = get_catalog().product_texts.get(product_id)
+    if text is None:
         return "❌ Produto não encontrado."
-    
-    message = f"🛍️ *{product.name}*\n\n"
-    message += f"💰 Preço: {product.formatted_price()}\n"
-    if product.description:
-        message += f"📝 Descrição: {product.description}\n"
-    message += f"📂 Categoria: {product.category.name}\n\n"
-    
-    message += "Para comprar este produto, responda:\n"
-    message += "*1* - Confirmar compra\n"
-    message += "*2* - Ver outros produtos desta categoria\n"
-    message += "*3* - Voltar ao menu principal\n"
-    
-    return message
+    return text
 
 def process_payment(phone_number, product_id, customer_name=None):
     """Process payment for a product"""
-    product = Product.query.get(product_id)
+    product = get_catalog().products.get(product_id)
     if not product:
         return "❌ Produto não encontrado."
     
@@ -178,15 +91,17 @@ def process_payment(phone_number, product_id, customer_name=None):
         status='pending'
     )
     db.session.add(order)
-    db.session.commit()
+    db.session.flush()  # assigns order.id; committed with the conversation
+    # Everything after the order is placed runs in the job workers
+    schedule_expiry(order)
     
     message = f"🛒 *Pedido Confirmado!*\n\n"
     message += f"📦 Produto: {product.name}\n"
-    message += f"💰 Valor: {product.formatted_price()}\n"
+    message += f"💰 Valor: {format_price(product.price)}\n"
     message += f"🔢 Pedido #: {order.id}\n\n"
     
     message += "💳 *Instruções de Pagamento:*\n"
-    message += f"• PIX: Envie {product.formatted_price()} para a chave PIX\n"
+    message += f"• PIX: Envie {format_price(product.price)} para a chave PIX\n"
     message += "• Cartão: Acesse o link de pagamento\n\n"
     
     message += "📱 Após o pagamento, envie o comprovante para receber o produto!\n\n"
@@ -194,195 +109,157 @@ def process_payment(phone_number, product_id, customer_name=None):
     
     return message
 
-def handle_help_request():
-    """Handle help request"""
-    return f"""🆘 *Atendimento Humano*
+class ChatServices:
+    """Catalog and order operations the dialog handlers call"""
+    
+    def category_text(self, category_id):
+        with stage('catalog'):
+            return get_category_products(category_id)
+    
+    def category_products(self, category_id):
+        with stage('catalog'):
+            return get_catalog().category_products(category_id)
+    
+    def product_text(self, product_id):
+        with stage('catalog'):
+            return get_product_details(product_id)
+    
+    def search_products(self, query):
+        with stage('catalog'):
+            return get_catalog().search(query)
+    
+    def search_text(self, query, products):
+        return render_search_results(query, products)
+    
+    def place_order(self, phone_number, product_id, customer_name):
+        return process_payment(phone_number, product_id, customer_name)
+
+chat_services = ChatServices()
 
-Em breve um de nossos atendentes entrará em contato com você!
+def session_from(conversation):
+    """Snapshot the fields of a conversation the flow can read"""
+    return Session(
+        conversation.current_state,
+        conversation.selected_category,
+        conversation.selected_product,
+        conversation.customer_name,
+        conversation.search_query,
+    )
+
+def apply_step(conversation, step):
+    """Write a flow step back to the conversation"""
+    conversation.current_state = step.state
+    for field, value in step.updates.items():
+        setattr(conversation, field, value)
+
+def handle_message(phone_number, message_body, message_sid):
+    """Run one inbound message through the flow and commit it; returns the TwiML reply"""
+    with stage('load'):
+        # Log incoming message (written with the conversation or by the background writer)
+        log_message(phone_number, message_body, is_incoming=True)
+        
+        # Get or create conversation
+        conversation = get_or_create_conversation(phone_number)
+        
+        # A customer coming back after the TTL of their state starts from the menu
+        if is_expired(conversation):
+            reset_session(conversation)
+    
+    # Run the conversation flow and apply the resulting state
+    with stage('state'):
+        step = chat_engine.dispatch(session_from(conversation), message_body, phone_number, chat_services)
+        apply_step(conversation, step)
+    reply_message = step.reply
+    
+    # Create response
+    with stage('twiml'):
+        twiml = message_response(reply_message)
+    
+    # Log outgoing message and commit everything in one transaction
+    with stage('commit'):
+        log_message(phone_number, reply_message, is_incoming=False)
+        conversation.last_message_at = datetime.utcnow()
+        if message_sid:
+            processed_messages.record(message_sid, phone_number, twiml)
+        db.session.commit()
+    if message_sid:
+        processed_messages.committed(message_sid, twiml)
+    
+    logging.info("Sent response", extra={'category': 'webhook.reply', 'phone': phone_number, 'reply': reply_message[:100]})
+    
+    return twiml
 
-⏰ Horário de atendimento:
-Segunda a Sexta: 8h às 18h
-Sábado: 8h às 12h
+def stored_reply(message_sid, phone_number, cached_only=False):
+    """The reply already sent for a MessageSid Twilio delivered again, or None
 
-📞 Ou ligue para: (11) 99999-9999
-📧 Email: contato@{BUSINESS_NAME.lower().replace(' ', '')}.com
+    cached_only looks in this worker's memory alone, so it can run before admission.
+    """
+    stored = processed_messages.cached(message_sid) if cached_only else processed_messages.get(message_sid)
+    if stored is not None:
+        logging.info("Duplicate delivery, returning stored reply",
+                     extra={'category': 'webhook.duplicate', 'phone': phone_number, 'message_sid': message_sid})
+        WEBHOOK_MESSAGES.inc('duplicate')
+    return stored
 
-Digite *menu* para voltar ao menu principal."""
+def reply_to(phone_number, message_body, message_sid):
+    """Handle a message, starting over while other workers change the conversation first; returns the TwiML"""
+    for attempt in range(1, WEBHOOK_MAX_ATTEMPTS + 1):
+        try:
+            twiml = handle_message(phone_number, message_body, message_sid)
+            WEBHOOK_MESSAGES.inc('ok')
+            return twiml
+        except (StaleDataError, IntegrityError):
+            # Another worker committed this conversation (or this very
+            # message) first; start over from its state
+            db.session.rollback()
+            stored = stored_reply(message_sid, phone_number) if message_sid else None
+            if stored is not None:
+                return stored
+            if attempt == WEBHOOK_MAX_ATTEMPTS:
+                raise
+            WEBHOOK_MESSAGES.inc('retried')
+            logging.warning("Conversation changed concurrently, retrying",
+                            extra={'category': 'webhook.retry', 'phone': phone_number, 'attempt': attempt})
 
 @chatbot_bp.route('/webhook', methods=['POST'])
 def webhook():
     """Handle incoming WhatsApp messages from Twilio"""
     try:
         # Get message details
-        phone_number = request.form.get('From', '').replace('whatsapp:', '')
-        message_body = request.form.get('Body', '').strip()
-        
-        logging.info(f"Received message from {phone_number}: {message_body}")
+        with stage('parse'):
+            phone_number = request.form.get('From', '').replace('whatsapp:', '')
+            message_body = request.form.get('Body', '').strip()
+            message_sid = request.form.get('MessageSid')
         
-        # Save incoming message
-        save_message(phone_number, message_body, is_incoming=True)
+        # Twilio retries deliveries it thinks timed out; answer those with the
+        # original reply, and without spending a token when this worker remembers it
+        if message_sid:
+            stored = stored_reply(message_sid, phone_number, cached_only=True)
+            if stored is not None:
+                return stored
         
-        # Get or create conversation
-        conversation = get_or_create_conversation(phone_number)
+        # Floods are answered here, before any database work
+        with stage('admit'):
+            rejected = admission.check(phone_number)
+        if rejected is not None:
+            return rejected
         
-        # Normalize message
-        message_lower = message_body.lower()
+        # Another worker, or this one before a restart, may have answered it
+        if message_sid:
+            stored = stored_reply(message_sid, phone_number)
+            if stored is not None:
+                return stored
         
-        # Create response
-        response = MessagingResponse()
-        reply_message = ""
+        logging.info("Received message", extra={'category': 'webhook.message', 'phone': phone_number, 'body': message_body})
         
-        # Handle special commands
-        if message_lower in ['menu', 'início', 'inicio', 'oi', 'olá', 'ola', 'começar', 'comecar']:
-            conversation.current_state = 'main_menu'
-            conversation.selected_category = None
-            conversation.selected_product = None
-            reply_message = get_main_menu()
-            
-        elif message_lower in ['ajuda', 'help', 'atendimento', 'humano']:
-            reply_message = handle_help_request()
-            
-        elif message_lower == 'voltar':
-            if conversation.current_state == 'viewing_products':
-                conversation.current_state = 'main_menu'
-                conversation.selected_category = None
-                reply_message = get_main_menu()
-            elif conversation.current_state == 'product_details':
-                conversation.current_state = 'viewing_products'
-                reply_message = get_category_products(conversation.selected_category)
-            else:
-                reply_message = get_main_menu()
-                
-        # Handle main menu selection
-        elif conversation.current_state == 'main_menu':
-            if message_body in ['1', '2', '3', '4', '5']:
-                category_id = int(message_body)
-                conversation.current_state = 'viewing_products'
-                conversation.selected_category = category_id
-                reply_message = get_category_products(category_id)
-            else:
-                reply_message = "❌ Opção inválida. " + get_main_menu()
-                
-        # Handle product selection
-        elif conversation.current_state == 'viewing_products':
-            # Special handling for donations (category 5 - Outros)
-            if conversation.selected_category == 5:
-                if message_body in ['1', '2', '3', '4', '5']:
-                    # Store donation option in selected_product temporarily 
-                    conversation.selected_product = int(message_body)
-                    conversation.current_state = 'requesting_donation_name'
-                    reply_message = process_donation_selection(message_body)
-                else:
-                    reply_message = "❌ Opção inválida. Escolha uma opção de 1 a 5."
-            else:
-                # Regular product selection
-                try:
-                    product_index = int(message_body) - 1
-                    products = Product.query.filter_by(
-                        category_id=conversation.selected_category, 
-                        is_active=True
-                    ).all()
-                    
-                    if 0 <= product_index < len(products):
-                        selected_product = products[product_index]
-                        conversation.current_state = 'product_details'
-                        conversation.selected_product = selected_product.id
-                        reply_message = get_product_details(selected_product.id)
-                    else:
-                        reply_message = "❌ Número de produto inválido. Tente novamente."
-                except ValueError:
-                    reply_message = "❌ Por favor, digite apenas o número do produto."
-                
-        # Handle product details actions
-        elif conversation.current_state == 'product_details':
-            if message_body == '1':  # Confirm purchase
-                conversation.current_state = 'requesting_name'
-                reply_message = "😊 Ótima escolha! Para finalizar o pedido, me informe seu nome completo:"
-                
-            elif message_body == '2':  # See other products
-                conversation.current_state = 'viewing_products'
-                reply_message = get_category_products(conversation.selected_category)
-                
-            elif message_body == '3':  # Back to main menu
-                conversation.current_state = 'main_menu'
-                conversation.selected_category = None
-                conversation.selected_product = None
-                reply_message = get_main_menu()
-            else:
-                reply_message = "❌ Opção inválida. Escolha 1, 2 ou 3."
-                
-        # Handle name input for regular products
-        elif conversation.current_state == 'requesting_name':
-            conversation.customer_name = message_body
-            conversation.current_state = 'main_menu'
-            reply_message = process_payment(phone_number, conversation.selected_product, message_body)
-            
-            # Reset conversation state
-            conversation.selected_category = None
-            conversation.selected_product = None
-            
-        # Handle name input for donations
-        elif conversation.current_state == 'requesting_donation_name':
-            conversation.customer_name = message_body
-            conversation.current_state = 'main_menu'
-            
-            # Process donation based on previously selected option (stored in selected_product)
-            if conversation.selected_product:
-                option = str(conversation.selected_product)
-                if option == '5':
-                    # For custom amount, ask for the value
-                    conversation.current_state = 'requesting_donation_amount'
-                    reply_message = "💰 Perfeito! Agora me informe o valor que deseja doar:\n\nExemplo: 25.50 ou 30"
-                else:
-                    # Process fixed amount donation
-                    amounts = {'1': '5.00', '2': '10.00', '3': '20.00', '4': '50.00'}
-                    descriptions = {'1': 'Cafezinho ☕', '2': 'Lanche 🍕', '3': 'Almoço 🍽️', '4': 'Apoio Premium 🌟'}
-                    amount = amounts.get(option, '5.00')
-                    description = descriptions.get(option, 'Doação')
-                    reply_message = process_donation_payment(message_body, amount, description)
-            else:
-                reply_message = "❌ Houve um erro. " + get_main_menu()
-            
-            # Reset conversation state
-            conversation.selected_category = None
-            conversation.selected_product = None
-            
-        # Handle custom donation amount
-        elif conversation.current_state == 'requesting_donation_amount':
-            try:
-                amount = float(message_body.replace(',', '.'))
-                if amount > 0:
-                    conversation.current_state = 'main_menu'
-                    reply_message = process_donation_payment(conversation.customer_name, f"{amount:.2f}", "Contribuição Personalizada 💰")
-                else:
-                    reply_message = "❌ Por favor, informe um valor válido maior que zero."
-            except ValueError:
-                reply_message = "❌ Por favor, informe apenas números. Exemplo: 25.50 ou 30"
-            
-        else:
-            # Default response
-            reply_message = "❓ Não entendi sua mensagem. " + get_main_menu()
-            conversation.current_state = 'main_menu'
-        
-        # Update conversation
-        conversation.last_message_at = datetime.utcnow()
-        db.session.commit()
-        
-        # Save outgoing message
-        save_message(phone_number, reply_message, is_incoming=False)
-        
-        # Send response
-        response.message(reply_message)
-        
-        logging.info(f"Sent response to {phone_number}: {reply_message[:100]}...")
-        
-        return str(response)
+        with conversation_locks.hold(phone_number):
+            return reply_to(phone_number, message_body, message_sid)
         
     except Exception as e:
-        logging.error(f"Error processing webhook: {str(e)}")
-        response = MessagingResponse()
-        response.message("❌ Desculpe, ocorreu um erro. Tente novamente em alguns instantes.")
-        return str(response)
+        logging.error("Error processing webhook: %s", e, extra={'category': 'webhook.error'}, exc_info=True)
+        db.session.rollback()
+        WEBHOOK_MESSAGES.inc('error')
+        return message_response(ERROR_REPLY)
 
 @chatbot_bp.route('/send-message', methods=['POST'])
 def send_message():
@@ -409,5 +286,10 @@ def send_message():
         return {'success': True, 'message_sid': twilio_message.sid}
         
     except Exception as e:
-        logging.error(f"Error sending message: {str(e)}")
+        logging.error("Error sending message: %s", e, extra={'category': 'send.error'}, exc_info=True)
         return {'error': str(e)}, 500
+
+@chatbot_bp.route('/api/twilio/stats', methods=['GET'])
+def twilio_stats():
+    """Outbound Twilio latency and retry counters for this worker"""
+    return twilio_client.get_stats()
@@ -0,0 +1,109 @@
+import json
+import click
+from flask import Blueprint
+
+# Registered without a group, so these run as `flask --app main <command>`
+commands_bp = Blueprint('commands', __name__, cli_group=None)
+
+@commands_bp.cli.command('init-db')
+def init_db_command():
+    """Create the tables, apply migrations and seed the default catalog"""
+    from app import init_db
+    init_db()
+    click.echo("Database initialized")
+
+@commands_bp.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations"""
+    from migrations import run_migrations
+    run_migrations()
+
+@commands_bp.cli.command('archive-messages')
+@click.option('--days', type=int, default=None, help='Archive messages older than this many days')
+def archive_messages_command(days):
+    """Move old messages into the compressed day archive"""
+    from retention import archive_messages, MESSAGE_RETENTION_DAYS
+    count = archive_messages(days if days is not None else MESSAGE_RETENTION_DAYS)
+    click.echo(f"Archived {count} messages")
+
+@commands_bp.cli.command('compact-messages')
+def compact_messages_command():
+    """Store repeated bot replies as template references"""
+    from retention import compact_messages
+    click.echo(f"Compacted {compact_messages()} messages")
+
+@commands_bp.cli.command('archived-messages')
+@click.argument('phone_number')
+def archived_messages_command(phone_number):
+    """Print the archived messages of a phone number as JSON lines"""
+    from retention import iter_archived_messages
+    for record in iter_archived_messages(phone_number):
+        click.echo(json.dumps(record, ensure_ascii=False))
+
+@commands_bp.cli.command('prune-message-ids')
+@click.option('--hours', type=int, default=None, help='Forget MessageSids older than this many hours')
+def prune_message_ids_command(hours):
+    """Delete old processed Twilio MessageSids"""
+    from idempotency import prune_processed_messages, IDEMPOTENCY_RETENTION_HOURS
+    count = prune_processed_messages(hours if hours is not None else IDEMPOTENCY_RETENTION_HOURS)
+    click.echo(f"Pruned {count} message ids")
+
+@commands_bp.cli.command('reconcile-stats')
+def reconcile_stats_command():
+    """Recompute the admin statistics counters from the base tables"""
+    from stats import reconcile_stats
+    reconcile_stats()
+    click.echo("Stats reconciled")
+
+@commands_bp.cli.command('expire-sessions')
+@click.option('--archive/--no-archive', default=True, help='Also archive long idle conversations')
+def expire_sessions_command(archive):
+    """Reset conversations idle past their state TTL and archive abandoned ones"""
+    from sessions import expire_sessions, archive_conversations, CONVERSATION_ARCHIVE_DAYS
+    if archive and CONVERSATION_ARCHIVE_DAYS:
+        click.echo(f"Archived {archive_conversations()} conversations")
+    click.echo(f"Reset {expire_sessions()} expired sessions")
+
+@commands_bp.cli.command('run-jobs')
+@click.option('--threads', type=int, default=None, help='Worker threads in this process (JOB_WORKER_THREADS)')
+@click.option('--once', is_flag=True, help='Run the due jobs and exit')
+@click.option('--kind', 'kinds', multiple=True, help='Only run jobs of this kind (repeatable)')
+def run_jobs_command(threads, once, kinds):
+    """Process order jobs: status changes, deliveries and expiry of unpaid orders"""
+    from flask import current_app
+    from jobs import run_workers, JOB_WORKER_THREADS
+    count = run_workers(current_app._get_current_object(), threads or JOB_WORKER_THREADS, once, kinds or None)
+    if once:
+        click.echo(f"Ran {count} jobs")
+
+@commands_bp.cli.command('prune-jobs')
+@click.option('--hours', type=int, default=None, help='Delete jobs finished more than this many hours ago')
+def prune_jobs_command(hours):
+    """Delete old finished background jobs"""
+    from jobs import prune_jobs, JOB_RETENTION_HOURS
+    click.echo(f"Pruned {prune_jobs(hours if hours is not None else JOB_RETENTION_HOURS)} jobs")
+
+@commands_bp.cli.command('import-catalog')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--kind', type=click.Choice(['products', 'categories']), default='products')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default=None, help='Defaults to the file extension')
+@click.option('--batch-size', type=int, default=None, help='Rows per transaction (CATALOG_IMPORT_BATCH_SIZE)')
+def import_catalog_command(path, kind, fmt, batch_size):
+    """Insert or update products or categories from a CSV or JSON lines file"""
+    from catalog_io import import_catalog, format_from_name, CATALOG_IMPORT_BATCH_SIZE
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        report = import_catalog(f, kind, fmt or format_from_name(path), batch_size or CATALOG_IMPORT_BATCH_SIZE)
+    for error in report.errors:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    click.echo(f"{report.rows} rows: {report.inserted} inserted, {report.updated} updated, "
+               f"{report.error_count} errors")
+
+@commands_bp.cli.command('export-catalog')
+@click.option('--kind', type=click.Choice(['products', 'categories']), default='products')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), default='csv')
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-', help='Defaults to stdout')
+def export_catalog_command(kind, fmt, output):
+    """Write all products or categories as CSV or JSON lines"""
+    from catalog_io import export_lines
+    for chunk in export_lines(kind, fmt):
+        output.write(chunk)
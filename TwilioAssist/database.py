@@ -0,0 +1,142 @@
+"""Engine configuration per role and routing of catalog reads to replicas.
+
+The primary (DATABASE_URL) takes every write and every read by default.
+DATABASE_REPLICA_URLS lists read replicas, configured as Flask-SQLAlchemy
+binds named replica0, replica1...; code that can live with replication lag
+(the catalog cache, /api/products, /api/categories, /admin) wraps its reads
+in replica_reads(), and each session then sends plain SELECTs to one replica
+picked at random. Flushes, INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE and
+reads after a catalog write in the same transaction stay on the primary.
+Without replicas replica_reads() changes nothing.
+
+Pools are sized per role (DB_* for the primary, DB_REPLICA_* for replicas,
+which default to the primary's) and reported on /metrics.
+"""
+import os
+import random
+from contextlib import contextmanager
+from functools import wraps
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from metrics import Counter, Gauge
+
+# Comma-separated; each needs the primary's schema (a streaming replica, or a copy of a SQLite file)
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# Per worker process: pool size plus overflow bounds its connections to each database
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+# Seconds a request waits for a free connection before failing
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "300"))
+# Off by default: a ping is a round trip per checkout, and a dropped connection
+# already invalidates the pool so only the statement that hit it fails
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "0") == "1"
+
+DB_REPLICA_POOL_SIZE = int(os.environ.get("DB_REPLICA_POOL_SIZE", DB_POOL_SIZE))
+DB_REPLICA_MAX_OVERFLOW = int(os.environ.get("DB_REPLICA_MAX_OVERFLOW", DB_MAX_OVERFLOW))
+DB_REPLICA_POOL_TIMEOUT = float(os.environ.get("DB_REPLICA_POOL_TIMEOUT", DB_POOL_TIMEOUT))
+
+PRIMARY = 'primary'
+REPLICA_KEYS = [f"replica{i}" for i in range(len(DATABASE_REPLICA_URLS))]
+
+POOL_CHECKOUTS = Counter('db_pool_checkouts_total', "Connections taken from the pool", ('role',))
+POOL_CONNECTS = Counter('db_pool_connects_total', "New database connections opened by the pool", ('role',))
+POOL_INVALIDATIONS = Counter('db_pool_invalidations_total', "Pooled connections discarded after an error", ('role',))
+
+# role -> engine; engines, not pools, since dispose() after a fork swaps the pool
+_engines = {}
+
+
+def pool_connections():
+    values = {}
+    for role, engine in list(_engines.items()):
+        pool = engine.pool
+        if not hasattr(pool, 'checkedout'):
+            continue
+        values[(role, 'checked_out')] = pool.checkedout()
+        values[(role, 'idle')] = pool.checkedin()
+        values[(role, 'overflow')] = max(pool.overflow(), 0)
+        values[(role, 'size')] = pool.size()
+    return values
+
+
+POOL_CONNECTIONS = Gauge('db_pool_connections', "Pooled database connections by role and state", ('role', 'state'),
+                         pool_connections)
+
+
+def engine_options(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT):
+    """create_engine arguments for one role"""
+    options = {'pool_recycle': DB_POOL_RECYCLE, 'pool_pre_ping': DB_POOL_PRE_PING}
+    url = make_url(url)
+    # In-memory SQLite gets a StaticPool from Flask-SQLAlchemy, which has no size
+    if not (url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')):
+        options.update(pool_size=pool_size, max_overflow=max_overflow, pool_timeout=pool_timeout)
+    return options
+
+
+def replica_binds():
+    """SQLALCHEMY_BINDS entries for the read replicas"""
+    return {
+        key: {'url': url, **engine_options(url, DB_REPLICA_POOL_SIZE, DB_REPLICA_MAX_OVERFLOW, DB_REPLICA_POOL_TIMEOUT)}
+        for key, url in zip(REPLICA_KEYS, DATABASE_REPLICA_URLS)
+    }
+
+
+def track_pool(role, engine):
+    """Count checkouts, connects and invalidations of an engine's pool and report its usage"""
+    if role in _engines:
+        return
+    _engines[role] = engine
+    event.listen(engine, 'checkout', lambda *args: POOL_CHECKOUTS.inc(role))
+    event.listen(engine, 'connect', lambda *args: POOL_CONNECTS.inc(role))
+    event.listen(engine, 'invalidate', lambda *args: POOL_INVALIDATIONS.inc(role))
+
+
+def init_app(app, db):
+    with app.app_context():
+        for key, engine in db.engines.items():
+            track_pool(key or PRIMARY, engine)
+
+
+class RoutingSession(Session):
+    """db.session: sends plain reads to a replica inside replica_reads()"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and REPLICA_KEYS and self.info.get('replica_reads') and self.can_read_from_replica(clause):
+            key = self.info.get('replica')
+            if key is None:
+                # One replica per session, so its reads see one consistent copy
+                key = self.info['replica'] = random.choice(REPLICA_KEYS)
+            return self._db.engines[key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def can_read_from_replica(self, clause):
+        if self._flushing or self.info.get('catalog_dirty'):
+            return False
+        # Only SELECTs without FOR UPDATE; anything else is, or locks for, a write
+        return getattr(clause, 'is_select', False) and getattr(clause, '_for_update_arg', None) is None
+
+
+@contextmanager
+def replica_reads(session=None):
+    """Let the reads of the block go to a replica"""
+    if session is None:
+        from app import db
+        session = db.session
+    previous = session.info.get('replica_reads', False)
+    session.info['replica_reads'] = True
+    try:
+        yield session
+    finally:
+        session.info['replica_reads'] = previous
+
+
+def reads_from_replica(view):
+    """Decorate a view whose reads can go to a replica"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+    return wrapper
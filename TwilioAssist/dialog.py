@@ -0,0 +1,302 @@
+from types import MappingProxyType
+from flows import Flow, Step
+
+# Business configuration
+BUSINESS_NAME = "Ediinho Boor"
+ATTENDANT_NAME = "Edii"
+
+# Static main menu, rendered once at import
+MAIN_MENU = f"""✨ Oi! Eu sou {ATTENDANT_NAME}, atendente virtual de {BUSINESS_NAME}!  
+Aqui você encontra produtos incríveis 🚀  
+Responda com o número da opção que deseja:
+
+1️⃣ Ebooks de Investimentos
+2️⃣ Ebooks de Emagrecimento
+3️⃣ Cursos de Investimentos
+4️⃣ Apps Free Fire
+5️⃣ Outros
+
+Digite *menu* a qualquer momento para voltar ao início.
+Digite *ajuda* para falar com atendimento humano."""
+
+# Donation options offered in category "Outros": option -> (amount, description)
+DONATION_CATEGORY_ID = 5
+DONATION_OPTIONS = {
+    '1': ('5.00', 'Cafezinho ☕'),
+    '2': ('10.00', 'Lanche 🍕'),
+    '3': ('20.00', 'Almoço 🍽️'),
+    '4': ('50.00', 'Apoio Premium 🌟'),
+    '5': ('0.00', 'Outro valor 💰')
+}
+CUSTOM_DONATION_OPTION = '5'
+
+def get_main_menu():
+    """Generate main menu message"""
+    return MAIN_MENU
+
+
+def get_donation_options():
+    """Show donation options for category Outros"""
+    message = "💝 *Apoie nosso trabalho!*\n\n"
+    message += "Se você gostou do nosso conteúdo e quer nos apoiar, pode fazer uma doação via PIX:\n\n"
+    
+    message += "💳 *Opções de Doação:*\n"
+    message += "1️⃣ R$ 5,00 - Cafezinho ☕\n"
+    message += "2️⃣ R$ 10,00 - Lanche 🍕\n"
+    message += "3️⃣ R$ 20,00 - Almoço 🍽️\n"
+    message += "4️⃣ R$ 50,00 - Apoio Premium 🌟\n"
+    message += "5️⃣ Outro valor (você escolhe) 💰\n\n"
+    
+    message += "🔑 **Chave PIX:** ediinhoboor@gmail.com\n\n"
+    message += "Responda com o número da opção desejada.\n"
+    message += "Digite *voltar* para retornar ao menu principal.\n\n"
+    message += "Muito obrigado pelo seu apoio! 🙏"
+    
+    return message
+
+def process_donation_selection(option):
+    """Process donation option selection"""
+    if option == CUSTOM_DONATION_OPTION:
+        message = "💰 *Outro valor*\n\n"
+        message += "Por favor, me informe o valor que deseja doar (apenas números):\n"
+        message += "Exemplo: 25.50 ou 15\n\n"
+        message += "Qual valor gostaria de contribuir?"
+        return message
+    else:
+        amount, description = DONATION_OPTIONS[option]
+        message = f"💝 *Doação Selecionada*\n\n"
+        message += f"📦 {description}\n"
+        message += f"💰 Valor: R$ {amount}\n\n"
+        message += "Para finalizar a doação, me informe seu nome:"
+        return message
+
+def process_donation_payment(name, amount, description="Doação"):
+    """Process donation payment"""
+    message = f"🙏 *Obrigado, {name}!*\n\n"
+    message += f"💝 Doação: {description}\n"
+    message += f"💰 Valor: R$ {amount}\n\n"
+    
+    message += "💳 *Dados para PIX:*\n"
+    message += "🔑 **Chave PIX:** ediinhoboor@gmail.com\n"
+    message += "🏷️ **Nome:** Ediinho Boor\n\n"
+    
+    message += "📱 Após fazer o PIX, pode enviar o comprovante aqui mesmo!\n\n"
+    message += "✨ Sua contribuição nos ajuda muito a continuar criando conteúdo de qualidade!\n\n"
+    message += "Digite *menu* para voltar ao início."
+    
+    return message
+
+
+def handle_help_request():
+    """Handle help request"""
+    return f"""🆘 *Atendimento Humano*
+
+Em breve um de nossos atendentes entrará em contato com você!
+
+⏰ Horário de atendimento:
+Segunda a Sexta: 8h às 18h
+Sábado: 8h às 12h
+
+📞 Ou ligue para: (11) 99999-9999
+📧 Email: contato@{BUSINESS_NAME.lower().replace(' ', '')}.com
+
+Digite *menu* para voltar ao menu principal."""
+
+
+# Replies that never change, built once
+DONATION_OPTIONS_TEXT = get_donation_options()
+HELP_TEXT = handle_help_request()
+INVALID_MAIN_MENU = "❌ Opção inválida. " + MAIN_MENU
+NOT_UNDERSTOOD = "❓ Não entendi sua mensagem. " + MAIN_MENU
+DONATION_ERROR = "❌ Houve um erro. " + MAIN_MENU
+INVALID_DONATION_OPTION = "❌ Opção inválida. Escolha uma opção de 1 a 5."
+PRODUCT_NUMBER_ONLY = "❌ Por favor, digite apenas o número do produto."
+INVALID_PRODUCT_NUMBER = "❌ Número de produto inválido. Tente novamente."
+ASK_CUSTOMER_NAME = "😊 Ótima escolha! Para finalizar o pedido, me informe seu nome completo:"
+INVALID_PRODUCT_ACTION = "❌ Opção inválida. Escolha 1, 2 ou 3."
+ASK_DONATION_AMOUNT = "💰 Perfeito! Agora me informe o valor que deseja doar:\n\nExemplo: 25.50 ou 30"
+AMOUNT_NUMBERS_ONLY = "❌ Por favor, informe apenas números. Exemplo: 25.50 ou 30"
+INVALID_AMOUNT = "❌ Por favor, informe um valor válido maior que zero."
+ERROR_REPLY = "❌ Desculpe, ocorreu um erro. Tente novamente em alguns instantes."
+SEARCH_USAGE = "🔎 Digite *buscar* seguido do que procura.\n\nExemplo: buscar investimentos"
+THROTTLED_REPLY = "⏳ Você está enviando mensagens muito rápido. Aguarde um minuto e tente novamente."
+BUSY_REPLY = "⚠️ Estamos recebendo muitas mensagens agora. Tente novamente em alguns minutos."
+
+# Every fixed reply above; their TwiML is rendered once at startup
+STATIC_REPLIES = (
+    MAIN_MENU, DONATION_OPTIONS_TEXT, HELP_TEXT, INVALID_MAIN_MENU, NOT_UNDERSTOOD, DONATION_ERROR,
+    INVALID_DONATION_OPTION, PRODUCT_NUMBER_ONLY, INVALID_PRODUCT_NUMBER, ASK_CUSTOMER_NAME,
+    INVALID_PRODUCT_ACTION, ASK_DONATION_AMOUNT, AMOUNT_NUMBERS_ONLY, INVALID_AMOUNT,
+    ERROR_REPLY, SEARCH_USAGE, THROTTLED_REPLY, BUSY_REPLY, *(process_donation_selection(option) for option in DONATION_OPTIONS),
+)
+
+RESET_SELECTION = MappingProxyType({'selected_category': None, 'selected_product': None, 'search_query': None})
+
+# Size of the Conversation.search_query column
+SEARCH_QUERY_MAX_LENGTH = 100
+
+chat_flow = Flow()
+
+
+@chat_flow.command('menu', 'início', 'inicio', 'oi', 'olá', 'ola', 'começar', 'comecar')
+def show_main_menu(ctx):
+    return Step('main_menu', MAIN_MENU, RESET_SELECTION)
+
+
+@chat_flow.command('ajuda', 'help', 'atendimento', 'humano')
+def show_help(ctx):
+    return Step(ctx.state, HELP_TEXT)
+
+
+@chat_flow.command('voltar')
+def go_back(ctx):
+    if ctx.state == 'viewing_products':
+        return Step('main_menu', MAIN_MENU, {'selected_category': None})
+    if ctx.state == 'product_details':
+        return Step('viewing_products', ctx.services.category_text(ctx.session.selected_category))
+    if ctx.state == 'search_results':
+        return Step('main_menu', MAIN_MENU, RESET_SELECTION)
+    return Step(ctx.state, MAIN_MENU)
+
+
+@chat_flow.command('buscar', 'procurar', 'pesquisar')
+def search_usage(ctx):
+    return Step(ctx.state, SEARCH_USAGE)
+
+
+@chat_flow.prefix('buscar', 'procurar', 'pesquisar')
+def search_command(ctx):
+    return search(ctx, ctx.argument)
+
+
+def search(ctx, query, products=None):
+    query = query[:SEARCH_QUERY_MAX_LENGTH]
+    if products is None:
+        products = ctx.services.search_products(query)
+    reply = ctx.services.search_text(query, products)
+    if not products:
+        return Step(ctx.state, reply)
+    return Step('search_results', reply, {**RESET_SELECTION, 'search_query': query})
+
+
+@chat_flow.option('main_menu', '1', '2', '3', '4', '5')
+def choose_category(ctx):
+    category_id = int(ctx.text)
+    return Step('viewing_products', ctx.services.category_text(category_id), {'selected_category': category_id})
+
+
+@chat_flow.fallback('main_menu')
+def invalid_main_menu(ctx):
+    # Text that is not a menu number is tried as a product name
+    if not ctx.text.isdecimal():
+        products = ctx.services.search_products(ctx.text[:SEARCH_QUERY_MAX_LENGTH])
+        if products:
+            return search(ctx, ctx.text, products)
+    return Step('main_menu', INVALID_MAIN_MENU)
+
+
+@chat_flow.fallback('search_results')
+def choose_search_result(ctx):
+    if not ctx.text.isdecimal():
+        return search(ctx, ctx.text)
+    # The same query against the same catalog gives the same numbering
+    products = ctx.services.search_products(ctx.session.search_query or '')
+    index = int(ctx.text) - 1
+    if 0 <= index < len(products):
+        product = products[index]
+        return Step('product_details', ctx.services.product_text(product.id),
+                    {'selected_product': product.id, 'selected_category': product.category_id})
+    return Step(ctx.state, INVALID_PRODUCT_NUMBER)
+
+
+@chat_flow.fallback('viewing_products')
+def choose_listed_item(ctx):
+    if ctx.session.selected_category == DONATION_CATEGORY_ID:
+        return choose_donation(ctx)
+    return choose_product(ctx)
+
+
+def choose_donation(ctx):
+    if ctx.text not in DONATION_OPTIONS:
+        return Step(ctx.state, INVALID_DONATION_OPTION)
+    # The donation option is kept in selected_product until the name arrives
+    return Step('requesting_donation_name', process_donation_selection(ctx.text),
+                {'selected_product': int(ctx.text)})
+
+
+def choose_product(ctx):
+    try:
+        product_index = int(ctx.text) - 1
+    except ValueError:
+        products = ctx.services.search_products(ctx.text[:SEARCH_QUERY_MAX_LENGTH])
+        if products:
+            return search(ctx, ctx.text, products)
+        return Step(ctx.state, PRODUCT_NUMBER_ONLY)
+
+    products = ctx.services.category_products(ctx.session.selected_category)
+    if 0 <= product_index < len(products):
+        product_id = products[product_index].id
+        return Step('product_details', ctx.services.product_text(product_id), {'selected_product': product_id})
+    return Step(ctx.state, INVALID_PRODUCT_NUMBER)
+
+
+@chat_flow.option('product_details', '1')
+def confirm_purchase(ctx):
+    return Step('requesting_name', ASK_CUSTOMER_NAME)
+
+
+@chat_flow.option('product_details', '2')
+def see_other_products(ctx):
+    return Step('viewing_products', ctx.services.category_text(ctx.session.selected_category))
+
+
+@chat_flow.option('product_details', '3')
+def back_to_main_menu(ctx):
+    return Step('main_menu', MAIN_MENU, RESET_SELECTION)
+
+
+@chat_flow.fallback('product_details')
+def invalid_product_action(ctx):
+    return Step(ctx.state, INVALID_PRODUCT_ACTION)
+
+
+@chat_flow.fallback('requesting_name')
+def receive_customer_name(ctx):
+    reply = ctx.services.place_order(ctx.phone_number, ctx.session.selected_product, ctx.text)
+    return Step('main_menu', reply, {'customer_name': ctx.text, **RESET_SELECTION})
+
+
+@chat_flow.fallback('requesting_donation_name')
+def receive_donor_name(ctx):
+    updates = {'customer_name': ctx.text, **RESET_SELECTION}
+    if not ctx.session.selected_product:
+        return Step('main_menu', DONATION_ERROR, updates)
+
+    option = str(ctx.session.selected_product)
+    if option == CUSTOM_DONATION_OPTION:
+        return Step('requesting_donation_amount',
+                    ASK_DONATION_AMOUNT, updates)
+
+    amount, description = DONATION_OPTIONS.get(option, ('5.00', 'Doação'))
+    return Step('main_menu', process_donation_payment(ctx.text, amount, description), updates)
+
+
+@chat_flow.fallback('requesting_donation_amount')
+def receive_donation_amount(ctx):
+    try:
+        amount = float(ctx.text.replace(',', '.'))
+    except ValueError:
+        return Step(ctx.state, AMOUNT_NUMBERS_ONLY)
+
+    if amount > 0:
+        reply = process_donation_payment(ctx.session.customer_name, f"{amount:.2f}", "Contribuição Personalizada 💰")
+        return Step('main_menu', reply)
+    return Step(ctx.state, INVALID_AMOUNT)
+
+
+@chat_flow.default
+def unknown_state(ctx):
+    return Step('main_menu', NOT_UNDERSTOOD)
+
+
+chat_engine = chat_flow.compile()
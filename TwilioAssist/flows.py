@@ -0,0 +1,156 @@
+"""Declarative conversation flows compiled into dispatch tables.
+
+A Flow collects global commands (keywords that work in any state), prefix
+commands (a keyword followed by free text, e.g. "buscar ebook"), per-state
+exact-input options and per-state fallbacks. compile() freezes them into
+dicts, so dispatching a message costs a couple of hash lookups no matter how
+many states or options are registered. Handlers take a Context and return a
+Step; they never touch Flask or the database directly, anything with side
+effects goes through ctx.services.
+"""
+from collections import namedtuple
+from types import MappingProxyType
+
+# Conversation fields a handler can read; names match the Conversation columns
+Session = namedtuple('Session', ['current_state', 'selected_category', 'selected_product', 'customer_name',
+                                 'search_query'], defaults=(None,))
+
+# Handler result: the next state, the reply text and other Conversation fields to set
+Step = namedtuple('Step', ['state', 'reply', 'updates'], defaults=(MappingProxyType({}),))
+
+StateTable = namedtuple('StateTable', ['options', 'fallback'])
+
+
+class Context:
+    """Everything a handler sees for one inbound message"""
+    __slots__ = ('session', 'text', 'lower', 'phone_number', 'services', 'argument')
+
+    def __init__(self, session, text, phone_number=None, services=None):
+        self.session = session
+        self.text = text
+        self.lower = text.lower()
+        self.phone_number = phone_number
+        self.services = services
+        # Text after the keyword of a prefix command
+        self.argument = None
+
+    @property
+    def state(self):
+        return self.session.current_state
+
+
+class Flow:
+    """Builder for a conversation flow"""
+
+    def __init__(self):
+        self._commands = {}
+        self._prefixes = {}
+        self._options = {}
+        self._fallbacks = {}
+        self._default = None
+
+    def command(self, *keywords):
+        """Register a handler for case-insensitive keywords valid in every state"""
+        def decorator(handler):
+            for keyword in keywords:
+                self._add(self._commands, keyword.lower(), handler, 'command')
+            return handler
+        return decorator
+
+    def prefix(self, *keywords):
+        """Register a handler for case-insensitive keywords followed by free text, valid in every state"""
+        def decorator(handler):
+            for keyword in keywords:
+                self._add(self._prefixes, keyword.lower(), handler, 'prefix')
+            return handler
+        return decorator
+
+    def option(self, state, *inputs):
+        """Register a handler for exact inputs while in a state"""
+        def decorator(handler):
+            options = self._options.setdefault(state, {})
+            for value in inputs:
+                self._add(options, value, handler, f'option in {state}')
+            return handler
+        return decorator
+
+    def fallback(self, state):
+        """Register the handler for any other input while in a state"""
+        def decorator(handler):
+            if state in self._fallbacks:
+                raise ValueError(f"Duplicate fallback for state {state}")
+            self._fallbacks[state] = handler
+            return handler
+        return decorator
+
+    def default(self, handler):
+        """Register the handler for states the flow does not know"""
+        self._default = handler
+        return handler
+
+    def copy(self):
+        """Return a builder with the same registrations, for extending a flow"""
+        flow = Flow()
+        flow._commands = dict(self._commands)
+        flow._prefixes = dict(self._prefixes)
+        flow._options = {state: dict(options) for state, options in self._options.items()}
+        flow._fallbacks = dict(self._fallbacks)
+        flow._default = self._default
+        return flow
+
+    @staticmethod
+    def _add(table, key, handler, kind):
+        if key in table:
+            raise ValueError(f"Duplicate {kind}: {key!r}")
+        table[key] = handler
+
+    def compile(self):
+        """Freeze the flow into a FlowEngine"""
+        if self._default is None:
+            raise ValueError("Flow needs a default handler")
+        states = {}
+        for state in set(self._options) | set(self._fallbacks):
+            states[state] = StateTable(
+                MappingProxyType(dict(self._options.get(state, {}))),
+                self._fallbacks.get(state),
+            )
+        return FlowEngine(dict(self._commands), states, self._default, dict(self._prefixes))
+
+
+class FlowEngine:
+    """Compiled flow: dispatches a message to its handler"""
+
+    def __init__(self, commands, states, default, prefixes=None):
+        self._commands = MappingProxyType(commands)
+        self._prefixes = MappingProxyType(prefixes or {})
+        self._states = MappingProxyType(states)
+        self._default = default
+
+    @property
+    def states(self):
+        return frozenset(self._states)
+
+    def resolve(self, ctx):
+        """Return the handler for a message"""
+        handler = self._commands.get(ctx.lower)
+        if handler is not None:
+            return handler
+        if self._prefixes:
+            words = ctx.text.split(None, 1)
+            if len(words) == 2:
+                handler = self._prefixes.get(words[0].lower())
+                if handler is not None:
+                    ctx.argument = words[1].strip()
+                    return handler
+        table = self._states.get(ctx.state)
+        if table is None:
+            return self._default
+        handler = table.options.get(ctx.text)
+        if handler is not None:
+            return handler
+        return table.fallback or self._default
+
+    def dispatch(self, session, text, phone_number=None, services=None):
+        """Handle one message and return the resulting Step"""
+        ctx = Context(session, text, phone_number, services)
+        return self.resolve(ctx)(ctx)
@@ -0,0 +1,15 @@
+# Loaded automatically when gunicorn starts from this directory.
+# With --preload the app is imported once in the master and forked into the
+# workers; create_app() does no database work, so workers are ready right away.
+
+
+def on_starting(server):
+    # Metrics files of a previous run would be added to this one's
+    from metrics import worker_metrics
+    worker_metrics.clear()
+
+
+def post_fork(server, worker):
+    # Workers must open their own connections instead of sharing the master's
+    from app import dispose_engines
+    dispose_engines(server.app.wsgi())
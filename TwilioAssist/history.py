@@ -0,0 +1,185 @@
+"""A customer's messages and orders in time order, streamed page by page.
+
+Messages and orders are each read with keyset pagination on (timestamp, id)
+over their (phone_number, timestamp) indexes, HISTORY_PAGE_SIZE rows a
+query, and merged as they are read, so memory stays flat however long the
+customer has been chatting. A cursor names the last event sent
+("<timestamp>,<type>,<id>"); passing it back as `after` resumes right after
+it. Times are naive UTC, as stored; `since` is inclusive, `until` exclusive.
+"""
+import os
+import json
+import heapq
+from itertools import islice
+from datetime import datetime, timezone
+from sqlalchemy import select, or_, and_
+from app import db
+from models import Message, MessageTemplate, Order, Product
+
+# Rows per query on each table
+HISTORY_PAGE_SIZE = int(os.environ.get("HISTORY_PAGE_SIZE", "500"))
+HISTORY_MAX_LIMIT = 1000
+
+# At the same instant a message sorts before an order
+KINDS = ('message', 'order')
+FORMATS = ('json', 'ndjson')
+CONTENT_TYPES = {'json': 'application/json', 'ndjson': 'application/x-ndjson; charset=utf-8'}
+
+
+class HistoryError(ValueError):
+    """A malformed filter or cursor"""
+
+
+def parse_time(value, field):
+    """Naive UTC datetime from an ISO 8601 date or date and time, or None"""
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise HistoryError(f"{field} must be an ISO 8601 date or date and time")
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def format_cursor(key):
+    moment, rank, event_id = key
+    return f"{moment.isoformat()},{KINDS[rank]},{event_id}"
+
+
+def parse_cursor(value):
+    """(timestamp, kind rank, id) from a cursor, or None"""
+    if not value:
+        return None
+    try:
+        moment, kind, event_id = value.split(',')
+        return datetime.fromisoformat(moment), KINDS.index(kind), int(event_id)
+    except ValueError:
+        raise HistoryError("after must be a cursor returned by a previous page")
+
+
+def keyset(query, time_column, id_column, since, until, after, page_size):
+    """Yield the rows of a query in (time, id) order, one page per statement
+
+    after is (time, id) to start past that row, or (time, None) to start past that instant.
+    """
+    query = query.where(time_column.is_not(None))
+    if since is not None:
+        query = query.where(time_column >= since)
+    if until is not None:
+        query = query.where(time_column < until)
+    query = query.order_by(time_column, id_column).limit(page_size)
+    while True:
+        page = query
+        if after is not None:
+            after_time, after_id = after
+            if after_id is None:
+                page = page.where(time_column > after_time)
+            else:
+                # The >= bound gives the index a range; the OR alone is only a filter to some planners
+                page = page.where(time_column >= after_time,
+                                  or_(time_column > after_time, and_(time_column == after_time, id_column > after_id)))
+        rows = db.session.execute(page).all()
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = (rows[-1].timestamp, rows[-1].id)
+
+
+def start_after(cursor, rank):
+    """Where the stream of one kind resumes after a cursor"""
+    if cursor is None:
+        return None
+    moment, cursor_rank, event_id = cursor
+    if rank == cursor_rank:
+        return moment, event_id
+    # Events of a later kind at the cursor's instant come after it; of an earlier kind, before it
+    return (moment, 0) if rank > cursor_rank else (moment, None)
+
+
+def message_events(phone_number, since, until, after, page_size):
+    query = (
+        select(Message.id, Message.timestamp, Message.is_incoming, Message.message_body,
+               MessageTemplate.body.label('template_body'))
+        .outerjoin(MessageTemplate, Message.template_id == MessageTemplate.id)
+        .where(Message.phone_number == phone_number)
+    )
+    for row in keyset(query, Message.timestamp, Message.id, since, until, start_after(after, 0), page_size):
+        yield (row.timestamp, 0, row.id), {
+            'type': 'message',
+            'id': row.id,
+            'timestamp': row.timestamp.isoformat(),
+            'direction': 'incoming' if row.is_incoming else 'outgoing',
+            'body': row.template_body if row.template_body is not None else row.message_body,
+        }
+
+
+def order_events(phone_number, since, until, after, page_size):
+    query = (
+        select(Order.id, Order.created_at.label('timestamp'), Order.status, Order.customer_name,
+               Order.product_id, Product.name.label('product_name'), Product.price)
+        .outerjoin(Product, Order.product_id == Product.id)
+        .where(Order.phone_number == phone_number)
+    )
+    for row in keyset(query, Order.created_at, Order.id, since, until, start_after(after, 1), page_size):
+        yield (row.timestamp, 1, row.id), {
+            'type': 'order',
+            'id': row.id,
+            'timestamp': row.timestamp.isoformat(),
+            'status': row.status,
+            'customer_name': row.customer_name,
+            'product_id': row.product_id,
+            'product_name': row.product_name,
+            'price': row.price,
+        }
+
+
+def history_events(phone_number, since=None, until=None, after=None, page_size=HISTORY_PAGE_SIZE):
+    """Yield (cursor key, event dict) for a number's messages and orders in time order"""
+    return heapq.merge(
+        message_events(phone_number, since, until, after, page_size),
+        order_events(phone_number, since, until, after, page_size),
+        key=lambda item: item[0],
+    )
+
+
+def stream_history(phone_number, fmt='json', since=None, until=None, after=None, limit=None,
+                   page_size=HISTORY_PAGE_SIZE):
+    """Yield the history as text chunks of JSON or JSON lines
+
+    With a limit the response ends with the cursor of the next page (null when
+    there is none): `next_after` in JSON, a {"type": "next"} line in JSON lines.
+    """
+    if limit is not None:
+        page_size = min(page_size, limit + 1)
+    events = history_events(phone_number, since, until, after, page_size)
+    if limit is not None:
+        # One more event tells whether there is a next page
+        events = islice(events, limit + 1)
+
+    if fmt == 'json':
+        yield '{"phone_number":' + json.dumps(phone_number) + ',"events":['
+    parts, last_key, count, more = [], None, 0, False
+    for key, event in events:
+        if count == limit:
+            more = True
+            break
+        text = json.dumps(event, ensure_ascii=False, separators=(',', ':'))
+        if fmt == 'json':
+            parts.append(',' + text if count else text)
+        else:
+            parts.append(text + '\n')
+        last_key = key
+        count += 1
+        if len(parts) == page_size:
+            yield ''.join(parts)
+            parts = []
+    if parts:
+        yield ''.join(parts)
+
+    next_after = format_cursor(last_key) if more else None
+    if fmt == 'json':
+        yield '],"next_after":' + json.dumps(next_after) + '}\n'
+    elif limit is not None:
+        yield json.dumps({'type': 'next', 'after': next_after}) + '\n'
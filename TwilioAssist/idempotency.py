@@ -0,0 +1,82 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import select, delete
+from app import db
+from models import ProcessedMessage
+
+# Recent MessageSids answered from memory before the database is consulted
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", "10000"))
+# Twilio stops retrying long before this; older records are only kept for auditing
+IDEMPOTENCY_RETENTION_HOURS = int(os.environ.get("IDEMPOTENCY_RETENTION_HOURS", "48"))
+
+
+class ProcessedMessages:
+    """LRU of handled MessageSids in front of the durable ProcessedMessage table
+
+    Replies are kept as encoded TwiML, the table stores them as text.
+    """
+
+    def __init__(self, maxsize=IDEMPOTENCY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._replies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, message_sid, response):
+        with self._lock:
+            self._replies[message_sid] = response
+            self._replies.move_to_end(message_sid)
+            while len(self._replies) > self.maxsize:
+                self._replies.popitem(last=False)
+
+    def cached(self, message_sid):
+        """The stored TwiML if this worker remembers the MessageSid, without touching the database"""
+        with self._lock:
+            response = self._replies.get(message_sid)
+            if response is not None:
+                self._replies.move_to_end(message_sid)
+            return response
+
+    def get(self, message_sid, session=None):
+        """Return the stored TwiML for a MessageSid that was already handled, or None"""
+        response = self.cached(message_sid)
+        if response is not None:
+            return response
+
+        # Another worker may have handled it, or this one restarted since
+        session = session or db.session
+        response = session.execute(
+            select(ProcessedMessage.response).where(ProcessedMessage.message_sid == message_sid)
+        ).scalar()
+        if response is not None:
+            response = response.encode()
+            self._remember(message_sid, response)
+        return response
+
+    def record(self, message_sid, phone_number, response, session=None):
+        """Store the reply in the caller's transaction; a concurrent duplicate fails its commit"""
+        session = session or db.session
+        session.add(ProcessedMessage(message_sid=message_sid, phone_number=phone_number, response=response.decode()))
+
+    def committed(self, message_sid, response):
+        """Cache the reply once the transaction that recorded it has committed"""
+        self._remember(message_sid, response)
+
+    def clear(self):
+        with self._lock:
+            self._replies.clear()
+
+
+processed_messages = ProcessedMessages()
+
+
+def prune_processed_messages(hours=IDEMPOTENCY_RETENTION_HOURS, session=None):
+    """Delete processed message records older than `hours`; returns the count"""
+    session = session or db.session
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    result = session.execute(delete(ProcessedMessage).where(ProcessedMessage.created_at < cutoff))
+    session.commit()
+    logging.info(f"Pruned {result.rowcount} processed message ids")
+    return result.rowcount
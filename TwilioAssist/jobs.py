@@ -0,0 +1,244 @@
+"""Durable job queue kept in the Job table.
+
+The webhook and the admin API only insert Job rows, in their own
+transactions. Job workers, started with `flask --app main run-jobs` as
+processes separate from the web workers, claim due jobs in batches with
+SELECT ... FOR UPDATE SKIP LOCKED (on PostgreSQL; elsewhere the conditional
+claim update alone keeps two workers from taking the same job), hand each
+kind to its handler (registered with @job_handler, see orders.py) and record the outcome in the same transaction as the
+handler's changes. A job that fails is retried with exponential backoff;
+a worker that dies leaves its jobs running until JOB_LOCK_TIMEOUT, after
+which they are queued again. Handlers must be idempotent.
+"""
+import os
+import time
+import signal
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete, func
+from app import db
+from models import Job
+from metrics import Counter, Histogram
+
+# Worker threads per `run-jobs` process; scale further by running more processes
+JOB_WORKER_THREADS = int(os.environ.get("JOB_WORKER_THREADS", "2"))
+JOB_BATCH_SIZE = int(os.environ.get("JOB_BATCH_SIZE", "50"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1.0"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+# Seconds before the first retry, doubled on each further attempt
+JOB_RETRY_BACKOFF = float(os.environ.get("JOB_RETRY_BACKOFF", "30"))
+# A running job whose worker has not finished it in this many seconds is queued again
+JOB_LOCK_TIMEOUT = int(os.environ.get("JOB_LOCK_TIMEOUT", "300"))
+# Finished jobs are deleted after this many hours
+JOB_RETENTION_HOURS = int(os.environ.get("JOB_RETENTION_HOURS", "168"))
+JOB_PRUNE_INTERVAL = int(os.environ.get("JOB_PRUNE_INTERVAL", "3600"))
+
+JOBS_PROCESSED = Counter('jobs_processed_total', "Background jobs run by outcome", ('kind', 'outcome'))
+JOB_LAG_SECONDS = Histogram('job_lag_seconds', "Time between a job becoming due and a worker claiming it", ('kind',))
+
+# kind -> handler(jobs) returning {job_id: error message} for the jobs that failed
+HANDLERS = {}
+
+
+def job_handler(*kinds):
+    """Register a batch handler for one or more job kinds"""
+    def decorator(fn):
+        for kind in kinds:
+            if kind in HANDLERS:
+                raise ValueError(f"Duplicate job handler: {kind!r}")
+            HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+def enqueue(kind, order_id=None, run_at=None, session=None):
+    """Add a job to the caller's transaction"""
+    job = Job(kind=kind, order_id=order_id, status='queued', attempts=0, run_at=run_at or datetime.utcnow())
+    (session or db.session).add(job)
+    return job
+
+
+def requeue_stale_jobs(session, now=None):
+    """Queue again the jobs of workers that stopped without finishing them"""
+    stale = (now or datetime.utcnow()) - timedelta(seconds=JOB_LOCK_TIMEOUT)
+    result = session.execute(
+        update(Job).where(Job.status == 'running', Job.locked_at < stale)
+        .values(status='queued', locked_by=None, locked_at=None)
+    )
+    session.commit()
+    if result.rowcount:
+        logging.warning(f"Requeued {result.rowcount} stale jobs")
+    return result.rowcount
+
+
+def claim_jobs(session, worker_id, limit=JOB_BATCH_SIZE, kinds=None, now=None):
+    """Take up to `limit` due jobs for this worker; returns (id, kind, order_id, attempts, run_at) rows"""
+    now = now or datetime.utcnow()
+    due = (Job.status == 'queued') & (Job.run_at <= now)
+    if kinds:
+        due = due & Job.kind.in_(kinds)
+    # Served by ix_job_status_run_at; rows locked by another worker are skipped
+    ids = session.execute(
+        select(Job.id).where(due).order_by(Job.run_at, Job.id).limit(limit).with_for_update(skip_locked=True)
+    ).scalars().all()
+    if not ids:
+        session.rollback()
+        return []
+    # The condition is repeated so a job claimed elsewhere in the meantime is left alone
+    session.execute(
+        update(Job).where(Job.id.in_(ids), due)
+        .values(status='running', locked_by=worker_id, locked_at=now, attempts=Job.attempts + 1)
+        .execution_options(synchronize_session=False)
+    )
+    session.commit()
+    jobs = session.execute(
+        select(Job.id, Job.kind, Job.order_id, Job.attempts, Job.run_at)
+        .where(Job.id.in_(ids), Job.locked_by == worker_id, Job.locked_at == now).order_by(Job.id)
+    ).all()
+    for job in jobs:
+        JOB_LAG_SECONDS.observe(max((now - job.run_at).total_seconds(), 0.0), job.kind)
+    return jobs
+
+
+def finish_jobs(session, jobs, errors, now=None):
+    """Mark jobs done, or schedule a retry / give up for those with an error (caller commits)"""
+    now = now or datetime.utcnow()
+    updates = []
+    for job in jobs:
+        error = errors.get(job.id)
+        if error is None:
+            outcome = 'done'
+            updates.append({'id': job.id, 'status': 'done', 'error': None, 'locked_by': None, 'finished_at': now})
+        elif job.attempts >= JOB_MAX_ATTEMPTS:
+            outcome = 'failed'
+            updates.append({'id': job.id, 'status': 'failed', 'error': error, 'locked_by': None, 'finished_at': now})
+        else:
+            outcome = 'retry'
+            retry_at = now + timedelta(seconds=JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1))
+            updates.append({'id': job.id, 'status': 'queued', 'error': error, 'locked_by': None, 'run_at': retry_at})
+        JOBS_PROCESSED.inc(job.kind, outcome)
+    # Rows are grouped by their keys so each group is one executemany
+    by_keys = {}
+    for row in updates:
+        by_keys.setdefault(tuple(sorted(row)), []).append(row)
+    for rows in by_keys.values():
+        session.execute(update(Job), rows)
+
+
+def run_jobs(session, jobs):
+    """Run claimed jobs through their handlers; each kind commits with its job outcomes"""
+    by_kind = {}
+    for job in jobs:
+        by_kind.setdefault(job.kind, []).append(job)
+
+    for kind, batch in by_kind.items():
+        handler = HANDLERS.get(kind)
+        if handler is None:
+            errors = {job.id: f"No handler for job kind {kind!r}" for job in batch}
+        else:
+            try:
+                errors = handler(batch) or {}
+                session.flush()
+            except Exception as e:
+                logging.exception(f"Error running {kind} jobs")
+                # The handler's changes go, the error is recorded on every job of the batch
+                session.rollback()
+                errors = {job.id: str(e) for job in batch}
+        finish_jobs(session, batch, errors)
+        session.commit()
+    return len(jobs)
+
+
+def prune_jobs(hours=JOB_RETENTION_HOURS):
+    """Delete jobs that finished more than `hours` ago; returns the count"""
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    result = db.session.execute(
+        delete(Job).where(Job.status.in_(['done', 'failed']), Job.finished_at < cutoff)
+    )
+    db.session.commit()
+    logging.info(f"Pruned {result.rowcount} finished jobs")
+    return result.rowcount
+
+
+def queue_summary():
+    """Job counts by kind and status"""
+    rows = db.session.execute(select(Job.kind, Job.status, func.count(Job.id)).group_by(Job.kind, Job.status))
+    summary = {}
+    for kind, status, count in rows:
+        summary.setdefault(kind, {})[status] = count
+    return summary
+
+
+class JobWorker:
+    """Claims and runs jobs in a loop; several can run in one process"""
+
+    def __init__(self, app, name, batch_size=JOB_BATCH_SIZE, poll_interval=JOB_POLL_INTERVAL, kinds=None):
+        self.app = app
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{name}"
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.kinds = kinds
+
+    def run_once(self):
+        """Claim and run one batch; returns the number of jobs run"""
+        jobs = claim_jobs(db.session, self.worker_id, self.batch_size, self.kinds)
+        if not jobs:
+            return 0
+        return run_jobs(db.session, jobs)
+
+    def run(self, stop, housekeeping=False):
+        """Work until `stop` is set; one worker per process also requeues stale jobs and prunes"""
+        last_housekeeping = last_prune = 0.0
+        with self.app.app_context():
+            while not stop.is_set():
+                try:
+                    if housekeeping and time.monotonic() - last_housekeeping >= JOB_LOCK_TIMEOUT / 4:
+                        last_housekeeping = time.monotonic()
+                        requeue_stale_jobs(db.session)
+                    if housekeeping and JOB_PRUNE_INTERVAL and time.monotonic() - last_prune >= JOB_PRUNE_INTERVAL:
+                        last_prune = time.monotonic()
+                        prune_jobs()
+                    # A full batch means more is probably waiting
+                    if self.run_once() >= self.batch_size:
+                        continue
+                except Exception as e:
+                    logging.error(f"Error in job worker {self.worker_id}: {str(e)}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+                stop.wait(self.poll_interval)
+
+
+def run_workers(app, threads=1, once=False, kinds=None):
+    """Run job workers in this process until interrupted (or until the queue is drained with once)"""
+    if once:
+        worker = JobWorker(app, 'once', kinds=kinds)
+        total = 0
+        with app.app_context():
+            while True:
+                count = worker.run_once()
+                total += count
+                if not count:
+                    return total
+
+    stop = threading.Event()
+    workers = [JobWorker(app, f"t{i}", kinds=kinds) for i in range(threads)]
+    pool = [
+        threading.Thread(target=w.run, args=(stop, i == 0), name=f"job-worker-{i}", daemon=True)
+        for i, w in enumerate(workers)
+    ]
+    # Let the current batches finish on SIGTERM from a process manager
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    for thread in pool:
+        thread.start()
+    logging.info(f"Started {threads} job workers")
+    try:
+        while not stop.is_set() and any(thread.is_alive() for thread in pool):
+            stop.wait(1)
+    except KeyboardInterrupt:
+        stop.set()
+    for thread in pool:
+        thread.join()
+    return None
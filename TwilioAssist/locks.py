@@ -0,0 +1,69 @@
+import os
+import sys
+import asyncio
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from sqlalchemy.util.concurrency import in_greenlet, await_only
+
+# Number of locks phone numbers are hashed onto within one process
+CONVERSATION_LOCK_STRIPES = int(os.environ.get("CONVERSATION_LOCK_STRIPES", "64"))
+# Seconds between tries at a busy lock from inside AsyncSession.run_sync
+LOCK_POLL_INTERVAL = 0.001
+
+
+@contextmanager
+def hold_lock(lock):
+    """Hold a threading lock that may also be taken inside AsyncSession.run_sync
+
+    Every run_sync call of the ASGI app runs on the event loop thread, so one
+    that blocked on a lock another holds across a query would stop the loop
+    for good; those wait by yielding to the loop instead.
+    """
+    # greenlet is only imported once an async engine is in use
+    if 'greenlet' not in sys.modules or not in_greenlet():
+        with lock:
+            yield
+        return
+    while not lock.acquire(blocking=False):
+        await_only(asyncio.sleep(LOCK_POLL_INTERVAL))
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+class StripedLock:
+    """Fixed set of locks keyed by hash, so memory does not grow with the number of keys"""
+
+    def __init__(self, stripes=CONVERSATION_LOCK_STRIPES):
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def lock_for(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    @contextmanager
+    def hold(self, key):
+        """Hold the lock for a key; unrelated keys sharing a stripe just wait their turn"""
+        with self.lock_for(key):
+            yield
+
+
+class AsyncStripedLock:
+    """StripedLock for coroutines sharing one event loop (the ASGI app)"""
+
+    def __init__(self, stripes=CONVERSATION_LOCK_STRIPES):
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+
+    def lock_for(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    @asynccontextmanager
+    async def hold(self, key):
+        async with self.lock_for(key):
+            yield
+
+
+# Serializes messages of the same number inside a worker; across workers the
+# row lock and Conversation.version take over
+conversation_locks = StripedLock()
+async_conversation_locks = AsyncStripedLock()
@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+from metrics import Counter
+
+# "text" keeps the synchronous development output, "json" hands records to a background writer
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG" if LOG_FORMAT == "text" else "INFO")
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Fraction of records kept per category, e.g. "webhook.message=0.1,webhook.reply=0.1"
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")
+# Salt for phone number hashes, so they can be correlated but not reversed from a table
+LOG_HASH_SALT = os.environ.get("LOG_HASH_SALT", "")
+
+LOG_RECORDS_DROPPED = Counter('log_records_dropped_total', "Log records dropped because the queue was full")
+LOG_RECORDS_SAMPLED_OUT = Counter('log_records_sampled_out_total', "Log records skipped by sampling", ('category',))
+
+# Attributes every LogRecord has; anything else came in through `extra`
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def parse_sample_rates(value):
+    rates = {}
+    for item in value.split(','):
+        if '=' in item:
+            category, rate = item.split('=', 1)
+            rates[category.strip()] = float(rate)
+    return rates
+
+
+def hash_phone(phone_number):
+    return hashlib.sha256((LOG_HASH_SALT + phone_number).encode('utf-8')).hexdigest()[:16]
+
+
+def record_fields(record):
+    return {k: v for k, v in vars(record).items() if k not in RECORD_ATTRIBUTES}
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fixed fraction of the records of each sampled category"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        category = getattr(record, 'category', None)
+        rate = self.rates.get(category)
+        if rate is None or rate >= 1 or random.random() < rate:
+            return True
+        LOG_RECORDS_SAMPLED_OUT.inc(category)
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; phone numbers are hashed and message texts reduced to lengths"""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record_fields(record).items():
+            if key == 'phone':
+                data['phone_hash'] = hash_phone(value)
+            elif key in ('body', 'reply'):
+                data[f'{key}_length'] = len(value)
+            else:
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """The default basicConfig layout followed by the record's extra fields"""
+
+    def __init__(self):
+        super().__init__(logging.BASIC_FORMAT)
+
+    def format(self, record):
+        text = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            text += " " + " ".join(f"{k}={v!r}" for k, v in fields.items())
+        return text
+
+
+class QueueLogHandler(logging.Handler):
+    """Bounded queue of records written by a background thread; drops instead of blocking"""
+
+    def __init__(self, target, maxsize=LOG_QUEUE_SIZE):
+        super().__init__()
+        self.target = target
+        self.maxsize = maxsize
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so each worker process starts its own writer
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.maxsize)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, args=(self._queue,), name="log-writer", daemon=True)
+            self._thread.start()
+
+    def emit(self, record):
+        # Formatting is left to the writer thread; only exception text is
+        # rendered here, while the traceback is still alive
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+    def _run(self, records):
+        while True:
+            record = records.get()
+            if record is None:
+                break
+            self.target.handle(record)
+
+    def close(self):
+        """Write what is queued and stop the writer"""
+        if self._thread is not None and self._pid == os.getpid():
+            try:
+                self._queue.put(None, timeout=1)
+                self._thread.join(timeout=5)
+            except queue.Full:
+                pass
+        self._thread = None
+        super().close()
+
+
+def configure_logging():
+    """Set up the root logger according to LOG_FORMAT"""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    stream = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        stream.setFormatter(JsonFormatter())
+        handler = QueueLogHandler(stream)
+        atexit.register(handler.close)
+    else:
+        stream.setFormatter(TextFormatter())
+        handler = stream
+
+    rates = parse_sample_rates(LOG_SAMPLE_RATES)
+    if rates:
+        handler.addFilter(SamplingFilter(rates))
+    root.addHandler(handler)
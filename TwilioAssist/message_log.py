@@ -0,0 +1,171 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+from app import db
+from metrics import Counter
+from models import Message
+from message_templates import template_registry
+from stats import record_messages
+
+# "sync" writes history rows in the webhook transaction, "async" hands them to a background writer
+MESSAGE_LOG_MODE = os.environ.get("MESSAGE_LOG_MODE", "sync")
+MESSAGE_LOG_QUEUE_SIZE = int(os.environ.get("MESSAGE_LOG_QUEUE_SIZE", "10000"))
+MESSAGE_LOG_BATCH_SIZE = int(os.environ.get("MESSAGE_LOG_BATCH_SIZE", "500"))
+MESSAGE_LOG_FLUSH_INTERVAL = float(os.environ.get("MESSAGE_LOG_FLUSH_INTERVAL", "1.0"))
+# A batch the database refuses is retried after 0.5s, 1s... before it is dropped
+MESSAGE_LOG_MAX_ATTEMPTS = int(os.environ.get("MESSAGE_LOG_MAX_ATTEMPTS", "4"))
+MESSAGE_LOG_RETRY_BACKOFF = float(os.environ.get("MESSAGE_LOG_RETRY_BACKOFF", "0.5"))
+
+MESSAGE_LOG_DROPPED = Counter('message_log_rows_dropped_total', "History rows dropped, by reason (queue_full, write_failed)",
+                              ['reason'])
+
+
+class MessageLogWriter:
+    """Bounded queue of Message rows flushed in bulk by a background thread"""
+
+    def __init__(self, maxsize=MESSAGE_LOG_QUEUE_SIZE, batch_size=MESSAGE_LOG_BATCH_SIZE,
+                 flush_interval=MESSAGE_LOG_FLUSH_INTERVAL):
+        self.app = None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self.stop)
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so each worker process starts its own writer
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="message-log-writer", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, row):
+        """Queue a row for the writer; returns False when the queue is full"""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+            return True
+        except queue.Full:
+            return False
+
+    def _drain(self, limit):
+        rows = []
+        while len(rows) < limit:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            rows = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size and not self._stop.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(rows)
+
+    def _write(self, rows):
+        if not rows:
+            return
+        for attempt in range(MESSAGE_LOG_MAX_ATTEMPTS):
+            try:
+                with self.app.app_context():
+                    db.session.execute(insert(Message), rows)
+                    written_at = time.time()
+                    db.session.commit()
+                break
+            except Exception as e:
+                if attempt + 1 >= MESSAGE_LOG_MAX_ATTEMPTS:
+                    MESSAGE_LOG_DROPPED.inc('write_failed', amount=len(rows))
+                    logging.error(f"Dropped {len(rows)} queued messages after {attempt + 1} attempts: {str(e)}")
+                    return
+                logging.warning(f"Error writing {len(rows)} queued messages, retrying: {str(e)}")
+                # New rows wait in the queue meanwhile; once it is full they are dropped
+                time.sleep(MESSAGE_LOG_RETRY_BACKOFF * 2 ** attempt)
+        record_messages(rows, written_at)
+
+    def flush(self):
+        """Write everything currently queued"""
+        rows = self._drain(self.batch_size)
+        while rows:
+            self._write(rows)
+            rows = self._drain(self.batch_size)
+
+    def stop(self):
+        """Stop the writer thread and flush what is left"""
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval * 2)
+        self._thread = None
+        if self.app is not None:
+            self.flush()
+
+
+message_log = MessageLogWriter()
+
+
+def log_message(phone_number, message_body, is_incoming=True, session=None):
+    """Record a message in the history without committing"""
+    session = session or db.session
+    # Canonical bot replies are stored as a reference instead of the full text;
+    # the registry is loaded on the first call, which comes before the webhook writes
+    templates = template_registry.ensure_loaded(session)
+    template_id = None if is_incoming else templates.get(message_body)
+    row = {
+        'phone_number': phone_number,
+        'message_body': '' if template_id else message_body,
+        'is_incoming': is_incoming,
+        'timestamp': datetime.utcnow(),
+        'template_id': template_id,
+    }
+    if MESSAGE_LOG_MODE == "async":
+        # Handed to the writer when the caller commits, so a rolled back or
+        # retried webhook leaves no history behind
+        session.info.setdefault('queued_messages', []).append(row)
+        return
+    session.add(Message(**row))
+
+
+@event.listens_for(Session, 'after_commit')
+def _enqueue_committed_messages(session):
+    rows = session.info.pop('queued_messages', None)
+    if not rows:
+        return
+    overflow = sum(not message_log.enqueue(row) for row in rows)
+    if overflow:
+        # Writing them here would hold the request while the database is struggling
+        MESSAGE_LOG_DROPPED.inc('queue_full', amount=overflow)
+        logging.warning("Message log queue full, dropped %s rows", overflow, extra={'category': 'message_log.dropped'})
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_rolled_back_messages(session):
+    session.info.pop('queued_messages', None)
@@ -0,0 +1,78 @@
+import hashlib
+import logging
+import threading
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+from models import MessageTemplate
+from locks import hold_lock
+from dialog import (
+    MAIN_MENU, HELP_TEXT, DONATION_OPTIONS_TEXT, INVALID_MAIN_MENU, NOT_UNDERSTOOD,
+    DONATION_OPTIONS, process_donation_selection,
+)
+
+# Long bot replies that repeat verbatim; stored once and referenced from Message
+CANONICAL_TEMPLATES = {
+    'main_menu': MAIN_MENU,
+    'help': HELP_TEXT,
+    'donation_options': DONATION_OPTIONS_TEXT,
+    'invalid_main_menu': INVALID_MAIN_MENU,
+    'not_understood': NOT_UNDERSTOOD,
+    **{f'donation_selection_{option}': process_donation_selection(option) for option in DONATION_OPTIONS},
+}
+
+
+def checksum(body):
+    return hashlib.sha256(body.encode('utf-8')).hexdigest()
+
+
+class TemplateRegistry:
+    """Maps canonical reply texts to MessageTemplate ids, loaded on first use"""
+
+    def __init__(self, templates):
+        self.templates = templates
+        self._ids = None
+        self._lock = threading.Lock()
+
+    def _load(self, bind):
+        by_checksum = {checksum(body): (key, body) for key, body in self.templates.items()}
+        # Own transaction, so template rows survive a rollback of the caller's work
+        with bind.connect() as conn:
+            rows = dict(conn.execute(
+                select(MessageTemplate.checksum, MessageTemplate.id)
+                .where(MessageTemplate.checksum.in_(list(by_checksum)))
+            ).all())
+            missing = [c for c in by_checksum if c not in rows]
+            if missing:
+                try:
+                    conn.execute(insert(MessageTemplate), [
+                        {'key': by_checksum[c][0], 'checksum': c, 'body': by_checksum[c][1]} for c in missing
+                    ])
+                    conn.commit()
+                    logging.info(f"Registered {len(missing)} message templates")
+                except IntegrityError:
+                    conn.rollback()  # another worker registered them first
+                rows = dict(conn.execute(
+                    select(MessageTemplate.checksum, MessageTemplate.id)
+                    .where(MessageTemplate.checksum.in_(list(by_checksum)))
+                ).all())
+        return {body: rows[c] for c, (key, body) in by_checksum.items() if c in rows}
+
+    def ensure_loaded(self, session):
+        """Load (and register) the templates; call before the session writes,
+        since SQLite cannot take a second writer while it holds a transaction"""
+        if self._ids is None:
+            with hold_lock(self._lock):
+                if self._ids is None:
+                    self._ids = self._load(session.get_bind())
+        return self._ids
+
+    def id_for(self, text, session):
+        """Return the template id for a canonical reply, or None"""
+        return self.ensure_loaded(session).get(text)
+
+    def items(self):
+        """Yield (template_id, body) for the registered templates"""
+        return ((template_id, body) for body, template_id in (self._ids or {}).items())
+
+
+template_registry = TemplateRegistry(CANONICAL_TEMPLATES)
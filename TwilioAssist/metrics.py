@@ -0,0 +1,344 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import threading
+from contextlib import contextmanager
+from flask import Blueprint, Response, g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Set to 0 to skip all instrumentation; /metrics then only shows empty series
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+# A directory the workers of one server share (gunicorn.conf.py empties it on
+# start); each worker writes its metrics there and /metrics adds them all up.
+# Unset, /metrics shows only the worker that answers the scrape
+METRICS_MULTIPROC_DIR = os.environ.get("METRICS_MULTIPROC_DIR")
+# Seconds between writes of a worker's metrics; other workers' series lag by up to this
+METRICS_WRITE_INTERVAL = float(os.environ.get("METRICS_WRITE_INTERVAL", "5"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+# Create blueprint
+metrics_bp = Blueprint('metrics', __name__)
+
+REGISTRY = []
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{n}="{escape(v)}"' for n, v in (*zip(names, values), *extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with optional labels, kept per process"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._values.items())
+
+    def combine(self, snapshots):
+        return add_values(snapshots)
+
+    def samples(self, values=None):
+        if values is None:
+            values = dict(self.snapshot())
+        for labelvalues, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, labelvalues)} {value}"
+
+
+class Histogram:
+    """Fixed-bucket histogram with optional labels, kept per process"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), then sum
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [(k, list(v)) for k, v in self._series.items()]
+
+    def combine(self, snapshots):
+        series = {}
+        for snapshot in snapshots:
+            for labelvalues, counts in snapshot:
+                total = series.setdefault(tuple(labelvalues), [0] * len(counts))
+                for i, count in enumerate(counts):
+                    total[i] += count
+        return series
+
+    def samples(self, series=None):
+        if series is None:
+            series = dict(self.snapshot())
+        for labelvalues, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                labels = format_labels(self.labelnames, labelvalues, (('le', bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {counts[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge:
+    """Values read when /metrics is scraped; collect returns {labelvalues: value}"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), collect=dict):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        REGISTRY.append(self)
+
+    def snapshot(self):
+        return list(self.collect().items())
+
+    def combine(self, snapshots):
+        return add_values(snapshots)
+
+    def samples(self, values=None):
+        if values is None:
+            values = dict(self.snapshot())
+        for labelvalues, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, labelvalues)} {value}"
+
+
+def add_values(snapshots):
+    """Sum (labelvalues, value) snapshots of several processes by labels"""
+    values = {}
+    for snapshot in snapshots:
+        for labelvalues, value in snapshot:
+            labelvalues = tuple(labelvalues)
+            values[labelvalues] = values.get(labelvalues, 0) + value
+    return values
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WorkerMetrics:
+    """Each worker's metrics as a file in METRICS_MULTIPROC_DIR, added up when /metrics is scraped
+
+    Counters and histograms of workers that exited are kept, so the totals
+    never go down; gauges only count live workers.
+    """
+
+    def __init__(self, directory=METRICS_MULTIPROC_DIR, interval=METRICS_WRITE_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.path = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so each worker process starts its own writer
+        if self.directory is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            os.makedirs(self.directory, exist_ok=True)
+            # The start time keeps a reused pid from overwriting a dead worker's counters
+            self.path = os.path.join(self.directory, f"{self._pid}-{time.time_ns()}.json")
+            threading.Thread(target=self._run, name="metrics-writer", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.write()
+
+    def write(self):
+        """Write this worker's metrics"""
+        if self._pid != os.getpid():
+            return
+        data = {'pid': self._pid, 'metrics': {metric.name: metric.snapshot() for metric in REGISTRY}}
+        with self._write_lock:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(self.path + '.tmp', self.path)
+
+    def read(self):
+        """Every worker's metrics, this one's as of now"""
+        self._ensure_started()
+        self.write()
+        workers = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    workers.append(json.load(f))
+            except (OSError, ValueError):
+                # Removed since the listing
+                continue
+        return workers
+
+    def clear(self):
+        """Remove the files of a previous server; run before the workers start"""
+        if self.directory is None or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(('.json', '.tmp')):
+                os.remove(os.path.join(self.directory, name))
+
+
+worker_metrics = WorkerMetrics()
+atexit.register(worker_metrics.write)
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format"""
+    workers = worker_metrics.read() if worker_metrics.directory else None
+    if workers is not None:
+        live = [worker for worker in workers if process_alive(worker['pid'])]
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        if workers is None:
+            lines.extend(metric.samples())
+        else:
+            sources = live if metric.kind == 'gauge' else workers
+            lines.extend(metric.samples(metric.combine(
+                [worker['metrics'][metric.name] for worker in sources if metric.name in worker['metrics']]
+            )))
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', "Time spent handling HTTP requests", ('endpoint', 'method', 'status'))
+HTTP_REQUEST_SQL = Histogram(
+    'http_request_sql_statements', "SQL statements executed per HTTP request", ('endpoint',), COUNT_BUCKETS)
+WEBHOOK_STAGE_SECONDS = Histogram(
+    'webhook_stage_duration_seconds', "Time spent in each webhook stage (state includes catalog)", ('stage',))
+WEBHOOK_MESSAGES = Counter(
+    'webhook_messages_total', "Inbound messages by outcome", ('outcome',))
+SQL_STATEMENTS = Counter(
+    'sql_statements_total', "SQL statements executed, including background writers")
+SQL_SECONDS = Histogram(
+    'sql_statement_duration_seconds', "SQL statement execution time")
+TWILIO_REQUEST_SECONDS = Histogram(
+    'twilio_request_duration_seconds', "Outbound Twilio API calls including retries", ('outcome',))
+TWILIO_RETRIES = Counter(
+    'twilio_retries_total', "Outbound Twilio API retries")
+
+
+@contextmanager
+def stage(name):
+    """Time one stage of the webhook"""
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        WEBHOOK_STAGE_SECONDS.observe(time.perf_counter() - start, name)
+
+
+def record_twilio_request(seconds, retries, failed):
+    if METRICS_ENABLED:
+        TWILIO_REQUEST_SECONDS.observe(seconds, 'failed' if failed else 'ok')
+        if retries:
+            TWILIO_RETRIES.inc(amount=retries)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _sql_started(conn, cursor, statement, parameters, context, executemany):
+    if METRICS_ENABLED:
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _sql_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    SQL_SECONDS.observe(time.perf_counter() - started.pop())
+    SQL_STATEMENTS.inc()
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+
+
+@event.listens_for(Engine, 'handle_error')
+def _sql_failed(context):
+    started = context.connection.info.get('query_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+def init_app(app):
+    """Time every request and count the SQL it runs"""
+    if not METRICS_ENABLED:
+        return
+
+    @app.before_request
+    def _start_timer():
+        worker_metrics._ensure_started()
+        g.request_started = time.perf_counter()
+        g.sql_statements = 0
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint, request.method,
+                                         str(response.status_code))
+            HTTP_REQUEST_SQL.observe(g.get('sql_statements', 0), endpoint)
+        return response
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of this worker's metrics, or of every worker's with METRICS_MULTIPROC_DIR"""
+    return Response(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,163 @@
+import logging
+from sqlalchemy import inspect, select, insert, update, delete, func, text
+from app import db
+from models import Broadcast, Conversation, Job, Message, MessageTemplate, Order, ProcessedMessage, SchemaMigration, StatCounter
+
+# (version, name, function) in the order they must run
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """Register a migration step"""
+    def decorator(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def find_index(table, name):
+    """Return the model Index declared on a table by name"""
+    for index in table.indexes:
+        if index.name == name:
+            return index
+    raise KeyError(name)
+
+
+def postgresql_index_valid(engine, name):
+    """pg_index.indisvalid of an index: None if there is none, False if a concurrent build left it INVALID"""
+    with engine.connect() as conn:
+        return conn.execute(
+            text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {'name': name}
+        ).scalar()
+
+
+def create_index(engine, index):
+    """Create an index if it is missing, without blocking writes on PostgreSQL"""
+    table = index.table
+    quote = engine.dialect.identifier_preparer.quote
+    if engine.dialect.name == 'postgresql':
+        # A CREATE INDEX CONCURRENTLY that failed or was cancelled leaves an
+        # INVALID index behind: it slows every write and no query can use it
+        valid = postgresql_index_valid(engine, quote(index.name))
+        if valid:
+            return
+        if valid is False:
+            logging.warning(f"Index {index.name} is invalid, rebuilding it")
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {quote(index.name)}"))
+    elif index.name in {ix['name'] for ix in inspect(engine).get_indexes(table.name)}:
+        return
+
+    columns = ", ".join(quote(c.name) for c in index.columns)
+    unique = "UNIQUE " if index.unique else ""
+    if engine.dialect.name == 'postgresql':
+        # CONCURRENTLY cannot run inside a transaction block
+        sql = f"CREATE {unique}INDEX CONCURRENTLY {quote(index.name)} ON {quote(table.name)} ({columns})"
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(sql))
+    else:
+        sql = f"CREATE {unique}INDEX {quote(index.name)} ON {quote(table.name)} ({columns})"
+        with engine.begin() as conn:
+            conn.execute(text(sql))
+    logging.info(f"Created index {index.name}")
+
+
+def add_column(engine, table, column):
+    """Add a nullable column to an existing table if it is missing"""
+    existing = {c['name'] for c in inspect(engine).get_columns(table.name)}
+    if column.name in existing:
+        return
+    quote = engine.dialect.identifier_preparer.quote
+    column_type = column.type.compile(dialect=engine.dialect)
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}"))
+    logging.info(f"Added column {table.name}.{column.name}")
+
+
+@migration(1, "phone number lookup indexes")
+def _phone_number_indexes(engine):
+    # The unique index needs one conversation per number; keep the oldest row,
+    # which is the one filter_by(...).first() has been returning
+    with engine.begin() as conn:
+        keep = select(func.min(Conversation.id)).group_by(Conversation.phone_number)
+        result = conn.execute(delete(Conversation.__table__).where(Conversation.id.not_in(keep)))
+        if result.rowcount:
+            logging.warning(f"Removed {result.rowcount} duplicate conversations")
+
+    create_index(engine, find_index(Conversation.__table__, 'ix_conversation_phone_number'))
+    create_index(engine, find_index(Message.__table__, 'ix_message_phone_number_timestamp'))
+    create_index(engine, find_index(Order.__table__, 'ix_order_phone_number_created_at'))
+
+
+@migration(2, "message template references and retention index")
+def _message_template_column(engine):
+    MessageTemplate.__table__.create(engine, checkfirst=True)
+    add_column(engine, Message.__table__, Message.__table__.c.template_id)
+    create_index(engine, find_index(Message.__table__, 'ix_message_timestamp'))
+
+
+@migration(3, "admin statistics counters")
+def _stat_counters(engine):
+    StatCounter.__table__.create(engine, checkfirst=True)
+    create_index(engine, find_index(Conversation.__table__, 'ix_conversation_last_message_at'))
+
+
+@migration(4, "processed Twilio message ids")
+def _processed_messages(engine):
+    ProcessedMessage.__table__.create(engine, checkfirst=True)
+
+
+@migration(5, "conversation version column")
+def _conversation_version(engine):
+    add_column(engine, Conversation.__table__, Conversation.__table__.c.version)
+    with engine.begin() as conn:
+        conn.execute(update(Conversation.__table__).where(Conversation.version.is_(None)).values(version=0))
+
+
+@migration(6, "conversation expiry index")
+def _conversation_expiry_index(engine):
+    create_index(engine, find_index(Conversation.__table__, 'ix_conversation_state_last_message_at'))
+
+
+@migration(7, "conversation search query column")
+def _conversation_search_query(engine):
+    add_column(engine, Conversation.__table__, Conversation.__table__.c.search_query)
+
+
+@migration(8, "background job queue")
+def _job_queue(engine):
+    Job.__table__.create(engine, checkfirst=True)
+
+
+@migration(9, "broadcast owner column")
+def _broadcast_owner(engine):
+    add_column(engine, Broadcast.__table__, Broadcast.__table__.c.owner)
+
+
+@migration(10, "rebuild invalid concurrent indexes")
+def _rebuild_invalid_indexes(engine):
+    # Earlier runs took an INVALID index for a built one; create_index now rebuilds those
+    for table, name in ((Conversation.__table__, 'ix_conversation_phone_number'),
+                        (Message.__table__, 'ix_message_phone_number_timestamp'),
+                        (Order.__table__, 'ix_order_phone_number_created_at'),
+                        (Message.__table__, 'ix_message_timestamp'),
+                        (Conversation.__table__, 'ix_conversation_last_message_at'),
+                        (Conversation.__table__, 'ix_conversation_state_last_message_at')):
+        create_index(engine, find_index(table, name))
+
+
+def run_migrations(engine=None):
+    """Apply pending migrations; safe to run on every deploy"""
+    engine = engine or db.engine
+    SchemaMigration.__table__.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        applied = set(conn.execute(select(SchemaMigration.version)).scalars())
+
+    for version, name, fn in MIGRATIONS:
+        if version in applied:
+            continue
+        logging.info(f"Applying migration {version}: {name}")
+        fn(engine)
+        with engine.begin() as conn:
+            conn.execute(insert(SchemaMigration).values(version=version, name=name))
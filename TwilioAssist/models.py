@@ -33,31 +33,72 @@ class Product(db.Model):
 
 class Conversation(db.Model):
     """Store conversation states and history"""
+    __table_args__ = (
+        db.Index('ix_conversation_phone_number', 'phone_number', unique=True),
+        db.Index('ix_conversation_last_message_at', 'last_message_at'),
+        # Expiry scan: idle conversations of one state, oldest first
+        db.Index('ix_conversation_state_last_message_at', 'current_state', 'last_message_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     phone_number = db.Column(db.String(20), nullable=False)
     current_state = db.Column(db.String(50), default='main_menu')
     selected_category = db.Column(db.Integer, db.ForeignKey('category.id'))
     selected_product = db.Column(db.Integer, db.ForeignKey('product.id'))
     customer_name = db.Column(db.String(100))
+    search_query = db.Column(db.String(100))  # last product search, for picking a result by number
     last_message_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped on every update; a stale write raises StaleDataError instead of losing a transition
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    __mapper_args__ = {'version_id_col': version}
     
     def __repr__(self):
         return f'<Conversation {self.phone_number}>'
 
 class Message(db.Model):
     """Store message history"""
+    __table_args__ = (
+        db.Index('ix_message_phone_number_timestamp', 'phone_number', 'timestamp'),
+        db.Index('ix_message_timestamp', 'timestamp'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     phone_number = db.Column(db.String(20), nullable=False)
-    message_body = db.Column(db.Text, nullable=False)
+    message_body = db.Column(db.Text, nullable=False)  # empty when template_id is set
     is_incoming = db.Column(db.Boolean, default=True)  # True for customer, False for bot
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    template_id = db.Column(db.Integer, db.ForeignKey('message_template.id'))
+    
+    # Relationship
+    template = db.relationship('MessageTemplate')
     
     def __repr__(self):
         return f'<Message {self.phone_number}>'
+    
+    @property
+    def body(self):
+        """Message text, resolving canonical bot replies"""
+        return self.template.body if self.template_id else self.message_body
+
+class MessageTemplate(db.Model):
+    """Canonical bot reply stored once and referenced from Message rows"""
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(50), nullable=False)
+    checksum = db.Column(db.String(64), nullable=False, unique=True)  # sha256 of body
+    body = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<MessageTemplate {self.key}>'
 
 class Order(db.Model):
     """Store order information"""
+    __table_args__ = (
+        db.Index('ix_order_phone_number_created_at', 'phone_number', 'created_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     phone_number = db.Column(db.String(20), nullable=False)
     customer_name = db.Column(db.String(100))
@@ -70,3 +111,104 @@ class Order(db.Model):
     
     def __repr__(self):
         return f'<Order {self.id} - {self.phone_number}>'
+
+class CatalogVersion(db.Model):
+    """Single-row version counter bumped on every catalog write"""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<CatalogVersion {self.version}>'
+
+class SchemaMigration(db.Model):
+    """Schema migrations applied to this database"""
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SchemaMigration {self.version}>'
+
+class Broadcast(db.Model):
+    """Outbound campaign sent to a set of recipients"""
+    id = db.Column(db.Integer, primary_key=True)
+    message_body = db.Column(db.Text, nullable=False)
+    audience = db.Column(db.String(20), nullable=False)  # conversations, buyers, list
+    status = db.Column(db.String(20), default='pending')  # pending, running, interrupted, completed, failed
+    total = db.Column(db.Integer, default=0)
+    sent = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+    owner = db.Column(db.String(32))  # claim token of the process sending it
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<Broadcast {self.id} - {self.status}>'
+
+class BroadcastRecipient(db.Model):
+    """Delivery status of a broadcast for one phone number"""
+    __table_args__ = (
+        db.UniqueConstraint('broadcast_id', 'phone_number', name='uq_broadcast_recipient_phone'),
+        db.Index('ix_broadcast_recipient_status', 'broadcast_id', 'status', 'id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    broadcast_id = db.Column(db.Integer, db.ForeignKey('broadcast.id'), nullable=False)
+    phone_number = db.Column(db.String(20), nullable=False)
+    status = db.Column(db.String(20), default='pending')  # pending, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    message_sid = db.Column(db.String(64))
+    error = db.Column(db.Text)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<BroadcastRecipient {self.broadcast_id} {self.phone_number}>'
+
+class StatCounter(db.Model):
+    """Incrementally maintained counter for the admin dashboard"""
+    key = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StatCounter {self.key}={self.value}>'
+
+class ProcessedMessage(db.Model):
+    """Inbound Twilio message already handled, with the reply that was returned"""
+    __table_args__ = (
+        db.Index('ix_processed_message_created_at', 'created_at'),
+    )
+    
+    message_sid = db.Column(db.String(64), primary_key=True)
+    phone_number = db.Column(db.String(20), nullable=False)
+    response = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ProcessedMessage {self.message_sid}>'
+
+class Job(db.Model):
+    """Durable background job, claimed by the job workers once run_at has passed"""
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at', 'id'),
+        db.Index('ix_job_order_id', 'order_id'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'))
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} - {self.status}>'
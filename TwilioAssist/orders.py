@@ -0,0 +1,236 @@
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, request
+from sqlalchemy import event, select, insert
+from sqlalchemy.orm import Session
+from app import db
+from models import Order, Message
+from jobs import job_handler, enqueue, queue_summary
+from broadcast import RateLimiter, send_one
+from catalog import get_catalog
+from stats import record_messages
+import twilio_client
+
+# Unpaid orders are cancelled after this many minutes
+ORDER_PAYMENT_TIMEOUT_MINUTES = int(os.environ.get("ORDER_PAYMENT_TIMEOUT_MINUTES", "1440"))
+# Outbound order messages per second, shared by the job workers of one process
+ORDER_MESSAGE_RATE = float(os.environ.get("ORDER_MESSAGE_RATE", "10"))
+ORDER_MESSAGE_CONCURRENCY = int(os.environ.get("ORDER_MESSAGE_CONCURRENCY", "4"))
+
+ORDER_STATUSES = ('pending', 'paid', 'delivered', 'cancelled')
+# target status -> statuses it can be reached from
+TRANSITIONS = {
+    'paid': ('pending',),
+    'cancelled': ('pending',),
+    'delivered': ('paid',),
+}
+# Status changes the admin can ask for, and the job that carries them out
+STATUS_JOBS = {'paid': 'order.paid', 'cancelled': 'order.cancel'}
+
+orders_bp = Blueprint('orders', __name__)
+
+message_limiter = RateLimiter(ORDER_MESSAGE_RATE)
+
+
+def schedule_expiry(order, session=None):
+    """Queue the cancellation of an order that is still unpaid when its time runs out"""
+    created_at = order.created_at or datetime.utcnow()
+    return enqueue('order.expire', order.id, created_at + timedelta(minutes=ORDER_PAYMENT_TIMEOUT_MINUTES), session)
+
+
+def delivery_message(order, product_name):
+    message = f"✅ *Pagamento confirmado!*\n\n"
+    message += f"🔢 Pedido #: {order.id}\n"
+    message += f"📦 Produto: {product_name}\n\n"
+    message += "Seu produto foi liberado. Obrigado pela compra"
+    message += f", {order.customer_name}!" if order.customer_name else "!"
+    message += "\n\nDigite *ajuda* se precisar de atendimento."
+    return message
+
+
+def cancellation_message(order, product_name, expired):
+    message = f"❌ *Pedido #{order.id} cancelado*\n\n"
+    message += f"📦 Produto: {product_name}\n"
+    if expired:
+        minutes = ORDER_PAYMENT_TIMEOUT_MINUTES
+        timeout = f"{minutes // 60} horas" if minutes >= 120 and minutes % 60 == 0 else f"{minutes} minutos"
+        message += f"⏰ Não recebemos o pagamento em {timeout}.\n"
+    message += "\nDigite *menu* para fazer um novo pedido."
+    return message
+
+
+def product_names(orders):
+    catalog = get_catalog()
+    names = {}
+    for order in orders:
+        product = catalog.products.get(order.product_id)
+        names[order.id] = product.name if product else order.product.name
+    return names
+
+
+def load_orders(jobs, lock=True):
+    """The orders of a batch of jobs, by id"""
+    query = select(Order).where(Order.id.in_({job.order_id for job in jobs}))
+    if lock:
+        query = query.with_for_update()
+    return {order.id: order for order in db.session.execute(query).scalars()}
+
+
+def send_messages(messages):
+    """Send (phone_number, body) pairs through Twilio concurrently; returns [(sid, error)]"""
+    client = twilio_client.get_client()
+    if client is None:
+        return [(None, 'Twilio not configured')] * len(messages)
+    with ThreadPoolExecutor(max_workers=ORDER_MESSAGE_CONCURRENCY) as pool:
+        return list(pool.map(lambda m: send_one(client, message_limiter, m[0], m[1]), messages))
+
+
+def log_sent(messages):
+    """Store sent order messages in the history (caller commits)"""
+    if not messages:
+        return
+    now = datetime.utcnow()
+    rows = [{'phone_number': phone, 'message_body': body, 'is_incoming': False, 'timestamp': now}
+            for phone, body in messages]
+    db.session.execute(insert(Message), rows)
+    db.session.info.setdefault('order_messages', []).extend(rows)
+    db.session.info['order_messages_written_at'] = time.time()
+
+
+@event.listens_for(Session, 'after_commit')
+def _count_committed_messages(session):
+    rows = session.info.pop('order_messages', None)
+    written_at = session.info.pop('order_messages_written_at', None)
+    if rows:
+        record_messages(rows, written_at)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_rolled_back_messages(session):
+    session.info.pop('order_messages', None)
+    session.info.pop('order_messages_written_at', None)
+
+
+@job_handler('order.paid')
+def mark_paid(jobs):
+    """pending -> paid, then queue the delivery"""
+    orders = load_orders(jobs)
+    for job in jobs:
+        order = orders.get(job.order_id)
+        if order is not None and order.status in TRANSITIONS['paid']:
+            order.status = 'paid'
+            enqueue('order.deliver', order.id)
+    return {}
+
+
+@job_handler('order.cancel', 'order.expire')
+def cancel(jobs):
+    """pending -> cancelled, then queue the notice to the customer"""
+    orders = load_orders(jobs)
+    for job in jobs:
+        order = orders.get(job.order_id)
+        if order is not None and order.status in TRANSITIONS['cancelled']:
+            order.status = 'cancelled'
+            enqueue('order.notify_expired' if job.kind == 'order.expire' else 'order.notify_cancelled', order.id)
+    return {}
+
+
+def send_for_orders(jobs, status, render, new_status=None):
+    """Message the customers of the jobs' orders that are in `status`; returns the job errors"""
+    # Not locked: the Twilio calls can take a while, and only these jobs move orders out of `status`
+    orders = load_orders(jobs, lock=False)
+    due = [(job, orders[job.order_id]) for job in jobs
+           if job.order_id in orders and orders[job.order_id].status == status]
+    names = product_names([order for _, order in due])
+    messages = [(order.phone_number, render(order, names[order.id])) for _, order in due]
+
+    errors = {}
+    sent = []
+    for (job, order), message, (sid, error) in zip(due, messages, send_messages(messages)):
+        if sid is None:
+            errors[job.id] = error
+            continue
+        sent.append(message)
+        if new_status:
+            order.status = new_status
+    log_sent(sent)
+    if sent or errors:
+        logging.info(f"Sent {len(sent)} order messages, {len(errors)} failed")
+    return errors
+
+
+@job_handler('order.deliver')
+def deliver(jobs):
+    """Send the product to customers of paid orders, then mark them delivered"""
+    return send_for_orders(jobs, 'paid', delivery_message, 'delivered')
+
+
+@job_handler('order.notify_cancelled')
+def notify_cancelled(jobs):
+    return send_for_orders(jobs, 'cancelled', lambda order, name: cancellation_message(order, name, False))
+
+
+@job_handler('order.notify_expired')
+def notify_expired(jobs):
+    return send_for_orders(jobs, 'cancelled', lambda order, name: cancellation_message(order, name, True))
+
+
+def request_status(order, status):
+    """Queue a status change asked for by the admin; returns the job, or None if it is not allowed"""
+    if status not in STATUS_JOBS or order.status not in TRANSITIONS[status]:
+        return None
+    job = enqueue(STATUS_JOBS[status], order.id)
+    db.session.commit()
+    return job
+
+
+def order_to_dict(order):
+    return {
+        'id': order.id,
+        'phone_number': order.phone_number,
+        'customer_name': order.customer_name,
+        'product_id': order.product_id,
+        'status': order.status,
+        'created_at': order.created_at.isoformat() if order.created_at else None,
+    }
+
+
+@orders_bp.route('/api/orders', methods=['GET'])
+def api_orders():
+    """Orders, newest first, optionally filtered by status"""
+    query = select(Order)
+    if request.args.get('status'):
+        query = query.where(Order.status == request.args['status'])
+    before_id = request.args.get('before_id', type=int)
+    if before_id:
+        query = query.where(Order.id < before_id)
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    orders = db.session.execute(query.order_by(Order.id.desc()).limit(limit)).scalars().all()
+    return {
+        'orders': [order_to_dict(o) for o in orders],
+        'next_before_id': orders[-1].id if len(orders) == limit else None,
+    }
+
+
+@orders_bp.route('/api/orders/<int:order_id>/status', methods=['POST'])
+def api_order_status(order_id):
+    """Ask the job workers to mark an order paid or cancelled"""
+    order = db.session.get(Order, order_id)
+    if not order:
+        return {'error': 'Order not found'}, 404
+    status = (request.get_json(silent=True) or {}).get('status')
+    if status not in STATUS_JOBS:
+        return {'error': f'Status must be one of: {", ".join(STATUS_JOBS)}'}, 400
+    job = request_status(order, status)
+    if job is None:
+        return {'error': f'Order is {order.status}'}, 409
+    return {'success': True, 'order_id': order_id, 'job_id': job.id}, 202
+
+
+@orders_bp.route('/api/jobs', methods=['GET'])
+def api_jobs():
+    """Background job counts by kind and status"""
+    return {'jobs': queue_summary()}
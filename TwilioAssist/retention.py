@@ -0,0 +1,162 @@
+import os
+import gzip
+import json
+import time
+import logging
+from datetime import datetime, timedelta, date
+from sqlalchemy import select, delete, update
+from app import db
+from models import Message, MessageTemplate
+from message_templates import template_registry
+from stats import stats_buffer
+
+# Messages older than this move from the database to the archive
+MESSAGE_RETENTION_DAYS = int(os.environ.get("MESSAGE_RETENTION_DAYS", "90"))
+MESSAGE_ARCHIVE_DIR = os.environ.get(
+    "MESSAGE_ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive", "messages")
+)
+MESSAGE_ARCHIVE_BATCH_SIZE = int(os.environ.get("MESSAGE_ARCHIVE_BATCH_SIZE", "1000"))
+
+ARCHIVE_SUFFIX = ".jsonl.gz"
+INDEX_SUFFIX = ".phones.json"
+
+
+def day_path(day, archive_dir=None):
+    """Archive file holding the messages of one day"""
+    return os.path.join(archive_dir or MESSAGE_ARCHIVE_DIR, f"{day:%Y}", f"{day:%m}", f"{day:%Y-%m-%d}{ARCHIVE_SUFFIX}")
+
+
+def index_path(path):
+    return path[:-len(ARCHIVE_SUFFIX)] + INDEX_SUFFIX
+
+
+def read_index(path):
+    try:
+        with open(index_path(path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def append_day(day, records, archive_dir=None):
+    """Append records to a day file as a new gzip member and update its phone index"""
+    path = day_path(day, archive_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    payload = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+    with open(path, "ab") as f:
+        f.write(gzip.compress(payload))
+        f.flush()
+        os.fsync(f.fileno())
+
+    # Phone number -> record count, so per-number queries can skip files
+    phones = read_index(path)
+    for r in records:
+        phones[r['phone_number']] = phones.get(r['phone_number'], 0) + 1
+    tmp = index_path(path) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(phones, f)
+    os.replace(tmp, index_path(path))
+
+
+def archive_messages(days=MESSAGE_RETENTION_DAYS, batch_size=MESSAGE_ARCHIVE_BATCH_SIZE, archive_dir=None, now=None):
+    """Move messages older than `days` into the day-partitioned archive; returns the count"""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    total = 0
+    while True:
+        rows = db.session.execute(
+            select(Message.id, Message.phone_number, Message.message_body, Message.is_incoming,
+                   Message.timestamp, Message.template_id)
+            .where(Message.timestamp < cutoff)
+            .order_by(Message.timestamp, Message.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(row.timestamp.date(), []).append({
+                'id': row.id,
+                'phone_number': row.phone_number,
+                'timestamp': row.timestamp.isoformat(),
+                'is_incoming': row.is_incoming,
+                'message_body': row.message_body,
+                'template_id': row.template_id,
+            })
+        # Files are written before the rows are deleted; a crash in between only
+        # leaves duplicates, which readers drop by id
+        for day, records in by_day.items():
+            append_day(day, records, archive_dir)
+
+        db.session.execute(delete(Message).where(Message.id.in_([row.id for row in rows])))
+        written_at = time.time()
+        db.session.commit()
+        stats_buffer.add({'messages': -len(rows)}, written_at)
+        total += len(rows)
+
+    logging.info(f"Archived {total} messages older than {cutoff:%Y-%m-%d}")
+    return total
+
+
+def archived_days(start=None, end=None, archive_dir=None):
+    """Yield (day, path) for archive files in a date range, oldest first"""
+    root = archive_dir or MESSAGE_ARCHIVE_DIR
+    if not os.path.isdir(root):
+        return
+    for year in sorted(os.listdir(root)):
+        for month in sorted(os.listdir(os.path.join(root, year))):
+            folder = os.path.join(root, year, month)
+            for name in sorted(os.listdir(folder)):
+                if not name.endswith(ARCHIVE_SUFFIX):
+                    continue
+                day = date.fromisoformat(name[:-len(ARCHIVE_SUFFIX)])
+                if (start and day < start) or (end and day > end):
+                    continue
+                yield day, os.path.join(folder, name)
+
+
+def iter_archived_messages(phone_number, start=None, end=None, archive_dir=None):
+    """Yield archived messages of a phone number in chronological order"""
+    templates = dict(db.session.execute(select(MessageTemplate.id, MessageTemplate.body)).all())
+    for day, path in archived_days(start, end, archive_dir):
+        if phone_number not in read_index(path):
+            continue
+        seen = set()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                if record['phone_number'] != phone_number or record['id'] in seen:
+                    continue
+                seen.add(record['id'])
+                template_id = record.get('template_id')
+                record['body'] = templates.get(template_id, '') if template_id else record['message_body']
+                yield record
+
+
+def compact_messages(batch_size=MESSAGE_ARCHIVE_BATCH_SIZE):
+    """Replace stored copies of canonical bot replies with template references"""
+    templates = template_registry.ensure_loaded(db.session)
+    last_id = 0
+    total = 0
+    while True:
+        rows = db.session.execute(
+            select(Message.id, Message.message_body)
+            .where(Message.is_incoming == False, Message.template_id.is_(None), Message.id > last_id)  # noqa: E712
+            .order_by(Message.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        matches = [
+            {'id': row.id, 'template_id': templates[row.message_body], 'message_body': ''}
+            for row in rows if row.message_body in templates
+        ]
+        if matches:
+            db.session.execute(update(Message), matches)
+            db.session.commit()
+            total += len(matches)
+
+    logging.info(f"Compacted {total} messages into template references")
+    return total
@@ -0,0 +1,274 @@
+"""Accent-insensitive inverted index over the active catalog.
+
+Each term maps to {product_id: weight}, the weight adding up the fields the
+term appears in (name counts more than category, category more than
+description). Query words match whole terms, and words of three or more
+letters also match longer terms starting with them, so "invest" finds
+"investimentos". Products matching every query word rank first.
+
+Readers never lock: every posting dict and the sorted vocabulary are replaced
+rather than changed in place, so a search running during an update sees
+each term either before or after it.
+"""
+import os
+import re
+import heapq
+import bisect
+import threading
+import unicodedata
+
+SEARCH_MAX_RESULTS = int(os.environ.get("SEARCH_MAX_RESULTS", "5"))
+# Terms a query word may expand to by prefix; keeps short prefixes cheap
+SEARCH_MAX_PREFIX_TERMS = int(os.environ.get("SEARCH_MAX_PREFIX_TERMS", "50"))
+# Products of the rarest word scored per query; bounds queries made only of very common words
+SEARCH_MAX_CANDIDATES = int(os.environ.get("SEARCH_MAX_CANDIDATES", "200"))
+
+NAME_WEIGHT = 3.0
+CATEGORY_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+# A prefix match scores this fraction of a whole-term match
+PREFIX_FACTOR = 0.5
+MIN_PREFIX_LENGTH = 3
+# Above this fraction of changed products, sync() rebuilds instead of patching
+REBUILD_FRACTION = 0.25
+
+STOPWORDS = frozenset("""
+a o e as os um uma de da do das dos em na no nas nos para por com sem ao aos
+que se ou the of and
+""".split())
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text):
+    """Lowercase ASCII text with accents removed (other non-ASCII characters are dropped)"""
+    if text.isascii():
+        return text.lower()
+    return unicodedata.normalize('NFKD', text.lower()).encode('ascii', 'ignore').decode('ascii')
+
+
+def tokenize(text):
+    """Search terms of a text, in order, without stopwords"""
+    if not text:
+        return []
+    return [w for w in WORD_RE.findall(normalize(text)) if w not in STOPWORDS]
+
+
+def product_terms(product):
+    """{term: weight} for a product with name, description and category_name"""
+    terms = {}
+    for text, weight in ((product.name, NAME_WEIGHT), (product.category_name, CATEGORY_WEIGHT),
+                         (product.description, DESCRIPTION_WEIGHT)):
+        for term in set(tokenize(text)):
+            terms[term] = terms.get(term, 0.0) + weight
+    return terms
+
+
+class SearchIndex:
+    """In-memory inverted index of products, updated incrementally"""
+
+    def __init__(self):
+        self._postings = {}
+        self._vocabulary = []
+        self._products = {}
+        self._terms = {}
+        self._ranked_cache = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._products)
+
+    def _apply(self, products, removed_ids):
+        """Index products and drop ids, copying each touched posting once"""
+        edits = {}
+        for product_id in (*removed_ids, *(p.id for p in products)):
+            for term in self._terms.get(product_id, ()):
+                edits.setdefault(term, {})[product_id] = None
+        new_terms = {}
+        for product in products:
+            terms = new_terms[product.id] = product_terms(product)
+            for term, weight in terms.items():
+                edits.setdefault(term, {})[product.id] = weight
+
+        postings = self._postings
+        added, removed = [], []
+        for term, changes in edits.items():
+            old = postings.get(term)
+            posting = dict(old) if old else {}
+            for product_id, weight in changes.items():
+                if weight is None:
+                    posting.pop(product_id, None)
+                else:
+                    posting[product_id] = weight
+            if posting:
+                postings[term] = posting
+                if not old:
+                    added.append(term)
+            elif old:
+                del postings[term]
+                removed.append(term)
+            self._patch_ranked(term, old, posting, changes)
+
+        for product_id in removed_ids:
+            self._products.pop(product_id, None)
+            self._terms.pop(product_id, None)
+        for product in products:
+            self._products[product.id] = product
+            self._terms[product.id] = new_terms[product.id]
+
+        if added or removed:
+            gone = set(removed)
+            vocabulary = [t for t in self._vocabulary if t not in gone] if gone else list(self._vocabulary)
+            for term in added:
+                bisect.insort(vocabulary, term)
+            self._vocabulary = vocabulary
+
+    def _patch_ranked(self, term, old, posting, changes):
+        """Carry a sorted posting over to the new version of a term without sorting it again"""
+        cached = self._ranked_cache.pop(term, None)
+        if not posting or cached is None or cached[0] is not old:
+            return
+        ranked = list(cached[1])
+        for product_id in changes:
+            if product_id in old:
+                index = bisect.bisect_left(ranked, (-old[product_id], product_id))
+                del ranked[index]
+        for product_id, weight in changes.items():
+            if weight is not None:
+                bisect.insort(ranked, (-weight, product_id))
+        self._ranked_cache[term] = (posting, ranked)
+
+    def rebuild(self, products):
+        """Replace the whole index"""
+        with self._lock:
+            postings, terms_by_product, by_id = {}, {}, {}
+            for product in products:
+                terms = product_terms(product)
+                for term, weight in terms.items():
+                    postings.setdefault(term, {})[product.id] = weight
+                terms_by_product[product.id] = terms
+                by_id[product.id] = product
+            self._postings = postings
+            self._terms = terms_by_product
+            self._products = by_id
+            self._vocabulary = sorted(postings)
+            self._ranked_cache = {
+                term: (posting, sorted((-weight, product_id) for product_id, weight in posting.items()))
+                for term, posting in postings.items()
+            }
+
+    def add(self, product):
+        """Index a product, replacing an older version of it"""
+        with self._lock:
+            self._apply([product], ())
+
+    def remove(self, product_id):
+        with self._lock:
+            self._apply((), [product_id])
+
+    def sync(self, products):
+        """Bring the index in line with a product list, touching only what changed; returns the change count"""
+        products = {p.id: p for p in products}
+        changed = [p for p in products.values() if self._products.get(p.id) != p]
+        missing = [pid for pid in self._products if pid not in products]
+        count = len(changed) + len(missing)
+        if not count:
+            return 0
+        if count > max(len(self._products), 1) * REBUILD_FRACTION:
+            self.rebuild(products.values())
+        else:
+            with self._lock:
+                self._apply(changed, missing)
+        return count
+
+    def _postings_for(self, word):
+        """[(term, posting, factor)] for one query word: the whole term and the terms it prefixes"""
+        postings = self._postings
+        exact = postings.get(word)
+        found = [(word, exact, 1.0)] if exact else []
+        if len(word) < MIN_PREFIX_LENGTH:
+            return found
+        vocabulary = self._vocabulary
+        start = bisect.bisect_left(vocabulary, word)
+        for term in vocabulary[start:start + SEARCH_MAX_PREFIX_TERMS + 1]:
+            if not term.startswith(word):
+                break
+            posting = postings.get(term)
+            if term != word and posting:
+                found.append((term, posting, PREFIX_FACTOR))
+        return found
+
+    def _ranked(self, term, posting):
+        """(-weight, product_id) pairs of a posting, best first; re-sorted after the term changes"""
+        cached = self._ranked_cache.get(term)
+        if cached is not None and cached[0] is posting:
+            return cached[1]
+        ranked = sorted((-weight, product_id) for product_id, weight in posting.items())
+        self._ranked_cache[term] = (posting, ranked)
+        return ranked
+
+    def _stream(self, found):
+        """(-score, product_id) for one query word, best first; a product may repeat"""
+        streams = [
+            self._ranked(term, posting) if factor == 1.0
+            else ((score * factor, product_id) for score, product_id in self._ranked(term, posting))
+            for term, posting, factor in found
+        ]
+        return iter(streams[0]) if len(streams) == 1 else heapq.merge(*streams)
+
+    @staticmethod
+    def _score(found, product_id):
+        return max((p[product_id] * f for _, p, f in found if product_id in p), default=0.0)
+
+    def search(self, query, limit=SEARCH_MAX_RESULTS):
+        """Best matching products for a free-text query, best first"""
+        words = [self._postings_for(w) for w in dict.fromkeys(tokenize(query))]
+        words = sorted((found for found in words if found), key=lambda found: sum(len(p) for _, p, _ in found))
+        if not words:
+            return []
+        score = self._score
+
+        # Products with every word: walk the rarest word best first and stop
+        # once nothing further down can beat the current top results
+        others_max = sum(max(-self._ranked(t, p)[0][0] * f for t, p, f in found) for found in words[1:])
+        top, seen = [], set()
+        for negative, product_id in self._stream(words[0]):
+            if len(top) == limit and top[0][0] >= others_max - negative:
+                break
+            if len(seen) >= SEARCH_MAX_CANDIDATES:
+                break
+            if product_id in seen:
+                continue
+            seen.add(product_id)
+            total = -negative
+            for found in words[1:]:
+                word_score = score(found, product_id)
+                if not word_score:
+                    break
+                total += word_score
+            else:
+                item = (total, -product_id)
+                if len(top) < limit:
+                    heapq.heappush(top, item)
+                elif item > top[0]:
+                    heapq.heapreplace(top, item)
+
+        if not top:
+            # Nothing has them all: the best few of each word
+            for found in words:
+                taken = 0
+                for negative, product_id in self._stream(found):
+                    if taken == limit:
+                        break
+                    if product_id not in seen:
+                        seen.add(product_id)
+                        top.append((-negative, -product_id))
+                        taken += 1
+            seen = None
+        ranked = [-item[1] for item in sorted(top, reverse=True)[:limit]]
+
+        products = self._products
+        return [products[pid] for pid in ranked if pid in products]
+
+
+product_index = SearchIndex()
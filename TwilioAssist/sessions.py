@@ -0,0 +1,219 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update, delete
+from app import db
+from models import Conversation
+from dialog import RESET_SELECTION, chat_engine
+from metrics import Counter
+from retention import append_day
+from stats import stats_buffer, take_lease
+
+# Minutes a conversation may sit idle before it goes back to the main menu
+SESSION_TTL_MINUTES = int(os.environ.get("SESSION_TTL_MINUTES", "1440"))
+# Per-state overrides, e.g. "requesting_name=60,requesting_donation_amount=30"
+SESSION_STATE_TTLS = os.environ.get(
+    "SESSION_STATE_TTLS", "requesting_name=60,requesting_donation_name=60,requesting_donation_amount=60"
+)
+# Conversations idle this long are archived and removed from the table (0 keeps them)
+CONVERSATION_ARCHIVE_DAYS = int(os.environ.get("CONVERSATION_ARCHIVE_DAYS", "180"))
+CONVERSATION_ARCHIVE_DIR = os.environ.get(
+    "CONVERSATION_ARCHIVE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive", "conversations")
+)
+# How often one worker sweeps expired sessions (0 disables the background sweeper)
+SESSION_SWEEP_INTERVAL = int(os.environ.get("SESSION_SWEEP_INTERVAL", "300"))
+SESSION_SWEEP_BATCH_SIZE = int(os.environ.get("SESSION_SWEEP_BATCH_SIZE", "500"))
+
+RESET_STATE = 'main_menu'
+SWEEP_LEASE_KEY = 'sessions:lease'
+
+SESSIONS_EXPIRED = Counter('sessions_expired_total', "Conversations reset or archived after their TTL", ('action',))
+
+
+def parse_state_ttls(value):
+    ttls = {}
+    for item in value.split(','):
+        if '=' in item:
+            state, minutes = item.split('=', 1)
+            ttls[state.strip()] = int(minutes)
+    return ttls
+
+
+STATE_TTLS = parse_state_ttls(SESSION_STATE_TTLS)
+
+
+def state_ttl(state):
+    """Idle time after which a conversation in this state is reset, or None"""
+    if state == RESET_STATE:
+        return None
+    return timedelta(minutes=STATE_TTLS.get(state, SESSION_TTL_MINUTES))
+
+
+def is_expired(conversation, now=None):
+    ttl = state_ttl(conversation.current_state)
+    if ttl is None or conversation.last_message_at is None:
+        return False
+    return conversation.last_message_at < (now or datetime.utcnow()) - ttl
+
+
+def reset_session(conversation):
+    """Send a loaded conversation back to the main menu"""
+    conversation.current_state = RESET_STATE
+    for field, value in RESET_SELECTION.items():
+        setattr(conversation, field, value)
+
+
+def expiring_states():
+    """Every state a conversation can be left in, but the one it is reset to"""
+    return sorted((chat_engine.states | set(STATE_TTLS)) - {RESET_STATE})
+
+
+def expire_sessions(batch_size=SESSION_SWEEP_BATCH_SIZE, now=None):
+    """Reset conversations idle past the TTL of their state; returns the count"""
+    now = now or datetime.utcnow()
+    session = db.session
+
+    total = 0
+    # The flow's states are known, so each is an index range scan; asking the
+    # table for its distinct states would read every conversation
+    for state in expiring_states():
+        cutoff = now - state_ttl(state)
+        while True:
+            # Served by ix_conversation_state_last_message_at
+            ids = session.execute(
+                select(Conversation.id)
+                .where(Conversation.current_state == state, Conversation.last_message_at < cutoff)
+                .order_by(Conversation.last_message_at)
+                .limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            # The conditions are checked again so a message that arrived since the
+            # select wins; bumping version makes a webhook holding the old row retry
+            result = session.execute(
+                update(Conversation)
+                .where(Conversation.id.in_(ids), Conversation.current_state == state,
+                       Conversation.last_message_at < cutoff)
+                .values(current_state=RESET_STATE, version=Conversation.version + 1, **RESET_SELECTION)
+                .execution_options(synchronize_session=False)
+            )
+            session.commit()
+            total += result.rowcount
+            if len(ids) < batch_size:
+                break
+
+    if total:
+        SESSIONS_EXPIRED.inc('reset', amount=total)
+    logging.info(f"Reset {total} expired sessions")
+    return total
+
+
+def archive_conversations(days=CONVERSATION_ARCHIVE_DAYS, batch_size=SESSION_SWEEP_BATCH_SIZE,
+                          archive_dir=None, now=None):
+    """Move conversations idle for more than `days` into the day archive; returns the count"""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    session = db.session
+    total = 0
+    while True:
+        rows = session.execute(
+            select(Conversation.id, Conversation.phone_number, Conversation.current_state,
+                   Conversation.customer_name, Conversation.last_message_at, Conversation.created_at)
+            .where(Conversation.last_message_at < cutoff)
+            .order_by(Conversation.last_message_at, Conversation.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(row.last_message_at.date(), []).append({
+                'id': row.id,
+                'phone_number': row.phone_number,
+                'current_state': row.current_state,
+                'customer_name': row.customer_name,
+                'last_message_at': row.last_message_at.isoformat(),
+                'created_at': row.created_at.isoformat() if row.created_at else None,
+            })
+        for day, records in by_day.items():
+            append_day(day, records, archive_dir or CONVERSATION_ARCHIVE_DIR)
+
+        # A conversation that became active again since the select is kept; its
+        # archived copy is only an old snapshot
+        result = session.execute(
+            delete(Conversation)
+            .where(Conversation.id.in_([row.id for row in rows]), Conversation.last_message_at < cutoff)
+            .execution_options(synchronize_session=False)
+        )
+        written_at = time.time()
+        session.commit()
+        stats_buffer.add({'conversations': -result.rowcount}, written_at)
+        total += result.rowcount
+        if len(rows) < batch_size:
+            break
+
+    if total:
+        SESSIONS_EXPIRED.inc('archived', amount=total)
+    logging.info(f"Archived {total} conversations idle since {cutoff:%Y-%m-%d}")
+    return total
+
+
+def sweep_sessions(lease=False):
+    """Archive abandoned conversations and reset expired ones"""
+    if lease and not take_lease(db.session, SESSION_SWEEP_INTERVAL * 0.9, SWEEP_LEASE_KEY):
+        return False
+    if CONVERSATION_ARCHIVE_DAYS:
+        archive_conversations()
+    expire_sessions()
+    return True
+
+
+class SessionSweeper:
+    """Background thread that periodically runs sweep_sessions in one worker at a time"""
+
+    def __init__(self, interval=SESSION_SWEEP_INTERVAL):
+        self.app = None
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def init_app(self, app):
+        if not self.interval:
+            return
+        self.app = app
+        atexit.register(self.stop)
+        # Started by the first request, so every forked worker gets its own thread
+        app.before_request(self._ensure_started)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="session-sweeper", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            started = time.monotonic()
+            try:
+                with self.app.app_context():
+                    if sweep_sessions(lease=True):
+                        logging.info(f"Swept sessions in {time.monotonic() - started:.2f}s")
+            except Exception as e:
+                logging.error(f"Error sweeping sessions: {str(e)}")
+
+    def stop(self):
+        self._stop.set()
+
+
+session_sweeper = SessionSweeper()
@@ -3,13 +3,25 @@
 document.addEventListener('DOMContentLoaded', function() {
     loadStats();
     setupEventListeners();
+    loadProducts();
+    loadBroadcasts();
 });
 
 function loadStats() {
-    // Load conversation and order counts (would be implemented with API calls)
-    // For now, setting placeholder values
-    document.getElementById('conversations-count').textContent = '-';
-    document.getElementById('orders-count').textContent = '-';
+    // Counters are maintained incrementally on the server, so this stays cheap
+    fetch('/api/stats')
+    .then(response => response.json())
+    .then(data => {
+        document.getElementById('conversations-count').textContent = data.conversations;
+        document.getElementById('orders-count').textContent = data.orders;
+        document.getElementById('conversations-count').title =
+            `${data.active_conversations} ativas nos últimos ${data.active_minutes} minutos`;
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        document.getElementById('conversations-count').textContent = '-';
+        document.getElementById('orders-count').textContent = '-';
+    });
 }
 
 function setupEventListeners() {
@@ -19,11 +31,150 @@ function setupEventListeners() {
         addProduct();
     });
 
+    document.getElementById('loadMoreProducts').addEventListener('click', function() {
+        loadProducts(productsAfterId);
+    });
+
     // Send Message Form
     document.getElementById('sendMessageForm').addEventListener('submit', function(e) {
         e.preventDefault();
         sendMessage();
     });
+
+    // Broadcast Form
+    document.getElementById('broadcastForm').addEventListener('submit', function(e) {
+        e.preventDefault();
+        createBroadcast();
+    });
+
+    document.getElementById('broadcastAudience').addEventListener('change', function(e) {
+        document.getElementById('broadcastNumbersGroup').classList.toggle('d-none', e.target.value !== 'list');
+    });
+
+    // Conversation History
+    document.getElementById('historyForm').addEventListener('submit', function(e) {
+        e.preventDefault();
+        loadHistory();
+    });
+
+    document.getElementById('loadMoreHistory').addEventListener('click', function() {
+        loadHistory(historyAfter);
+    });
+}
+
+// Cursor for the next page of products, null when everything is loaded
+let productsAfterId = null;
+
+function loadProducts(afterId) {
+    const table = document.getElementById('productsTable');
+    const loadMore = document.getElementById('loadMoreProducts');
+    if (!afterId) {
+        table.innerHTML = '';
+    }
+
+    // The server answers 304 while the catalog is unchanged and the browser reuses its copy
+    fetch(`/api/products?limit=50&after_id=${afterId || 0}`)
+    .then(response => response.json())
+    .then(data => {
+        data.products.forEach(p => {
+            const row = document.createElement('tr');
+            row.innerHTML = `
+                <td>${p.id}</td>
+                <td></td>
+                <td></td>
+                <td>${formatCurrency(p.price)}</td>
+                <td>
+                    <span class="badge bg-${p.is_active ? 'success' : 'secondary'}">
+                        ${p.is_active ? 'Ativo' : 'Inativo'}
+                    </span>
+                </td>
+                <td>
+                    <button class="btn btn-sm btn-outline-primary" onclick="editProduct(${p.id})">
+                        <i class="fas fa-edit"></i>
+                    </button>
+                    <button class="btn btn-sm btn-outline-danger" onclick="deleteProduct(${p.id})">
+                        <i class="fas fa-trash"></i>
+                    </button>
+                </td>
+            `;
+            row.children[1].textContent = p.name;
+            row.children[2].textContent = p.category_name || 'N/A';
+            table.appendChild(row);
+        });
+        productsAfterId = data.next_after_id;
+        loadMore.classList.toggle('d-none', productsAfterId === null);
+    })
+    .catch(error => console.error('Error:', error));
+}
+
+// Cursor for the next page of the conversation history, null when everything is loaded
+let historyAfter = null;
+
+function loadHistory(after) {
+    const table = document.getElementById('historyTable');
+    const loadMore = document.getElementById('loadMoreHistory');
+    const phone = formatPhoneNumber(document.getElementById('historyPhone').value.trim());
+    if (!after) {
+        table.innerHTML = '';
+    }
+
+    // The server stores UTC; the inputs are in the browser's time zone
+    const params = new URLSearchParams({ limit: 100 });
+    const since = document.getElementById('historySince').value;
+    const until = document.getElementById('historyUntil').value;
+    if (since) {
+        params.set('since', new Date(since).toISOString());
+    }
+    if (until) {
+        params.set('until', new Date(until).toISOString());
+    }
+    if (after) {
+        params.set('after', after);
+    }
+
+    fetch(`/api/conversations/${encodeURIComponent(phone)}/history?${params}`)
+    .then(response => response.json())
+    .then(data => {
+        if (data.error) {
+            showAlert('Erro ao carregar histórico: ' + data.error, 'danger');
+            return;
+        }
+        if (!after && data.events.length === 0) {
+            showAlert('Nenhuma mensagem ou pedido encontrado para este número.', 'info');
+        }
+        data.events.forEach(e => {
+            const row = document.createElement('tr');
+            row.innerHTML = `
+                <td class="text-nowrap">${new Date(e.timestamp + 'Z').toLocaleString('pt-BR')}</td>
+                <td>${historyBadge(e)}</td>
+                <td></td>
+            `;
+            if (e.type === 'order') {
+                const product = e.product_name || `Produto ${e.product_id}`;
+                row.children[2].textContent = `Pedido #${e.id}: ${product}` +
+                    (e.price != null ? ` (${formatCurrency(e.price)})` : '') + ` - ${e.status}`;
+            } else {
+                row.children[2].textContent = e.body;
+                row.children[2].style.whiteSpace = 'pre-wrap';
+            }
+            table.appendChild(row);
+        });
+        historyAfter = data.next_after;
+        loadMore.classList.toggle('d-none', historyAfter === null);
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        showAlert('Erro ao carregar histórico. Tente novamente.', 'danger');
+    });
+}
+
+function historyBadge(event) {
+    if (event.type === 'order') {
+        return '<span class="badge bg-warning">Pedido</span>';
+    }
+    return event.direction === 'incoming'
+        ? '<span class="badge bg-info">Cliente</span>'
+        : '<span class="badge bg-success">Bot</span>';
 }
 
 function addProduct() {
@@ -125,6 +276,130 @@ function sendMessage() {
     });
 }
 
+function createBroadcast() {
+    const audience = document.getElementById('broadcastAudience').value;
+    const message = document.getElementById('broadcastMessage').value;
+    const phoneNumbers = document.getElementById('broadcastNumbers').value
+        .split('\n')
+        .map(n => n.trim())
+        .filter(n => n);
+
+    if (!message || (audience === 'list' && phoneNumbers.length === 0)) {
+        showAlert('Por favor, preencha todos os campos.', 'warning');
+        return;
+    }
+
+    const submitBtn = document.querySelector('#broadcastForm button[type="submit"]');
+    const originalText = submitBtn.innerHTML;
+    submitBtn.innerHTML = '<i class="fas fa-spinner fa-spin me-1"></i>Criando...';
+    submitBtn.disabled = true;
+
+    fetch('/api/broadcasts', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            message: message,
+            audience: audience,
+            phone_numbers: phoneNumbers
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            showAlert(`Campanha criada para ${data.total} destinatários!`, 'success');
+            document.getElementById('broadcastForm').reset();
+            loadBroadcasts();
+        } else {
+            showAlert('Erro ao criar campanha: ' + (data.error || 'Erro desconhecido'), 'danger');
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        showAlert('Erro ao criar campanha. Tente novamente.', 'danger');
+    })
+    .finally(() => {
+        submitBtn.innerHTML = originalText;
+        submitBtn.disabled = false;
+    });
+}
+
+function loadBroadcasts() {
+    const table = document.getElementById('broadcastsTable');
+    if (!table) {
+        return;
+    }
+
+    fetch('/api/broadcasts')
+    .then(response => response.json())
+    .then(data => {
+        table.innerHTML = '';
+        data.broadcasts.forEach(b => {
+            const row = document.createElement('tr');
+            const message = b.message.length > 60 ? b.message.slice(0, 60) + '…' : b.message;
+            row.innerHTML = `
+                <td>${b.id}</td>
+                <td></td>
+                <td><span class="badge bg-${broadcastBadge(b.status)}">${b.status}</span></td>
+                <td>${b.sent}</td>
+                <td>${b.failed}</td>
+                <td>${b.total}</td>
+                <td></td>
+            `;
+            row.children[1].textContent = message;
+            if (b.status !== 'running' && (b.status !== 'completed' || b.failed > 0)) {
+                const button = document.createElement('button');
+                button.className = 'btn btn-sm btn-outline-warning';
+                button.innerHTML = '<i class="fas fa-redo"></i>';
+                button.title = 'Retomar';
+                button.addEventListener('click', () => resumeBroadcast(b.id));
+                row.children[6].appendChild(button);
+            }
+            table.appendChild(row);
+        });
+
+        // Keep polling while a campaign is sending
+        if (data.broadcasts.some(b => b.status === 'running' || b.status === 'pending')) {
+            setTimeout(loadBroadcasts, 5000);
+        }
+    })
+    .catch(error => console.error('Error:', error));
+}
+
+function broadcastBadge(status) {
+    return {
+        completed: 'success',
+        running: 'info',
+        pending: 'secondary',
+        interrupted: 'warning',
+        failed: 'danger'
+    }[status] || 'secondary';
+}
+
+function resumeBroadcast(broadcastId) {
+    fetch(`/api/broadcasts/${broadcastId}/resume`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ retry_failed: true })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            showAlert('Campanha retomada!', 'success');
+            loadBroadcasts();
+        } else {
+            showAlert('Erro ao retomar campanha: ' + (data.error || 'Erro desconhecido'), 'danger');
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        showAlert('Erro ao retomar campanha. Tente novamente.', 'danger');
+    });
+}
+
 function editProduct(productId) {
     showAlert('Funcionalidade de edição será implementada em breve.', 'info');
 }
@@ -0,0 +1,361 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import event, select, insert, update, delete, func, inspect
+from sqlalchemy.orm import Session
+from app import db
+from models import Conversation, Message, Order, Product, StatCounter
+from catalog import catalog_cache
+
+# Counter deltas are buffered per process and written on this interval
+STATS_FLUSH_INTERVAL = float(os.environ.get("STATS_FLUSH_INTERVAL", "2"))
+# How often one worker recomputes the counters from the base tables (0 disables)
+STATS_RECONCILE_INTERVAL = int(os.environ.get("STATS_RECONCILE_INTERVAL", "3600"))
+STATS_RECONCILE_HOURS = int(os.environ.get("STATS_RECONCILE_HOURS", "48"))
+STATS_ACTIVE_MINUTES = int(os.environ.get("STATS_ACTIVE_MINUTES", "30"))
+
+RECONCILE_LEASE_KEY = 'reconcile:lease'
+# Unix time the last reconcile started counting; deltas written before it are already counted
+RECONCILED_AT_KEY = 'reconcile:at'
+
+
+def hour_key(timestamp):
+    return f"messages:hour:{(timestamp or datetime.utcnow()):%Y-%m-%dT%H}"
+
+
+def product_revenue(product_id, session):
+    """Return (price, category_id) for a product, from the catalog cache when possible"""
+    snapshot = catalog_cache.peek()
+    product = snapshot.products.get(product_id) if snapshot else None
+    if product is None:
+        product = session.get(Product, product_id)
+    if product is None:
+        return 0.0, None
+    return product.price, product.category_id
+
+
+def order_deltas(deltas, product_id, status, sign, session):
+    """Add the counters of one order (sign -1 removes them)"""
+    deltas['orders'] += sign
+    deltas[f'orders:status:{status}'] += sign
+    if status != 'cancelled':
+        price, category_id = product_revenue(product_id, session)
+        deltas[f'revenue:product:{product_id}'] += sign * price
+        if category_id is not None:
+            deltas[f'revenue:category:{category_id}'] += sign * price
+
+
+def message_deltas(deltas, rows):
+    """Add counters for Message rows given as dicts (bulk inserts)"""
+    for row in rows:
+        deltas['messages'] += 1
+        deltas[hour_key(row.get('timestamp'))] += 1
+
+
+class StatsBuffer:
+    """Per-process counter deltas flushed to StatCounter by a background thread
+
+    Deltas are kept with the time their rows were written, taken while the
+    transaction still held its locks, so that a flush can drop those a
+    reconcile in another worker has already counted. On SQLite writers and the
+    reconcile are serialized by the database lock and nothing is counted
+    twice. On PostgreSQL the counts run under READ COMMITTED: a transaction
+    that wrote before the reconcile started but commits after one of its
+    counts is missed, and one written after the start that commits before a
+    later count is counted twice. Either error is limited to the commits made
+    while the counts run and is corrected by the next reconcile.
+    """
+
+    def __init__(self, interval=STATS_FLUSH_INTERVAL):
+        self.app = None
+        self.interval = interval
+        # (time written, Counter) in the order they were added
+        self._deltas = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def init_app(self, app):
+        self.app = app
+        atexit.register(self.stop)
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="stats-writer", daemon=True)
+            self._thread.start()
+
+    def add(self, deltas, written_at=None):
+        if not deltas:
+            return
+        self._ensure_started()
+        with self._lock:
+            self._deltas.append((written_at or time.time(), deltas))
+
+    def _run(self):
+        last_reconcile = time.monotonic()
+        while not self._stop.wait(self.interval):
+            self.flush()
+            if STATS_RECONCILE_INTERVAL and time.monotonic() - last_reconcile >= STATS_RECONCILE_INTERVAL:
+                last_reconcile = time.monotonic()
+                try:
+                    with self.app.app_context():
+                        reconcile_stats(lease=True)
+                except Exception as e:
+                    logging.error(f"Error reconciling stats: {str(e)}")
+
+    def take(self):
+        with self._lock:
+            slots, self._deltas = self._deltas, []
+        return slots
+
+    def put_back(self, slots):
+        with self._lock:
+            self._deltas[:0] = slots
+
+    def flush(self):
+        """Write pending deltas not already counted by a reconcile"""
+        slots = self.take()
+        if not slots or self.app is None:
+            return
+        try:
+            with self.app.app_context():
+                # FOR SHARE: a reconcile in progress holds this row until it commits
+                reconciled_at = db.session.execute(
+                    select(StatCounter.value).where(StatCounter.key == RECONCILED_AT_KEY).with_for_update(read=True)
+                ).scalar() or 0
+                deltas = Counter()
+                for written_at, slot in slots:
+                    if written_at > reconciled_at:
+                        deltas.update(slot)
+                deltas = {k: v for k, v in deltas.items() if v}
+                if deltas:
+                    apply_deltas(db.session, deltas)
+                db.session.commit()
+        except Exception as e:
+            logging.error(f"Error writing stats: {str(e)}")
+            self.put_back(slots)
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+
+stats_buffer = StatsBuffer()
+
+
+def upsert_statement(session, key, delta):
+    """INSERT ... ON CONFLICT DO UPDATE adding delta to a counter"""
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    stmt = dialect_insert(StatCounter).values(key=key, value=delta, updated_at=datetime.utcnow())
+    return stmt.on_conflict_do_update(
+        index_elements=[StatCounter.key],
+        set_={'value': StatCounter.value + stmt.excluded.value, 'updated_at': stmt.excluded.updated_at},
+    )
+
+
+def apply_deltas(session, deltas):
+    """Add deltas to the stored counters"""
+    for key in sorted(deltas):  # fixed order avoids deadlocks between workers
+        stmt = upsert_statement(session, key, deltas[key])
+        if stmt is not None:
+            session.execute(stmt)
+            continue
+        result = session.execute(
+            update(StatCounter).where(StatCounter.key == key).values(value=StatCounter.value + deltas[key])
+        )
+        if result.rowcount == 0:
+            session.execute(insert(StatCounter).values(key=key, value=deltas[key]))
+
+
+def record_messages(rows, written_at=None):
+    """Count Message rows written with bulk inserts, after they committed"""
+    deltas = Counter()
+    message_deltas(deltas, rows)
+    stats_buffer.add(deltas, written_at)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_deltas(session, flush_context):
+    deltas = session.info.setdefault('stat_deltas', Counter())
+    # The rows are written but not committed, so a reconcile cannot have started in between
+    session.info['stat_written_at'] = time.time()
+    for obj in session.new:
+        if isinstance(obj, Message):
+            deltas['messages'] += 1
+            deltas[hour_key(obj.timestamp)] += 1
+        elif isinstance(obj, Conversation):
+            deltas['conversations'] += 1
+        elif isinstance(obj, Order):
+            order_deltas(deltas, obj.product_id, obj.status or 'pending', 1, session)
+    for obj in session.dirty:
+        if isinstance(obj, Order):
+            history = inspect(obj).attrs.status.history
+            if history.deleted and history.added:
+                order_deltas(deltas, obj.product_id, history.deleted[0], -1, session)
+                order_deltas(deltas, obj.product_id, history.added[0], 1, session)
+    for obj in session.deleted:
+        if isinstance(obj, Order):
+            order_deltas(deltas, obj.product_id, obj.status, -1, session)
+        elif isinstance(obj, Conversation):
+            deltas['conversations'] -= 1
+        elif isinstance(obj, Message):
+            deltas['messages'] -= 1
+
+
+@event.listens_for(Session, 'after_commit')
+def _buffer_committed_deltas(session):
+    deltas = session.info.pop('stat_deltas', None)
+    written_at = session.info.pop('stat_written_at', None)
+    if deltas:
+        stats_buffer.add(deltas, written_at)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_rolled_back_deltas(session):
+    session.info.pop('stat_deltas', None)
+    session.info.pop('stat_written_at', None)
+
+
+def take_lease(session, interval, key=RECONCILE_LEASE_KEY):
+    """Let only one worker run a periodic job per interval, using a counter row as the lease"""
+    now = time.time()
+    result = session.execute(
+        update(StatCounter)
+        .where(StatCounter.key == key, StatCounter.value < now - interval)
+        .values(value=now)
+    )
+    if result.rowcount == 0:
+        exists = session.execute(select(StatCounter.key).where(StatCounter.key == key)).first()
+        if exists:
+            session.rollback()
+            return False
+        session.execute(insert(StatCounter).values(key=key, value=now))
+    session.commit()
+    return True
+
+
+def mark_reconciled(session):
+    """Lock the reconcile mark, then set it to the current time and return it"""
+    mark = update(StatCounter).where(StatCounter.key == RECONCILED_AT_KEY)
+    # The time is read once the lock is held, so no flush (and on SQLite no write)
+    # can commit between the mark and the counts
+    if session.execute(mark.values(value=StatCounter.value)).rowcount == 0:
+        session.execute(insert(StatCounter).values(key=RECONCILED_AT_KEY, value=0))
+    at = time.time()
+    session.execute(mark.values(value=at))
+    return at
+
+
+def reconcile_stats(lease=False):
+    """Recompute the counters from the base tables"""
+    session = db.session
+    if lease and not take_lease(session, STATS_RECONCILE_INTERVAL * 0.9):
+        return False
+    stats_buffer.flush()
+
+    # Taken first and held until the commit, so flushes in other workers wait
+    # for this reconcile and then drop what it counted
+    mark_reconciled(session)
+    counters = Counter()
+    counters['conversations'] = session.execute(select(func.count(Conversation.id))).scalar()
+    counters['messages'] = session.execute(select(func.count(Message.id))).scalar()
+
+    for status, count in session.execute(select(Order.status, func.count(Order.id)).group_by(Order.status)):
+        counters['orders'] += count
+        counters[f'orders:status:{status}'] = count
+
+    revenue = session.execute(
+        select(Order.product_id, Product.category_id, func.sum(Product.price))
+        .join(Product, Product.id == Order.product_id)
+        .where(Order.status != 'cancelled')
+        .group_by(Order.product_id, Product.category_id)
+    )
+    for product_id, category_id, total in revenue:
+        counters[f'revenue:product:{product_id}'] = total
+        counters[f'revenue:category:{category_id}'] += total
+
+    since = (datetime.utcnow() - timedelta(hours=STATS_RECONCILE_HOURS)).replace(minute=0, second=0, microsecond=0)
+    for (timestamp,) in session.execute(
+        select(Message.timestamp).where(Message.timestamp >= since).execution_options(yield_per=5000)
+    ):
+        counters[hour_key(timestamp)] += 1
+
+    # Replace everything except hour buckets older than the recount window and the leases
+    session.execute(
+        delete(StatCounter)
+        .where(~StatCounter.key.endswith(':lease'), StatCounter.key != RECONCILED_AT_KEY)
+        .where((~StatCounter.key.startswith('messages:hour:')) | (StatCounter.key >= hour_key(since)))
+    )
+    now = datetime.utcnow()
+    session.execute(insert(StatCounter), [
+        {'key': key, 'value': value, 'updated_at': now} for key, value in counters.items()
+    ])
+    session.commit()
+    logging.info(f"Reconciled {len(counters)} stat counters")
+    return True
+
+
+def get_stats(hours=24, active_minutes=STATS_ACTIVE_MINUTES):
+    """Dashboard numbers from the counters, independent of history size"""
+    session = db.session
+    now = datetime.utcnow()
+    first_hour = hour_key(now - timedelta(hours=hours - 1))
+    rows = session.execute(
+        select(StatCounter.key, StatCounter.value)
+        .where((~StatCounter.key.startswith('messages:hour:')) | (StatCounter.key >= first_hour))
+    ).all()
+    counters = {key: value for key, value in rows}
+
+    snapshot = catalog_cache.peek()
+    names = {}
+    if snapshot:
+        names = {('product', p.id): p.name for p in snapshot.products.values()}
+        names.update({('category', c.id): c.name for c in snapshot.categories.values()})
+
+    def grouped(prefix, kind=None):
+        items = []
+        for key, value in counters.items():
+            if key.startswith(prefix):
+                ident = key[len(prefix):]
+                item = {'id': int(ident) if ident.isdigit() else ident, 'value': round(value, 2)}
+                if kind:
+                    item['name'] = names.get((kind, item['id']))
+                items.append(item)
+        return sorted(items, key=lambda item: str(item['id']))
+
+    # Served by the last_message_at index: proportional to active sessions, not history
+    active = session.execute(
+        select(func.count(Conversation.id))
+        .where(Conversation.last_message_at >= now - timedelta(minutes=active_minutes))
+    ).scalar()
+
+    return {
+        'conversations': int(counters.get('conversations', 0)),
+        'orders': int(counters.get('orders', 0)),
+        'orders_by_status': {item['id']: int(item['value']) for item in grouped('orders:status:')},
+        'revenue_by_product': grouped('revenue:product:', 'product'),
+        'revenue_by_category': grouped('revenue:category:', 'category'),
+        'messages': int(counters.get('messages', 0)),
+        'messages_per_hour': [
+            {'hour': item['id'], 'count': int(item['value'])} for item in grouped('messages:hour:')
+        ],
+        'active_conversations': active,
+        'active_minutes': active_minutes,
+    }
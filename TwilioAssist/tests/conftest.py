@@ -0,0 +1,49 @@
+"""Shared fixtures: the app on a fresh SQLite file and the fake Twilio server.
+
+    python -m pytest
+"""
+import os
+import sys
+import tempfile
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+sys.path.insert(0, os.path.join(APP_DIR, 'benchmarks'))
+
+# Settings are read when the modules are imported, so before any test imports them
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+# Admission control is off unless a test builds its own limiter
+os.environ["PHONE_RATE_PER_MINUTE"] = "0"
+os.environ["GLOBAL_RATE_PER_SECOND"] = "0"
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import create_app, init_db
+    app = create_app()
+    with app.app_context():
+        init_db()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def fake_twilio():
+    """Start a fake Twilio API with the given options; stopped after the test"""
+    from fake_twilio import start_fake_twilio
+    servers = []
+
+    def start(**kwargs):
+        server = start_fake_twilio(**kwargs)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,64 @@
+import pytest
+from sqlalchemy import event
+import admission
+from admission import ADMITTED, THROTTLED, STILL_THROTTLED, OVERLOADED, MemoryLimiter
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    """Install a memory limiter with the given buckets for one test"""
+    def install(phone_rate=0, phone_burst=0, global_rate=0, global_burst=0):
+        limiter = MemoryLimiter(phone_rate, phone_burst, global_rate, global_burst)
+        monkeypatch.setattr(admission.admission, '_limiter', limiter)
+        return limiter
+    return install
+
+
+@pytest.fixture
+def statements(app):
+    """SQL statements run by the app while the test runs"""
+    from app import db
+    with app.app_context():
+        engine = db.engine
+    ran = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        ran.append(statement)
+    event.listen(engine, 'before_cursor_execute', record)
+    yield ran
+    event.remove(engine, 'before_cursor_execute', record)
+
+
+def post(client, phone, body, message_sid):
+    response = client.post('/webhook', data={'From': f'whatsapp:{phone}', 'Body': body, 'MessageSid': message_sid})
+    assert response.status_code == 200
+    return response.get_data()
+
+
+def test_overload_keeps_the_numbers_tokens():
+    limiter = MemoryLimiter(1 / 3600, 2, 1e-9, 1)
+    assert [limiter.check('+1') for _ in range(3)] == [ADMITTED, OVERLOADED, OVERLOADED]
+    # The overloaded attempts gave their phone tokens back
+    limiter.total = None
+    assert [limiter.check('+1') for _ in range(3)] == [ADMITTED, THROTTLED, STILL_THROTTLED]
+
+
+def test_rejected_messages_run_no_sql(client, limiter, statements):
+    limiter(phone_rate=1 / 3600, phone_burst=1)
+    post(client, '+5511911110001', 'oi', 'SMadmit0000000000000000000000001')
+
+    statements.clear()
+    throttled = post(client, '+5511911110001', 'oi', 'SMadmit0000000000000000000000002')
+    ignored = post(client, '+5511911110001', 'oi', 'SMadmit0000000000000000000000003')
+    assert b'<Message>' in throttled
+    assert b'<Message>' not in ignored
+    assert statements == []
+
+
+def test_redelivery_gets_its_reply_while_throttled(client, limiter, statements):
+    limiter(phone_rate=1 / 3600, phone_burst=1)
+    reply = post(client, '+5511911110002', 'oi', 'SMadmit0000000000000000000000004')
+
+    statements.clear()
+    assert post(client, '+5511911110002', 'oi', 'SMadmit0000000000000000000000004') == reply
+    assert statements == []
@@ -0,0 +1,46 @@
+import threading
+from sqlalchemy import select, func
+from app import db
+from models import Conversation, Order
+
+SETUP = ["oi", "1", "1"]
+
+
+def post(client, phone, body, sid):
+    response = client.post('/webhook', data={'From': f'whatsapp:{phone}', 'Body': body, 'MessageSid': sid})
+    assert response.status_code == 200
+    assert b'ocorreu um erro' not in response.get_data()
+
+
+def conversation_state(phone):
+    conversation = db.session.execute(select(Conversation).where(Conversation.phone_number == phone)).scalar_one()
+    orders = db.session.execute(select(func.count(Order.id)).where(Order.phone_number == phone)).scalar()
+    return conversation.current_state, conversation.customer_name, orders, conversation.version
+
+
+def test_two_writers_on_one_number_lose_no_update(app):
+    phone = '+5511911110008'
+    for step, body in enumerate(SETUP):
+        post(app.test_client(), phone, body, f'SMrace{step}')
+
+    # Both messages are "1", so either order ends in the same state
+    barrier = threading.Barrier(2)
+    errors = []
+
+    def writer(k):
+        client = app.test_client()
+        barrier.wait()
+        try:
+            post(client, phone, "1", f'SMraceburst{k}')
+        except AssertionError as e:
+            errors.append(e)
+    threads = [threading.Thread(target=writer, args=(k,)) for k in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with app.app_context():
+        # The first "1" confirms the purchase and the second is taken as the customer's name
+        assert conversation_state(phone) == ('main_menu', '1', 1, len(SETUP) + 2)
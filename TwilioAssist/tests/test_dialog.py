@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+from flows import Session
+from dialog import INVALID_MAIN_MENU, INVALID_PRODUCT_NUMBER, chat_engine
+
+PRODUCT = SimpleNamespace(id=7, category_id=1)
+
+
+class Services:
+    """Catalog with one product matching 'ebook'; searches are recorded"""
+
+    def __init__(self):
+        self.queries = []
+
+    def search_products(self, query):
+        self.queries.append(query)
+        return [PRODUCT] if 'ebook' in query else []
+
+    def search_text(self, query, products):
+        return f"busca:{query}:{len(products)}"
+
+    def product_text(self, product_id):
+        return f"produto:{product_id}"
+
+
+def test_superscript_digit_in_search_results_is_searched():
+    services = Services()
+    step = chat_engine.dispatch(Session('search_results', None, None, None, 'ebook'), '²', services=services)
+    assert step.reply == 'busca:²:0'
+    assert services.queries == ['²']
+
+
+def test_search_result_is_chosen_by_number():
+    services = Services()
+    step = chat_engine.dispatch(Session('search_results', None, None, None, 'ebook'), '1', services=services)
+    assert step.state == 'product_details'
+    assert step.reply == 'produto:7'
+    step = chat_engine.dispatch(Session('search_results', None, None, None, 'ebook'), '9', services=services)
+    assert step.reply == INVALID_PRODUCT_NUMBER
+
+
+def test_superscript_digit_in_main_menu_is_searched():
+    services = Services()
+    step = chat_engine.dispatch(Session('main_menu', None, None, None), '²', services=services)
+    assert step.reply == INVALID_MAIN_MENU
+    assert services.queries == ['²']
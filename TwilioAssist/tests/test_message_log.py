@@ -0,0 +1,27 @@
+import pytest
+from sqlalchemy.orm import Session
+import message_log
+from message_log import MESSAGE_LOG_DROPPED, MessageLogWriter, _enqueue_committed_messages
+
+
+def dropped(reason):
+    return dict(MESSAGE_LOG_DROPPED.snapshot()).get((reason,), 0)
+
+
+def test_full_queue_drops_rows_without_writing(app, monkeypatch):
+    writer = MessageLogWriter(maxsize=2)
+    monkeypatch.setattr(writer, '_ensure_started', lambda: None)
+
+    def write(rows):
+        pytest.fail("rows were written on the committing thread")
+    monkeypatch.setattr(writer, '_write', write)
+    monkeypatch.setattr(message_log, 'message_log', writer)
+
+    session = Session()
+    session.info['queued_messages'] = [{'phone_number': '+5511911110003', 'message_body': str(i)} for i in range(5)]
+    before = dropped('queue_full')
+    _enqueue_committed_messages(session)
+
+    assert writer._queue.qsize() == 2
+    assert dropped('queue_full') - before == 3
+    assert 'queued_messages' not in session.info
@@ -0,0 +1,38 @@
+from sqlalchemy import select, func
+from app import db
+from models import Conversation, StatCounter
+from stats import stats_buffer, reconcile_stats
+
+
+def counted_conversations():
+    return db.session.execute(select(StatCounter.value).where(StatCounter.key == 'conversations')).scalar()
+
+
+def stored_conversations():
+    return db.session.execute(select(func.count(Conversation.id))).scalar()
+
+
+def add_conversation(phone_number):
+    db.session.add(Conversation(phone_number=phone_number))
+    db.session.commit()
+
+
+def test_deltas_written_before_a_reconcile_are_not_counted_twice(app):
+    with app.app_context():
+        add_conversation('+5511911110004')
+        # Still buffered in another worker when the reconcile counts the row
+        pending = stats_buffer.take()
+        reconcile_stats()
+        stats_buffer.put_back(pending)
+        stats_buffer.flush()
+
+        assert counted_conversations() == stored_conversations()
+
+
+def test_deltas_written_after_a_reconcile_are_kept(app):
+    with app.app_context():
+        reconcile_stats()
+        add_conversation('+5511911110005')
+        stats_buffer.flush()
+
+        assert counted_conversations() == stored_conversations()
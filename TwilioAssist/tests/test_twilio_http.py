@@ -0,0 +1,57 @@
+import time
+import asyncio
+import pytest
+import requests
+from twilio_async_http import AsyncPooledTwilioHttpClient
+from twilio_http import PooledTwilioHttpClient
+
+MESSAGES_URL = "https://api.twilio.com/2010-04-01/Accounts/AC00000000000000000000000000000000/Messages.json"
+
+
+def send_async(request_timeout=None, **options):
+    """POST a message with an AsyncPooledTwilioHttpClient built inside a fresh event loop"""
+    async def send():
+        client = AsyncPooledTwilioHttpClient(**options)
+        try:
+            return await client.request('POST', MESSAGES_URL, data={'To': 'whatsapp:+5511999990000', 'Body': 'oi'},
+                                        timeout=request_timeout)
+        finally:
+            await client.close()
+    return asyncio.run(send())
+
+
+def test_async_client_times_out_on_a_slow_endpoint(fake_twilio):
+    server = fake_twilio(latency=3)
+
+    start = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        send_async(timeout=0.3, max_retries=2, backoff=0, base_url=server.url)
+    # One attempt: a POST that timed out after it went out may have been accepted
+    assert time.perf_counter() - start < 0.9
+
+
+def test_async_client_honours_a_per_request_timeout(fake_twilio):
+    server = fake_twilio(latency=3)
+
+    start = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        send_async(request_timeout=0.3, timeout=None, max_retries=0, base_url=server.url)
+    assert time.perf_counter() - start < 0.9
+
+
+def test_async_client_sends_within_the_timeout(fake_twilio):
+    server = fake_twilio(latency=0.05)
+
+    response = send_async(timeout=2, base_url=server.url)
+    assert response.status_code == 201
+    assert server.messages[-1]['Body'] == 'oi'
+
+
+def test_sync_client_times_out_on_a_slow_endpoint(fake_twilio):
+    server = fake_twilio(latency=3)
+    client = PooledTwilioHttpClient(timeout=0.3, max_retries=2, backoff=0, base_url=server.url)
+
+    start = time.perf_counter()
+    with pytest.raises(requests.Timeout):
+        client.request('POST', MESSAGES_URL, data={'Body': 'oi'})
+    assert time.perf_counter() - start < 0.9
@@ -0,0 +1,51 @@
+import random
+import pytest
+from twilio.twiml.messaging_response import MessagingResponse
+from catalog import CachedCategory, CachedProduct, render_category, render_product
+from dialog import STATIC_REPLIES, process_donation_payment
+from twiml import EMPTY_RESPONSE, STATIC_RESPONSES, message_response, render_message
+
+AWKWARD = [
+    "", " ", "a", "\n", "R&D <b>bold</b> > less", "&amp; already escaped", "\"quotes\" and 'apostrophes'",
+    "]]>", "tab\there\r\nwindows", "\x0b\x0c", "emoji 🚀🙏💰 and accents ção", "<![CDATA[x]]>",
+    "ends with &", "<" * 50, "x" * 5000,
+]
+ALPHABET = "abc XYZ 123 &<>\"'\n\t\r;#ç🚀💰éü*_~"
+
+PRODUCT = CachedProduct(1, "Ebook: R&D <Avançado>", "Guia \"completo\" & prático", 19.9, 1, "Ebooks & Cursos")
+CATALOG_REPLIES = [
+    render_category(CachedCategory(1, "Ebooks & Cursos", None, (PRODUCT,))),
+    render_category(CachedCategory(2, "Vazia <nenhum>", None, ())),
+    render_product(PRODUCT),
+    process_donation_payment("Ana & <Bia>", "12.50", "Contribuição Personalizada 💰"),
+]
+
+
+def twilio_response(text=None):
+    """What twilio's MessagingResponse sends, encoded"""
+    response = MessagingResponse()
+    if text is not None:
+        response.message(text)
+    return str(response).encode()
+
+
+def random_texts(count, seed=1):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 200))) for _ in range(count)]
+
+
+@pytest.mark.parametrize('text', list(STATIC_REPLIES) + AWKWARD + CATALOG_REPLIES + random_texts(200))
+def test_message_bytes_match_messaging_response(text):
+    expected = twilio_response(text)
+    assert message_response(text) == expected
+    assert render_message(text) == expected
+
+
+def test_static_responses_match_messaging_response():
+    assert set(STATIC_RESPONSES) == set(STATIC_REPLIES)
+    for text, body in STATIC_RESPONSES.items():
+        assert body == twilio_response(text)
+
+
+def test_empty_response_matches_messaging_response():
+    assert EMPTY_RESPONSE == twilio_response()
@@ -0,0 +1,90 @@
+import asyncio
+import time
+import logging
+from urllib.parse import urlsplit
+from aiohttp import BasicAuth, ClientConnectorError, ClientError, ClientSession, ClientTimeout, ConnectionTimeoutError, TCPConnector
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+from twilio.http.response import Response
+from twilio_http import SAFE_RETRY_METHODS, PooledTwilioHttpClient
+from twilio_client import (
+    TWILIO_HTTP_TIMEOUT, TWILIO_ASYNC_POOL_SIZE, TWILIO_MAX_RETRIES, TWILIO_RETRY_BACKOFF,
+    TWILIO_API_BASE_URL, OutboundStats,
+)
+
+
+class AsyncPooledTwilioHttpClient(AsyncTwilioHttpClient):
+    """aiohttp counterpart of PooledTwilioHttpClient for the ASGI app; create it inside the event loop"""
+
+    _rewrite = PooledTwilioHttpClient._rewrite
+    _delay = PooledTwilioHttpClient._delay
+    _retry_status = PooledTwilioHttpClient._retry_status
+
+    def __init__(self, timeout=TWILIO_HTTP_TIMEOUT, pool_size=TWILIO_ASYNC_POOL_SIZE,
+                 max_retries=TWILIO_MAX_RETRIES, backoff=TWILIO_RETRY_BACKOFF, base_url=TWILIO_API_BASE_URL):
+        super().__init__(pool_connections=False, timeout=timeout)
+        # One keep-alive pool per process; pool_size caps the sends in flight
+        self.session = ClientSession(connector=TCPConnector(limit=pool_size))
+        self.client_timeout = self._client_timeout(timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.base_url = urlsplit(base_url) if base_url else None
+        self.stats = OutboundStats()
+
+    @staticmethod
+    def _client_timeout(timeout):
+        # sock_connect makes a connect timeout distinguishable from one after the request went out
+        return ClientTimeout(total=timeout, sock_connect=timeout)
+
+    async def _send(self, method, url, params=None, data=None, headers=None, auth=None, timeout=None,
+                    allow_redirects=False):
+        """One attempt, made as AsyncTwilioHttpClient.request makes it
+
+        That method hands its timeout to aiohttp even when it is None, which
+        replaces the session's timeout with none at all; here None means the
+        client's own.
+        """
+        kwargs = {
+            "method": method.upper(),
+            "url": url,
+            "params": params,
+            "data": data,
+            "headers": headers,
+            "auth": BasicAuth(login=auth[0], password=auth[1]) if auth is not None else None,
+            "timeout": self.client_timeout if timeout is None else self._client_timeout(timeout),
+            "allow_redirects": allow_redirects,
+        }
+        self.log_request(kwargs)
+        async with self.session.request(**kwargs) as response:
+            self.log_response(response.status, response)
+            self._test_only_last_response = Response(response.status, await response.text(), response.headers)
+        return self._test_only_last_response
+
+    def _retry_error(self, method, error):
+        return method.upper() in SAFE_RETRY_METHODS or isinstance(error, (ClientConnectorError, ConnectionTimeoutError))
+
+    async def request(self, method, url, *args, **kwargs):
+        url = self._rewrite(url)
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                response = await self._send(method, url, *args, **kwargs)
+            except (ClientError, asyncio.TimeoutError) as e:
+                if attempt >= self.max_retries or not self._retry_error(method, e):
+                    self.stats.record(time.perf_counter() - start, attempt, failed=True)
+                    raise
+                delay = self._delay(attempt)
+                logging.warning(f"Twilio request failed ({e!r}), retrying in {delay:.2f}s")
+            else:
+                if attempt >= self.max_retries or not self._retry_status(method, response):
+                    elapsed = time.perf_counter() - start
+                    self.stats.record(elapsed, attempt, failed=response.status_code >= 400)
+                    logging.debug("Twilio %s %s in %.1fms (%d retries)", method, response.status_code, elapsed * 1000, attempt)
+                    return response
+                delay = self._delay(attempt, response)
+                logging.warning(f"Twilio returned {response.status_code}, retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def close(self):
+        await self.session.close()
@@ -0,0 +1,101 @@
+import os
+import threading
+from collections import deque
+from metrics import record_twilio_request
+
+TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID")
+TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN")
+
+# Outbound HTTP settings
+TWILIO_HTTP_TIMEOUT = float(os.environ.get("TWILIO_HTTP_TIMEOUT", "10"))
+TWILIO_POOL_SIZE = int(os.environ.get("TWILIO_POOL_SIZE", "10"))
+# Connections, and so sends in flight, of the ASGI app's aiohttp client
+TWILIO_ASYNC_POOL_SIZE = int(os.environ.get("TWILIO_ASYNC_POOL_SIZE", "100"))
+TWILIO_MAX_RETRIES = int(os.environ.get("TWILIO_MAX_RETRIES", "3"))
+TWILIO_RETRY_BACKOFF = float(os.environ.get("TWILIO_RETRY_BACKOFF", "0.5"))
+# Longest Retry-After honored; the wait holds the sending thread
+TWILIO_MAX_RETRY_AFTER = float(os.environ.get("TWILIO_MAX_RETRY_AFTER", "5"))
+# Point the client at a local stand-in, e.g. http://127.0.0.1:8099
+TWILIO_API_BASE_URL = os.environ.get("TWILIO_API_BASE_URL")
+
+class OutboundStats:
+    """Thread-safe counters for outbound Twilio requests"""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+
+    def record(self, seconds, retries, failed):
+        record_twilio_request(seconds, retries, failed)
+        with self._lock:
+            self.requests += 1
+            self.retries += retries
+            self.failures += 1 if failed else 0
+            self.total_seconds += seconds
+            self._latencies.append(seconds)
+
+    def snapshot(self):
+        """Return the counters and recent latency percentiles in milliseconds"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            data = {
+                'requests': self.requests,
+                'retries': self.retries,
+                'failures': self.failures,
+                'avg_ms': self.total_seconds / self.requests * 1000 if self.requests else 0.0,
+            }
+        for name, q in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+            data[name] = latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000 if latencies else 0.0
+        return data
+
+
+_client = None
+_client_lock = threading.Lock()
+_async_client = None
+
+
+def get_client():
+    """Return the process-wide Twilio client, or None if Twilio is not configured"""
+    global _client
+    if _client is None and TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
+        with _client_lock:
+            if _client is None:
+                # requests and the Twilio SDK load on first use, not at worker start
+                from twilio.rest import Client
+                from twilio_http import PooledTwilioHttpClient
+                _client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=PooledTwilioHttpClient())
+    return _client
+
+
+def get_async_client():
+    """Return the ASGI app's Twilio client (see open_async_client), or None if Twilio is not configured"""
+    return _async_client
+
+
+def open_async_client():
+    """Create the aiohttp-backed Twilio client; call from the running event loop"""
+    global _async_client
+    if _async_client is None and TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN:
+        from twilio.rest import Client
+        from twilio_async_http import AsyncPooledTwilioHttpClient
+        _async_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=AsyncPooledTwilioHttpClient())
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    client, _async_client = _async_client, None
+    if client is not None:
+        await client.http_client.close()
+
+
+def get_stats():
+    """Return outbound request stats for this process"""
+    client = _client or _async_client
+    if client is None:
+        return OutboundStats().snapshot()
+    return client.http_client.stats.snapshot()
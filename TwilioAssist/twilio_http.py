@@ -0,0 +1,93 @@
+import time
+import logging
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError
+from twilio.http.http_client import TwilioHttpClient
+from twilio_client import (
+    TWILIO_HTTP_TIMEOUT, TWILIO_POOL_SIZE, TWILIO_MAX_RETRIES, TWILIO_RETRY_BACKOFF,
+    TWILIO_MAX_RETRY_AFTER, TWILIO_API_BASE_URL, OutboundStats,
+)
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+# A POST (e.g. sending a message) may have been accepted before a 5xx or a
+# dropped connection, and retrying it would send the message twice; it is only
+# retried when Twilio refused it outright or it never left this process
+SAFE_RETRY_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+
+def connect_failed(error):
+    """True when a requests error happened before the request was written"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.ConnectionError) or not error.args:
+        return False
+    # requests wraps urllib3's MaxRetryError, whose reason is the connect error
+    # (NewConnectionError and NameResolutionError are ConnectTimeoutErrors)
+    reason = getattr(error.args[0], 'reason', error.args[0])
+    return isinstance(reason, ConnectTimeoutError)
+
+
+class PooledTwilioHttpClient(TwilioHttpClient):
+    """Keep-alive HTTP client with retries on 429/5xx (POST: see SAFE_RETRY_METHODS) and latency stats"""
+
+    def __init__(self, timeout=TWILIO_HTTP_TIMEOUT, pool_size=TWILIO_POOL_SIZE,
+                 max_retries=TWILIO_MAX_RETRIES, backoff=TWILIO_RETRY_BACKOFF, base_url=TWILIO_API_BASE_URL):
+        super().__init__(pool_connections=True, timeout=timeout)
+        # Retries are handled here so they can be counted; urllib3 must not retry on its own
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.base_url = urlsplit(base_url) if base_url else None
+        self.stats = OutboundStats()
+
+    def _rewrite(self, url):
+        if self.base_url is None:
+            return url
+        return urlsplit(url)._replace(scheme=self.base_url.scheme, netloc=self.base_url.netloc).geturl()
+
+    def _delay(self, attempt, response=None):
+        if response is not None and response.status_code in (429, 503):
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), TWILIO_MAX_RETRY_AFTER)
+        return self.backoff * (2 ** attempt)
+
+    def _retry_status(self, method, response):
+        """Whether a response is worth another attempt"""
+        if response.status_code not in RETRY_STATUSES:
+            return False
+        if method.upper() in SAFE_RETRY_METHODS or response.status_code == 429:
+            return True
+        # 503 with Retry-After is Twilio turning the request away before handling it
+        return response.status_code == 503 and bool(response.headers.get('Retry-After'))
+
+    def _retry_error(self, method, error):
+        return method.upper() in SAFE_RETRY_METHODS or connect_failed(error)
+
+    def request(self, method, url, *args, **kwargs):
+        url = self._rewrite(url)
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= self.max_retries or not self._retry_error(method, e):
+                    self.stats.record(time.perf_counter() - start, attempt, failed=True)
+                    raise
+                delay = self._delay(attempt)
+                logging.warning(f"Twilio request failed ({e}), retrying in {delay:.2f}s")
+            else:
+                if attempt >= self.max_retries or not self._retry_status(method, response):
+                    elapsed = time.perf_counter() - start
+                    self.stats.record(elapsed, attempt, failed=response.status_code >= 400)
+                    logging.debug("Twilio %s %s in %.1fms (%d retries)", method, response.status_code, elapsed * 1000, attempt)
+                    return response
+                delay = self._delay(attempt, response)
+                logging.warning(f"Twilio returned {response.status_code}, retrying in {delay:.2f}s")
+            time.sleep(delay)
+            attempt += 1
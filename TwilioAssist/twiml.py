@@ -0,0 +1,38 @@
+from dialog import STATIC_REPLIES
+
+# Byte-for-byte what twilio's MessagingResponse produces for a single message,
+# as the UTF-8 body that goes on the wire
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>'
+EMPTY_MESSAGE = (XML_DECLARATION + '<Response><Message /></Response>').encode()
+# No reply at all
+EMPTY_RESPONSE = (XML_DECLARATION + '<Response />').encode()
+
+
+def escape(text):
+    """Escape element text the way ElementTree does"""
+    if '&' in text:
+        text = text.replace('&', '&amp;')
+    if '<' in text:
+        text = text.replace('<', '&lt;')
+    if '>' in text:
+        text = text.replace('>', '&gt;')
+    return text
+
+
+def render_message(text):
+    """TwiML replying with one message, encoded"""
+    if not text:
+        return EMPTY_MESSAGE
+    return f'{XML_DECLARATION}<Response><Message>{escape(text)}</Message></Response>'.encode()
+
+
+# Rendered and encoded once; most replies are one of these
+STATIC_RESPONSES = {text: render_message(text) for text in STATIC_REPLIES}
+
+
+def message_response(text):
+    """TwiML for a reply, from the precomputed table when the text is static"""
+    response = STATIC_RESPONSES.get(text)
+    if response is None:
+        response = render_message(text)
+    return response